@@ -24,6 +24,7 @@ __all__ = (
     'get_active_project',
     'get_api_version',
     'get_auth_status',
+    'get_catalog_entries',
     'get_collections',
     'get_data',
     'get_datasets',
@@ -58,6 +59,7 @@ __all__ = (
     'save_settings',
     'set_active_project',
     'search_catalog',
+    'search_keywords',
     'stage_for_download',
     'unauthenticate_provider',
     'update_metadata',
@@ -108,6 +110,8 @@ from .manage import (
 
 from .catalog import (
     search_catalog,
+    search_keywords,
+    get_catalog_entries,
     get_tags,
     new_catalog_entry,
 )
@@ -1,22 +1,31 @@
+import os
 import json
+import time
 import itertools
+from functools import partial
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import pandas as pd
 import numpy as np
+import geopandas as gpd
 import geojson
 from shapely.geometry import shape
 
 from .tasks import add_async
-from .metadata import get_metadata
+from .metadata import get_metadata, _get_catalog_metadata
 from .. import util
+from ..util.catalog_cache import metadata_to_records
 from ..plugins import load_providers
-from ..static import UriType
-from ..database.database import get_db, db_session, select_datasets
+from ..static import UriType, SearchStatus
+from ..database.database import get_db, db_session, query_datasets
 
 
 @add_async
 def search_catalog(uris=None, expand=False, as_dataframe=False, as_geojson=False,
-                   update_cache=False, filters=None, queries=None):
+                   update_cache=False, filters=None, queries=None, timeout=None,
+                   raise_on_error=True, return_status=False, limit=None, offset=0, cursor=None,
+                   stream=False, chunksize=1000, facets=None, use_global_index=False, tolerance=None):
     """Retrieve list of catalog entries from resources.
 
     Args:
@@ -37,21 +46,220 @@ def search_catalog(uris=None, expand=False, as_dataframe=False, as_geojson=False
                 available filters:
                     * `bbox` (string, optional): filter catalog_entries by bounding box
                     * `geom_type` (string, optional): filter catalog_entries by geom_type, i.e. point/line/polygon
-                    * `parameter` (string, optional): filter catalog_entries by parameter
+                    * `parameter` (string, optional): filter catalog_entries that have this exact parameter
                     * `display_name` (string, optional):  filter catalog_entries by display_name
                     * `description` (string, optional): filter catalog_entries by description
                     * `search_terms` (list, optional): filter catalog_entries by search_terms
+                    * `keywords` (list, optional): filter catalog_entries that contain all of the keywords
+                      as words or word prefixes (see `search_keywords`)
 
                 catalog_entries can also be filtered by any other metadata fields
 
         queries(list, Optional, Default=None):
             list of string arguments to pass to pandas.DataFrame.query to filter the catalog_entries
+        timeout (float, Optional, Default=None):
+            number of seconds to wait for each service. Services are searched concurrently and
+            services that do not respond in time are left out of the results (their search keeps
+            running in the background and still updates the cache).
+        raise_on_error (bool, Optional, Default=True):
+            if True, raise the error of the first service that failed or timed out, otherwise
+            leave it out of the results (see `return_status`)
+        return_status (bool, Optional, Default=False):
+            if True, also return the status of the search of each service
+        limit (int, Optional, Default=None):
+            maximum number of catalog entries to return
+        offset (int, Optional, Default=0):
+            number of catalog entries to skip (after `cursor`)
+        cursor (string, Optional, Default=None):
+            uri of the last catalog entry of the previous page. Only catalog entries after it are
+            returned. Unlike `offset`, pages stay consistent when entries are added or removed.
+        stream (bool, Optional, Default=False):
+            if True, return a generator that formats the results `chunksize` catalog entries at a time.
+            It yields catalog entry uris, geo-json features (with `as_geojson`) or a DataFrame
+            (with `as_dataframe`) or dict (with `expand`) for each chunk.
+        chunksize (int, Optional, Default=1000):
+            number of catalog entries to format at a time when streaming
+        facets (list, Optional, Default=None):
+            if given, also return the number of matching catalog entries (before pagination) with
+            each value of these fields: `parameter`, `geom_type`, any other catalog_entry field
+            (i.e. `service`) or metadata tag (see `get_tags`)
+        use_global_index (bool, Optional, Default=False):
+            if True, find the catalog entries of services with a cached catalog that match the
+            `bbox` and `parameter` filters in a single index of all cached catalogs, and only read
+            those entries from the service caches. If no `uris` are given all cached catalogs are searched.
+        tolerance (float, Optional, Default=None):
+            if given, use the geometries of catalogs of lines and polygons simplified to this tolerance
+            (in degrees) that are stored in the catalog caches, rather than the exact geometries. The
+            simplified geometries are used both to filter and to return catalog entries, which makes
+            searches and geojson output of detailed polygons faster and smaller.
 
     Returns:
         datasets (list, geo-json dict or pandas.DataFrame, Default=list):
              datasets of specified service(s), collection(s) or catalog_entry(s)
+        facets (dict):
+            only if `facets` is given, dict keyed by facet of dicts of the count of each value, from
+            the most to the least common value
+        status (dict):
+            only if `return_status` is True, dict keyed by service uri with the `status`
+            (see `quest.static.SearchStatus`), `message` and `elapsed` seconds of each service search
 
     """
+    catalog_entries, status = _search_catalog(uris, update_cache=update_cache, filters=filters, queries=queries,
+                                              timeout=timeout, raise_on_error=raise_on_error,
+                                              use_global_index=use_global_index, tolerance=tolerance)
+    if facets is not None:
+        facet_counts = _count_facets(catalog_entries, util.listify(facets), filters)
+
+    catalog_entries = _paginate(catalog_entries, limit=limit, offset=offset, cursor=cursor)
+
+    format_options = dict(expand=expand, as_dataframe=as_dataframe, as_geojson=as_geojson)
+    if stream:
+        catalog_entries = _stream_catalog_entries(catalog_entries, filters, chunksize=chunksize, **format_options)
+    else:
+        catalog_entries = _format_catalog_entries(catalog_entries, filters, **format_options)
+
+    result = (catalog_entries,)
+    if facets is not None:
+        result += (facet_counts,)
+    if return_status:
+        result += (status,)
+
+    return result if len(result) > 1 else catalog_entries
+
+
+@add_async
+def search_keywords(keywords, uris=None, prefix=True, match_all=True, limit=None, expand=False,
+                    as_dataframe=False, as_geojson=False, update_cache=False, filters=None, queries=None,
+                    timeout=None, raise_on_error=True, return_status=False, offset=0, cursor=None,
+                    stream=False, chunksize=1000):
+    """Search catalog entries by keywords and rank them by relevance.
+
+    Keywords are matched against the words of the display_name, description and metadata of
+    catalog entries using the token index that is kept with the catalog cache of each service,
+    so that columns are not scanned at query time.
+
+    Args:
+        keywords (string or list, Required):
+            keywords to search for. Keywords are split into words and matched case insensitively.
+        uris (string or list, Required):
+            uris of service_uris or collections
+        prefix (bool, Optional, Default=True):
+            if True, keywords also match words that start with the keyword (i.e. 'gage' matches 'gages')
+        match_all (bool, Optional, Default=True):
+            if True, only return catalog entries that match all of the keywords, otherwise
+            return catalog entries that match any of the keywords
+        limit (int, Optional, Default=None):
+            maximum number of catalog entries to return
+        expand (bool, Optional, Default=False):
+            if true then return metadata along with catalog entries
+        as_dataframe (bool, Optional, Default=False):
+           include catalog_entry details and format as a pandas DataFrame indexed by catalog_entry uris
+        as_geojson (bool, Optional, Default=False):
+            include catalog_entry details and format as a geojson scheme indexed by catalog_entry uris
+        update_cache (bool, Optional,Default=False):
+            if True, update metadata cache
+        filters (dict, Optional, Default=None):
+            additional filters (see `search_catalog`)
+        queries(list, Optional, Default=None):
+            list of string arguments to pass to pandas.DataFrame.query to filter the catalog_entries
+        timeout (float, Optional, Default=None):
+            number of seconds to wait for each service (see `search_catalog`)
+        raise_on_error (bool, Optional, Default=True):
+            if True, raise the error of the first service that failed or timed out
+        return_status (bool, Optional, Default=False):
+            if True, also return the status of the search of each service
+        offset (int, Optional, Default=0):
+            number of ranked catalog entries to skip (see `search_catalog`)
+        cursor (string, Optional, Default=None):
+            uri of the last catalog entry of the previous page (see `search_catalog`)
+        stream (bool, Optional, Default=False):
+            if True, return a generator of the results (see `search_catalog`)
+        chunksize (int, Optional, Default=1000):
+            number of catalog entries to format at a time when streaming
+
+    Returns:
+        catalog_entries (list, geo-json dict or pandas.DataFrame, Default=list):
+             matching catalog entries ordered from most to least relevant. Details include a `score` field.
+        status (dict):
+            only if `return_status` is True, the status of the search of each service (see `search_catalog`)
+    """
+    filters = dict(filters or {}, keywords=util.listify(keywords))
+    options = {'prefix': prefix, 'match_all': match_all}
+
+    catalog_entries, status = _search_catalog(uris, update_cache=update_cache, filters=filters, queries=queries,
+                                              timeout=timeout, raise_on_error=raise_on_error,
+                                              keyword_options=options)
+
+    if not catalog_entries.empty:
+        scores = _keyword_scores(filters['keywords'], filters, catalog_entries, np.arange(len(catalog_entries)),
+                                 **options)
+        # rank by score, ties are kept in uri order
+        order = np.argsort(-scores, kind='mergesort')
+        catalog_entries = catalog_entries.iloc[order].assign(score=scores[order])
+
+    catalog_entries = _paginate(catalog_entries, limit=limit, offset=offset, cursor=cursor)
+
+    format_options = dict(expand=expand, as_dataframe=as_dataframe, as_geojson=as_geojson)
+    if stream:
+        catalog_entries = _stream_catalog_entries(catalog_entries, filters, chunksize=chunksize, **format_options)
+    else:
+        catalog_entries = _format_catalog_entries(catalog_entries, filters, **format_options)
+
+    if return_status:
+        return catalog_entries, status
+
+    return catalog_entries
+
+
+@add_async
+def get_catalog_entries(uris, expand=False, as_dataframe=False, as_geojson=False, update_cache=False):
+    """Get catalog entries by uri.
+
+    Catalog entries are looked up by service id in the cached catalog of each service, so only
+    the requested entries are read and the catalogs are neither searched nor loaded in full.
+
+    Args:
+        uris (string, comma separated string, or list of strings, Required):
+            uris of the catalog entries to get
+        expand (bool, Optional, Default=False):
+            if true then return metadata along with catalog entries
+        as_dataframe (bool, Optional, Default=False):
+           include catalog_entry details and format as a pandas DataFrame indexed by catalog_entry uris
+        as_geojson (bool, Optional, Default=False):
+            include catalog_entry details and format as a geojson scheme indexed by catalog_entry uris
+        update_cache (bool, Optional,Default=False):
+            if True, update metadata cache
+
+    Returns:
+        catalog_entries (list, geo-json dict or pandas.DataFrame, Default=list):
+             the catalog entries in the order of `uris`. Uris that are not in the catalogs are left out.
+    """
+    uris = pd.unique(pd.Series(util.listify(uris), dtype=object))
+    parsed = pd.DataFrame([util.parse_service_uri(uri) for uri in uris], columns=['provider', 'service', 'service_id'])
+
+    all_catalog_entries = []
+    for (provider, service), grp in parsed.dropna().groupby(['provider', 'service']):
+        provider_plugin = load_providers()[provider]
+        all_catalog_entries.append(provider_plugin.get_catalog_entries(
+            service, grp['service_id'].tolist(), update_cache=update_cache
+        ))
+
+    catalog_entries = _merge_catalog_entries(all_catalog_entries)
+    if not catalog_entries.empty:
+        rows = catalog_entries.index.get_indexer(uris)
+        catalog_entries = catalog_entries.iloc[rows[rows >= 0]]
+
+    return _format_catalog_entries(catalog_entries, None, expand=expand, as_dataframe=as_dataframe,
+                                   as_geojson=as_geojson)
+
+
+def _search_catalog(uris, update_cache=False, filters=None, queries=None, timeout=None, raise_on_error=True,
+                    keyword_options=None, use_global_index=False, tolerance=None):
+    """Helper function for `search_catalog` and `search_keywords` to search and filter catalog_entries.
+
+    Returns:
+        A tuple of a pandas.DataFrame of the catalog_entries indexed by uri and a dict of the status of each service
+    """
     uris = list(itertools.chain(util.listify(uris) or []))
 
     grouped_uris = util.classify_uris(uris, as_dataframe=False, exclude=[UriType.DATASET],
@@ -60,89 +268,478 @@ def search_catalog(uris=None, expand=False, as_dataframe=False, as_geojson=False
     services = grouped_uris.get(UriType.SERVICE) or []
     collections = grouped_uris.get(UriType.COLLECTION) or []
 
-    catalog_entries = [d['catalog_entry'] for d in select_datasets(lambda c: c.collection.name in collections)]
+    catalog_entries = [d['catalog_entry'] for d in query_datasets({'collection': collections}, ['catalog_entry'])]
 
     all_catalog_entries = list()
 
     filters = filters or dict()
+    indexed_service_ids = dict()
+    if use_global_index and not update_cache:
+        cache_files = _get_catalog_cache_files()
+        if not uris:
+            services = list(cache_files)
+        indexed_services = [name for name in services if name in cache_files]
+        if indexed_services:
+            index = util.global_index.update_global_index(cache_files)
+            records = util.global_index.query_global_index(index, bbox=filters.get('bbox'),
+                                                           parameter=filters.get('parameter'),
+                                                           services=indexed_services)
+            indexed_service_ids = {name: [] for name in indexed_services}
+            indexed_service_ids.update(records.groupby('service')['service_id'].apply(list).to_dict())
+
+    service_searches = OrderedDict()
     for name in services:
         provider, service, catalog_entry = util.parse_service_uri(name)
         if catalog_entry is not None:
             catalog_entries.append(name)
             continue
         provider_plugin = load_providers()[provider]
-        tmp_catalog_entries = provider_plugin.search_catalog(service, update_cache=update_cache, **filters)
-        all_catalog_entries.append(tmp_catalog_entries)
+        if name in indexed_service_ids:
+            service_searches[name] = partial(provider_plugin.get_catalog_entries, service,
+                                             indexed_service_ids[name], tolerance=tolerance, **filters)
+        else:
+            service_searches[name] = partial(provider_plugin.search_catalog, service,
+                                             update_cache=update_cache, tolerance=tolerance, **filters)
+
+    all_catalog_entries, status = _search_services(service_searches, timeout=timeout, raise_on_error=raise_on_error)
 
     if catalog_entries:
-        all_catalog_entries.append(get_metadata(catalog_entries, as_dataframe=True))
-
-    if all_catalog_entries:
-        # drop duplicates fails when some columns have nested list/tuples like
-        # _geom_coords. so drop based on index
-        catalog_entries = pd.concat(all_catalog_entries)
-        catalog_entries['index'] = catalog_entries.index
-        catalog_entries = catalog_entries.drop_duplicates(subset='index')
-        catalog_entries = catalog_entries.set_index('index').sort_index()
+        # metadata is joined from the side tables below
+        all_catalog_entries.append(get_metadata(catalog_entries, as_dataframe=True).drop('metadata', axis=1))
+
+    catalog_entries = _merge_catalog_entries(all_catalog_entries)
+
+    # apply any specified filters and queries as a single mask
+    if not catalog_entries.empty:
+        mask = np.ones(len(catalog_entries), dtype=bool)
+        for predicate in _plan_filters(catalog_entries, filters, queries, keyword_options=keyword_options):
+            rows = np.flatnonzero(mask)
+            if len(rows) == 0:
+                break  # if no entries are left then doesn't try filtering any further
+            mask[rows] = predicate(catalog_entries, rows)
+
+        catalog_entries = catalog_entries[mask]
+
+    return catalog_entries, status
+
+
+def _format_catalog_entries(catalog_entries, filters, expand=False, as_dataframe=False, as_geojson=False):
+    """Helper function for `search_catalog`, `search_keywords` and `get_catalog_entries` to format the
+    catalog_entries to return.
+    """
+    if not (expand or as_dataframe or as_geojson):
+        catalog_entries = catalog_entries.index.astype('unicode').tolist()
+
     else:
-        catalog_entries = pd.DataFrame()
+        if not catalog_entries.empty:
+            catalog_entries = catalog_entries.assign(metadata=_get_metadata_records(catalog_entries, filters))
 
-    # apply any specified filters
-    for k, v in filters.items():
-        if catalog_entries.empty:
-            break  # if dataframe is empty then doesn't try filtering any further
+        if as_geojson:
+            if catalog_entries.empty:
+                catalog_entries = geojson.FeatureCollection([])
+            else:
+                catalog_entries = json.loads(util.geojson_encoder.write_geojson(catalog_entries))
+
+        elif not as_dataframe:
+            catalog_entries = catalog_entries.to_dict(orient='index')
+
+    return catalog_entries
+
+
+def _paginate(catalog_entries, limit=None, offset=0, cursor=None):
+    """Helper function for `search_catalog` and `search_keywords` to select a page of the catalog_entries.
+    """
+    start = 0
+    if cursor is not None and not catalog_entries.empty:
+        if cursor in catalog_entries.index:
+            start = catalog_entries.index.get_loc(cursor) + 1
+        elif catalog_entries.index.is_monotonic_increasing:
+            # the entry was removed since the previous page
+            start = catalog_entries.index.searchsorted(cursor, side='right')
         else:
-            if k == 'bbox':
-                bbox = util.bbox2poly(*[float(x) for x in util.listify(v)], as_shapely=True)
-                idx = catalog_entries.intersects(bbox)  # http://geopandas.org/reference.html#GeoSeries.intersects
-                catalog_entries = catalog_entries[idx]
-
-            elif k == 'geom_type':
-                idx = catalog_entries.geom_type.str.contains(v).fillna(value=False)
-                catalog_entries = catalog_entries[idx]
-
-            elif k == 'parameter':
-                idx = catalog_entries.parameters.str.contains(v)
-                catalog_entries = catalog_entries[idx]
-
-            elif k == 'display_name':
-                idx = catalog_entries.display_name.str.contains(v)
-                catalog_entries = catalog_entries[idx]
-
-            elif k == 'description':
-                idx = catalog_entries.display_name.str.contains(v)
-                catalog_entries = catalog_entries[idx]
-
-            elif k == 'search_terms':
-                idx = np.column_stack([
-                    catalog_entries[col].apply(str).str.contains(search_term, na=False)
-                    for col, search_term in itertools.product(catalog_entries.columns, v)
-                ]).any(axis=1)
-                catalog_entries = catalog_entries[idx]
+            raise ValueError('cursor {} is not in the search results'.format(cursor))
 
-            else:
-                idx = catalog_entries.metadata.map(lambda x: _multi_index(x, k) == v)
-                catalog_entries = catalog_entries[idx]
+    start += offset or 0
+    stop = None if limit is None else start + limit
 
-    if queries is not None:
-        for query in queries:
-            catalog_entries = catalog_entries.query(query)
+    return catalog_entries.iloc[start:stop]
 
-    if not (expand or as_dataframe or as_geojson):
-        return catalog_entries.index.astype('unicode').tolist()
 
-    if as_geojson:
-        if catalog_entries.empty:
-            return geojson.FeatureCollection([])
+def _stream_catalog_entries(catalog_entries, filters, chunksize=1000, expand=False, as_dataframe=False,
+                            as_geojson=False):
+    """Helper function for `search_catalog` and `search_keywords` to format catalog_entries a chunk at a time.
+    """
+    for start in range(0, len(catalog_entries), chunksize):
+        chunk = _format_catalog_entries(catalog_entries.iloc[start:start + chunksize], filters, expand=expand,
+                                        as_dataframe=as_dataframe, as_geojson=as_geojson)
+        if as_geojson:
+            yield from chunk['features']
+        elif as_dataframe or expand:
+            yield chunk
+        else:
+            yield from chunk
+
+
+def _count_facets(catalog_entries, facets, filters):
+    """Helper function for `search_catalog` to count the catalog_entries with each value of each facet.
+
+    Parameters are counted per distinct combination of parameters (the categories of the
+    `parameters` column) and geometries by type id, so only metadata tags need to be read
+    for the individual catalog_entries.
+    """
+    counts = OrderedDict((facet, OrderedDict()) for facet in facets)
+    if catalog_entries.empty:
+        return counts
+
+    tags = []
+    for facet in facets:
+        if facet == 'parameter':
+            codes, combinations = pd.factorize(catalog_entries['parameters'])
+            parameter_counts = Counter()
+            for combination, count in zip(combinations, np.bincount(codes[codes >= 0], minlength=len(combinations))):
+                parameter_counts.update({parameter: count for parameter in str(combination).split(',') if parameter})
+            values = pd.Series(parameter_counts, dtype='int64')
+
+        elif facet == 'geom_type':
+            values = gpd.GeoSeries(catalog_entries['geometry'].values).geom_type.value_counts()
+
+        elif facet in catalog_entries.columns and facet != 'geometry':
+            values = catalog_entries[facet].value_counts()
+
+        else:
+            tags.append(facet)
+            continue
+
+        values = values.sort_values(ascending=False, kind='mergesort')
+        counts[facet] = OrderedDict((_to_python(k), int(v)) for k, v in values.items())
+
+    if tags:
+        fields = list(OrderedDict.fromkeys(tag.split(':')[0] for tag in tags))
+        entries = catalog_entries[['service', 'service_id']]
+        metadata = pd.concat(_get_catalog_metadata(entries, columns=fields, filters=filters))
+        tag_counts = util.tag_index.tags_to_dict(util.tag_index.build_tag_index(metadata), as_count=True)
+        for tag in tags:
+            counts[tag] = OrderedDict(tag_counts.get(tag, {}))
+
+    return counts
+
+
+def _to_python(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _merge_catalog_entries(all_catalog_entries):
+    """Helper function for `search_catalog` to merge the catalog_entries of each source into one frame.
+
+    The result is sorted by uri and has one entry per uri (from the first source that has it).
+    Cached catalogs are already sorted, so sources are only sorted when they are not. Sources
+    that cover disjoint ranges of uris (i.e. different services) are concatenated in order,
+    otherwise the sorted runs are merged with a stable sort. Duplicates are then adjacent.
+    """
+    frames = [df for df in all_catalog_entries if len(df) > 0]
+    if not frames:
+        return pd.DataFrame()
+
+    # drop duplicates fails when some columns have nested list/tuples like
+    # _geom_coords. so drop based on index
+    frames = [df if df.index.is_monotonic_increasing else df.sort_index(kind='mergesort') for df in frames]
+    if len(frames) == 1:
+        catalog_entries = frames[0]
+    else:
+        ordered = sorted(frames, key=lambda df: df.index[0])
+        if all(a.index[-1] < b.index[0] for a, b in zip(ordered[:-1], ordered[1:])):
+            catalog_entries = pd.concat(ordered)
         else:
-            return json.loads(catalog_entries.to_json(default=util.to_json_default_handler))
+            catalog_entries = pd.concat(frames)
+            catalog_entries = catalog_entries.iloc[np.argsort(catalog_entries.index.values, kind='stable')]
 
-    if not as_dataframe:
-        catalog_entries = catalog_entries.to_dict(orient='index')
+    uris = catalog_entries.index.values
+    duplicated = np.zeros(len(uris), dtype=bool)
+    duplicated[1:] = uris[1:] == uris[:-1]
+    if duplicated.any():
+        catalog_entries = catalog_entries[~duplicated]
+
+    catalog_entries.index = catalog_entries.index.rename('index')
 
     return catalog_entries
 
 
+def _get_catalog_cache_files():
+    """Helper function for `search_catalog` to find the services with a cached catalog.
+
+    Returns:
+        A dict of the path of the catalog cache file keyed by service uri
+    """
+    cache_files = OrderedDict()
+    for provider_name, provider_plugin in load_providers().items():
+        for service_name, service in provider_plugin.services.items():
+            if not service.use_cache:
+                continue
+            cache_file = service.catalog_cache_file
+            if os.path.exists(cache_file) and os.path.exists(util.catalog_cache.metadata_cache_file(cache_file)):
+                cache_files[util.construct_service_uri(provider_name, service_name)] = cache_file
+
+    return cache_files
+
+
+def _search_services(service_searches, timeout=None, raise_on_error=True):
+    """Helper function for `search_catalog` to search services concurrently.
+
+    Args:
+        service_searches (OrderedDict): functions that search the catalog of each service keyed by service uri
+        timeout (float): number of seconds to wait for the services
+        raise_on_error (bool): if True, raise the error of the first service that failed or timed out
+
+    Returns:
+        A tuple of a list of catalogs of the services that succeeded and a dict of the status of each service
+    """
+    all_catalog_entries = list()
+    status = OrderedDict()
+    if not service_searches:
+        return all_catalog_entries, status
+
+    def timed(search):
+        start = time.time()
+        return search(), time.time() - start
+
+    executor = ThreadPoolExecutor(max_workers=len(service_searches))
+    futures = OrderedDict((name, executor.submit(timed, search)) for name, search in service_searches.items())
+    wait(futures.values(), timeout=timeout)
+    # don't wait for services that timed out
+    executor.shutdown(wait=False)
+
+    for name, future in futures.items():
+        if not future.done():
+            message = 'Searching {} did not finish within {} seconds'.format(name, timeout)
+            if raise_on_error:
+                raise TimeoutError(message)
+            status[name] = {'status': SearchStatus.TIMEOUT, 'message': message, 'elapsed': timeout}
+
+        elif future.exception() is not None:
+            e = future.exception()
+            if raise_on_error:
+                raise e
+            status[name] = {'status': SearchStatus.FAILED, 'message': '{}: {}'.format(type(e).__name__, e)}
+
+        else:
+            catalog_entries, elapsed = future.result()
+            all_catalog_entries.append(catalog_entries)
+            status[name] = {'status': SearchStatus.SUCCESS, 'message': '', 'elapsed': elapsed}
+            continue
+
+        util.logger.error(status[name]['message'])
+
+    return all_catalog_entries, status
+
+
+# relative cost of evaluating each kind of filter, index backed and exact filters are evaluated first
+_FILTER_COSTS = {
+    'bbox': 0,
+    'parameter': 1,
+    'metadata': 2,
+    'geom_type': 3,
+    'keywords': 1,
+    'search_terms': 4,
+    'display_name': 5,
+    'description': 5,
+    'query': 6,
+}
+
+
+def _plan_filters(catalog_entries, filters, queries=None, keyword_options=None):
+    """Helper function for `search_catalog` to order filters and queries by estimated cost and selectivity.
+
+    All filters and queries must match, so they can be evaluated in any order. Each one is
+    only evaluated for the entries that matched the filters before it.
+
+    Returns:
+        A list of functions that take the catalog_entries and an array of rows and return a
+        boolean array of the rows that match.
+    """
+    plan = []
+    for k, v in filters.items():
+        selectivity = 1.0
+        if k == 'bbox':
+            bbox = util.bbox2poly(*[float(x) for x in util.listify(v)], as_shapely=True)
+            selectivity = bbox.area / (360 * 180)
+            kind, predicate = k, partial(_filter_bbox, bbox)
+
+        elif k == 'geom_type':
+            kind, predicate = k, partial(_filter_geom_type, v)
+
+        elif k == 'parameter':
+            counts = catalog_entries['parameters'].value_counts()
+            selectivity = counts[_filter_parameters(counts.index, v)].sum() / len(catalog_entries)
+            kind, predicate = k, partial(_filter_column, 'parameters', partial(_filter_parameters, parameter=v))
+
+        elif k in ('display_name', 'description'):
+            kind, predicate = k, partial(_filter_column, k, partial(_contains, pattern=v))
+
+        elif k == 'keywords':
+            kind, predicate = k, partial(_filter_keywords, util.listify(v), filters, **(keyword_options or {}))
+
+        elif k == 'search_terms':
+            kind, predicate = k, partial(_filter_search_terms, util.listify(v), filters)
+
+        else:
+            kind, predicate = 'metadata', partial(_filter_metadata, k, v, filters)
+
+        plan.append((_FILTER_COSTS[kind], selectivity, len(plan), predicate))
+
+    for query in queries or []:
+        plan.append((_FILTER_COSTS['query'], 1.0, len(plan), partial(_filter_query, query)))
+
+    return [predicate for _, _, _, predicate in sorted(plan, key=lambda x: x[:3])]
+
+
+def _filter_bbox(bbox, catalog_entries, rows):
+    geometry = gpd.GeoSeries(catalog_entries['geometry'].values[rows])
+    return geometry.intersects(bbox).values  # http://geopandas.org/reference.html#GeoSeries.intersects
+
+
+def _filter_geom_type(geom_type, catalog_entries, rows):
+    geometry = gpd.GeoSeries(catalog_entries['geometry'].values[rows])
+    return geometry.geom_type.str.contains(geom_type).fillna(value=False).values.astype(bool)
+
+
+def _filter_column(column, predicate, catalog_entries, rows):
+    return predicate(pd.Series(catalog_entries[column].values[rows]))
+
+
+def _contains(values, pattern):
+    return values.str.contains(pattern, na=False).values
+
+
+def _filter_query(query, catalog_entries, rows):
+    return catalog_entries.iloc[rows].eval(query).values
+
+
+def _filter_search_terms(search_terms, filters, catalog_entries, rows):
+    """Helper function for `search_catalog` to filter catalog_entries that contain any of the search terms.
+
+    The token index of each service is used to find the entries that may contain a search term
+    so that only those entries have to be searched. Terms that may occur in text that is not
+    indexed (the service uri, the name of the entry or the metadata field names) are searched
+    in all entries.
+    """
+    entries = catalog_entries.iloc[rows]
+    columns = [c for c in entries.columns if c not in ['geometry', 'reserved']]
+    matches = np.zeros(len(rows), dtype=bool)
+
+    for service_uri, positions in entries.groupby('service').indices.items():
+        provider, service, _ = util.parse_service_uri(service_uri)
+        provider_plugin = load_providers()[provider]
+        index = provider_plugin.get_token_index(service, **filters)
+        metadata_fields = provider_plugin.get_catalog_metadata(service, service_ids=[], **filters).columns
+        unindexed_tokens = set(util.text_index.tokenize(service_uri)) | {'none'}
+        unindexed_tokens.update(token for field in metadata_fields for token in util.text_index.tokenize(field))
+
+        for search_term in search_terms:
+            candidates = positions[~matches[positions]]
+            token_rows = index.candidates(search_term)
+            if token_rows is not None and not _matches_tokens(search_term, unindexed_tokens):
+                candidates = candidates[np.isin(entries['service_id'].values[candidates],
+                                                index.service_ids[token_rows])]
+            if len(candidates) == 0:
+                continue
+
+            text = entries.iloc[candidates][columns]
+            metadata = provider_plugin.get_catalog_metadata(
+                service, service_ids=entries['service_id'].values[candidates].tolist(), **filters
+            ).reindex(text.index)
+            text = text.assign(metadata=[str(record) for record in metadata_to_records(metadata)])
+            found = np.column_stack([
+                text[col].apply(str).str.contains(search_term, na=False).values for col in text.columns
+            ]).any(axis=1)
+            matches[candidates[found]] = True
+
+    return matches
+
+
+def _matches_tokens(term, tokens):
+    """Helper function for `_filter_search_terms` to check whether a token of a search term occurs in any of the tokens.
+    """
+    return any(term_token in token for term_token in util.text_index.tokenize(term) for token in tokens)
+
+
+def _filter_keywords(keywords, filters, catalog_entries, rows, prefix=True, match_all=True):
+    return _keyword_scores(keywords, filters, catalog_entries, rows, prefix=prefix, match_all=match_all) > 0
+
+
+def _keyword_scores(keywords, filters, catalog_entries, rows, prefix=True, match_all=True):
+    """Helper function for `search_keywords` to score how well catalog_entries match keywords.
+
+    Returns:
+        An array with the score of each row, which is 0 for rows that don't match.
+    """
+    entries = catalog_entries.iloc[rows]
+    service_ids = entries['service_id'].values.astype(str)
+    scores = np.zeros(len(rows))
+
+    for service_uri, positions in entries.groupby('service').indices.items():
+        provider, service, _ = util.parse_service_uri(service_uri)
+        index = load_providers()[provider].get_token_index(service, **filters)
+        matches, match_scores = index.search(keywords, prefix=prefix, match_all=match_all)
+        service_scores = pd.Series(match_scores, index=index.service_ids[matches])
+        scores[positions] = service_scores.reindex(service_ids[positions]).fillna(0).values
+
+    return scores
+
+
+def _filter_parameters(parameters, parameter):
+    """Helper function for `search_catalog` to test which catalog_entries have a parameter.
+
+    Parameters are stored as comma separated strings, but there are only a few distinct
+    combinations of parameters, so each combination is only split once.
+    """
+    codes, combinations = pd.factorize(parameters)
+    # the extra False is selected by the code of missing values (-1)
+    matches = np.array([parameter in c.split(',') for c in combinations] + [False])
+    return matches[codes]
+
+
+def _filter_metadata(key, value, filters, catalog_entries, rows):
+    """Helper function for `search_catalog` to filter catalog_entries on a metadata field.
+
+    Top level fields are compared as columns of the metadata side tables. Multi-index
+    tags (see `get_tags`) are looked up in the nested dicts of their top level field.
+    """
+    catalog_entries = catalog_entries.iloc[rows, catalog_entries.columns.get_indexer(['service', 'service_id'])]
+    field = key.split(':')[0]
+    idx = pd.Series(False, index=catalog_entries.index)
+    for metadata in _get_catalog_metadata(catalog_entries, columns=[field], filters=filters):
+        if field not in metadata.columns:
+            continue
+
+        if field == key:
+            matches = metadata[field] == value
+        else:
+            matches = metadata[field].map(lambda x: _multi_index_equals(x, key, value))
+
+        idx.loc[matches.index[matches.values]] = True
+
+    return idx.values
+
+
+def _multi_index_equals(d, index, value):
+    """Helper function for `_filter_metadata` to compare a multi-index tag that may be missing.
+    """
+    try:
+        return _multi_index({index.split(':')[0]: d}, index) == value
+    except (KeyError, TypeError):
+        return False
+
+
+def _get_metadata_records(catalog_entries, filters):
+    """Helper function for `search_catalog` to build the `metadata` dicts of catalog_entries.
+    """
+    records = dict()
+    for metadata in _get_catalog_metadata(catalog_entries, filters=filters):
+        records.update(zip(metadata.index, metadata_to_records(metadata)))
+
+    return [records.get(uri, {}) for uri in catalog_entries.index]
+
+
 def _multi_index(d, index):
     """Helper function for `search_catalog` filters to index multi-index tags (see `get_tags`)
     """
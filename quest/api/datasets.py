@@ -10,7 +10,11 @@ from .metadata import get_metadata, update_metadata
 from .. import util
 from .. import static
 from ..plugins import load_providers, load_plugins, list_plugins
-from ..database.database import get_db, db_session, select_datasets
+from ..database.database import DATASET_FILTER_COLUMNS, query_datasets, insert_datasets, update_datasets
+
+
+# number of download results written to the database in each transaction
+STATUS_BATCH_SIZE = 100
 
 
 @add_async
@@ -58,21 +62,29 @@ def publish(publisher_uri, options=None, **kwargs):
     return data
 
 @add_async
-def download_datasets(datasets, options=None, raise_on_error=False):
+def download_datasets(datasets, options=None, raise_on_error=False, use_cache=False):
     """Download datasets and save them in the Quest project.
 
     Args:
         datasets (string or list, Required):
             datasets to download
         options (dict, Optional, Default=None):
-            Dictionary of download options to stage the datasets with before downloading (see :func:`quest.api.stage_for_download`)
+            Dictionary of download options to stage the datasets with before downloading
+            (see :func:`quest.api.stage_for_download`)
         raise_on_error (bool, Optional, Default=False):
             if True, if an error occurs raise an exception
+        use_cache (bool, Optional, Default=False):
+            if True, use data that was downloaded with the same catalog entry and options in any project
+            rather than downloading it again, and store new downloads in the download cache
         async (bool, Optional, Default=False):
             if True, download in background
 
     Note:
-        If `options` are not provided then the `datasets` should already download options set by calling :func:`quest.api.stage_for_download`.
+        If `options` are not provided then the `datasets` should already download options set by calling
+        :func:`quest.api.stage_for_download`.
+
+        The files of datasets downloaded with `use_cache` are stored once in the download cache under
+        the `CACHE_DIR` and are shared by the datasets of all projects (see :mod:`quest.util.download_cache`).
 
     Returns:
         status (dict):
@@ -89,43 +101,65 @@ def download_datasets(datasets, options=None, raise_on_error=False):
     # filter out non download datasets
     datasets = datasets[datasets['source'] == static.DatasetSource.WEB_SERVICE]
 
-    db = get_db()
     project_path = _get_project_dir()
+    _update_datasets({idx: {'status': static.DatasetStatus.PENDING} for idx in datasets.index})
+
     status = {}
-    for idx, dataset in datasets.iterrows():
-        collection_path = os.path.join(project_path, dataset['collection'])
-        catalog_entry = dataset["catalog_entry"]
-        try:
-            update_metadata(idx, quest_metadata={'status': static.DatasetStatus.PENDING})
-            kwargs = dataset['options'] or dict()
-            all_metadata = download(catalog_entry,
-                                    file_path=collection_path,
-                                    dataset=idx, **kwargs)
-
-            metadata = all_metadata.pop('metadata', None)
-            quest_metadata = all_metadata
-            quest_metadata.update({
-                'status': static.DatasetStatus.DOWNLOADED,
-                'message': 'success',
-                })
-        except Exception as e:
-            if raise_on_error:
-                raise
-
-            quest_metadata = {
-                'status': static.DatasetStatus.FAILED_DOWNLOAD,
-                'message': str(e),
-                }
-
-            metadata = None
-
-        status[idx] = quest_metadata['status']
-
-        quest_metadata.update({'metadata': metadata})
-
-        with db_session:
-            dataset = db.Dataset[idx]
-            dataset.set(**quest_metadata)
+    updates = {}
+    previous_keys = {}
+    try:
+        for idx, dataset in datasets.iterrows():
+            collection_path = os.path.join(project_path, dataset['collection'])
+            catalog_entry = dataset["catalog_entry"]
+            acquired = None
+            try:
+                kwargs = dataset['options'] or dict()
+                key = util.download_cache.download_key(catalog_entry, kwargs) if use_cache else None
+                all_metadata = key and util.download_cache.acquire(key)
+                if all_metadata:
+                    acquired = key
+                else:
+                    all_metadata = download(catalog_entry,
+                                            file_path=collection_path,
+                                            dataset=idx, **kwargs)
+                    folder = _download_folder(all_metadata.get('file_path'), collection_path, idx)
+                    stored_path = key and util.download_cache.store(key, catalog_entry, kwargs, all_metadata,
+                                                                    folder=folder)
+                    if stored_path:
+                        acquired = key
+                        all_metadata['file_path'] = stored_path
+
+                metadata = all_metadata.pop('metadata', None)
+                quest_metadata = all_metadata
+                quest_metadata.update({
+                    'status': static.DatasetStatus.DOWNLOADED,
+                    'message': 'success',
+                    'download_key': acquired,
+                    })
+                previous_keys[idx] = dataset.get('download_key')
+            except Exception as e:
+                util.download_cache.release([acquired])
+                if raise_on_error:
+                    raise
+
+                quest_metadata = {
+                    'status': static.DatasetStatus.FAILED_DOWNLOAD,
+                    'message': str(e),
+                    }
+
+                metadata = None
+
+            status[idx] = quest_metadata['status']
+
+            quest_metadata.update({'metadata': metadata})
+            updates[idx] = quest_metadata
+
+            if len(updates) >= STATUS_BATCH_SIZE:
+                _update_downloaded_datasets(updates, previous_keys)
+                updates = {}
+    finally:
+        # write the results of downloads that finished, even if a download raised
+        _update_downloaded_datasets(updates, previous_keys)
 
     return status
 
@@ -176,25 +210,44 @@ def get_publish_options(publish_uri, fmt='json'):
 
 
 @add_async
-def get_datasets(expand=None, filters=None, queries=None, as_dataframe=None):
+def get_datasets(expand=None, filters=None, queries=None, as_dataframe=None, columns=None):
     """Return all available datasets in active project.
 
     Args:
         expand (bool, Optional, Default=None):
             include dataset details and format as dict
         filters(dict, Optional, Default=None):
-             filter dataset by any metadata field
+             filter dataset by any metadata field. A list of values matches datasets with any of the values.
         queries(list, Optional, Default=None):
             list of string arguments to pass to pandas.DataFrame.query to filter the datasets
         as_dataframe (bool or None, Optional, Default=None):
             include dataset details and format as pandas dataframe
+        columns (list, Optional, Default=None):
+            dataset details to include when expanded or formatted as a dataframe, defaults to all details
+
+    Note:
+        Filters on the `name`, `collection`, `status`, `datatype`, `source` and `catalog_entry`
+        fields are evaluated by the database, and only the details that are needed are loaded.
+
     Returns:
         uris (list, dict, pandas Dataframe, Default=list):
             staged dataset uids
 
     """
-    datasets = select_datasets()
-    datasets = pd.DataFrame(datasets)
+    filters = dict(filters or {})
+    db_filters = {k: filters.pop(k) for k in list(filters) if k in DATASET_FILTER_COLUMNS}
+
+    if filters or queries is not None:
+        # other filters and queries may refer to any field
+        fields = None
+    elif not expand and not as_dataframe:
+        fields = ['name']
+    elif columns is not None:
+        fields = ['name'] + [c for c in columns if c != 'name']
+    else:
+        fields = None
+
+    datasets = pd.DataFrame(query_datasets(db_filters, fields), columns=fields)
     if not datasets.empty:
         datasets.set_index('name', inplace=True, drop=False)
 
@@ -205,12 +258,14 @@ def get_datasets(expand=None, filters=None, queries=None, as_dataframe=None):
             datasets = {}
         return datasets
 
-    if filters is not None:
-        for k, v in filters.items():
-            if k not in datasets.keys():
-                util.logger.warning('filter field {} not found, continuing'.format(k))
-                continue
+    for k, v in filters.items():
+        if k not in datasets.keys():
+            util.logger.warning('filter field {} not found, continuing'.format(k))
+            continue
 
+        if isinstance(v, (list, tuple, set)):
+            datasets = datasets.loc[datasets[k].isin(v)]
+        else:
             datasets = datasets.loc[datasets[k] == v]
 
     if queries is not None:
@@ -219,14 +274,17 @@ def get_datasets(expand=None, filters=None, queries=None, as_dataframe=None):
 
     if not expand and not as_dataframe:
         datasets = datasets['name'].tolist()
-    elif not as_dataframe:
-        datasets = datasets.to_dict(orient='index')
+    else:
+        if columns is not None:
+            datasets = datasets[list(columns)]
+        if not as_dataframe:
+            datasets = datasets.to_dict(orient='index')
 
     return datasets
 
 
 @add_async
-def add_datasets(collection, catalog_entries):
+def add_datasets(collection, catalog_entries, raise_on_error=False):
     """Adds new datasets (created from ``catalog_entries``) to ``collection``
 
     Args:
@@ -234,23 +292,31 @@ def add_datasets(collection, catalog_entries):
             name of collection
         catalog_entries (string, comma separated strings, list of strings, or :obj:`pandas.DataFrame`, Required):
             list of catalog entry uris from which to create new datasets to add to the collection.
+        raise_on_error (bool, Optional, Default=False):
+            if True, raise an exception if any dataset could not be created
+
+    Note:
+        All datasets are created in a single transaction. Datasets that could not be created
+        are logged and left out of the returned uris.
 
     Returns:
         uris (list):
             uris of newly created datasets
     """
+    if collection not in get_collections():
+        raise ValueError("Collection {} does not exist".format(collection))
+
     if not isinstance(catalog_entries, pd.DataFrame):
-        entries = get_metadata(catalog_entries, as_dataframe=True)
+        catalog_entries = get_metadata(catalog_entries, as_dataframe=True)
 
-    uris = []
-    for _, data in entries.iterrows():
+    datasets = []
+    for catalog_entry, service in zip(catalog_entries['name'], catalog_entries['service']):
         source = static.DatasetSource.WEB_SERVICE
-        if 'quest' in data['service']:
+        if 'quest' in service:
             source = static.DatasetSource.DERIVED
-        uri = new_dataset(collection=collection, catalog_entry=data.to_frame().transpose(), source=source)
-        uris.append(uri)
+        datasets.append(_new_dataset_metadata(catalog_entry, collection, source=source))
 
-    return uris
+    return _insert_datasets(datasets, raise_on_error=raise_on_error)
 
 
 @add_async
@@ -291,36 +357,10 @@ def new_dataset(catalog_entry, collection, source=None, display_name=None,
     except IndexError:
         raise ValueError('Entry {} dose not exist'.format(catalog_entry))
 
-    name = name or util.uuid('dataset')
-    assert name.startswith('d') and util.is_uuid(name)
-
-    if source is None:
-        source = static.DatasetSource.USER
-
-    if display_name is None:
-        display_name = name
+    dataset = _new_dataset_metadata(catalog_entry, collection, source=source, display_name=display_name,
+                                    description=description, file_path=file_path, metadata=metadata, name=name)
 
-    if metadata is None:
-        metadata = {}
-
-    quest_metadata = {
-        'name': name,
-        'collection': collection,
-        'catalog_entry': catalog_entry,
-        'source': source,
-        'display_name': display_name,
-        'description': description,
-        'file_path': file_path,
-        'metadata': metadata,
-    }
-    if source == static.DatasetSource.WEB_SERVICE:
-        quest_metadata.update({'status': static.DatasetStatus.NOT_STAGED})
-
-    db = get_db()
-    with db_session:
-        db.Dataset(**quest_metadata)
-
-    return name
+    return _insert_datasets([dataset], raise_on_error=True)[0]
 
 
 def stage_for_download(uris, options=None):
@@ -340,44 +380,142 @@ def stage_for_download(uris, options=None):
             staged dataset uids
     """
     uris = util.listify(uris)
-    display_name = None
-    datasets = []
 
     # TODO classify uris and ensure only datasets
 
     if not isinstance(options, list):
         options = [options] * len(uris)
 
-    db = get_db()
+    all_metadata = get_metadata(uris)
+    missing = [uri for uri in uris if uri not in all_metadata]
+    if missing:
+        raise ValueError('Datasets {} do not exist'.format(', '.join(missing)))
 
+    updates = {}
     for dataset_uri, kwargs in zip(uris, options):
         if isinstance(kwargs, param.Parameterized):
             kwargs = dict(kwargs.get_param_values())
 
-        dataset_metadata = get_metadata(dataset_uri)[dataset_uri]
+        dataset_metadata = all_metadata[dataset_uri]
 
         parameter = kwargs.get('parameter') if kwargs else None
         parameter_name = parameter or 'no_parameter'
 
-        if dataset_metadata['display_name'] == dataset_uri:
+        display_name = dataset_metadata['display_name']
+        if display_name == dataset_uri:
             catalog_entry = dataset_metadata['catalog_entry']
             provider, service, _ = util.parse_service_uri(catalog_entry)
             display_name = '{0}-{1}-{2}'.format(provider, parameter_name, dataset_uri[:7])
 
-        quest_metadata = {
-            'display_name': display_name or dataset_metadata['display_name'],
+        updates[dataset_uri] = {
+            'display_name': display_name,
             'options': kwargs,
             'status': static.DatasetStatus.STAGED,
             'parameter': parameter
         }
 
-        with db_session:
-            dataset = db.Dataset[dataset_uri]
-            dataset.set(**quest_metadata)
+    _update_datasets(updates, raise_on_error=True)
 
-        datasets.append(dataset_uri)
+    return uris
 
-    return datasets
+
+def _new_dataset_metadata(catalog_entry, collection, source=None, display_name=None,
+                          description=None, file_path=None, metadata=None, name=None):
+    """Helper function to build the database record of a new dataset (see `new_dataset`).
+    """
+    name = name or util.uuid('dataset')
+    assert name.startswith('d') and util.is_uuid(name)
+
+    if source is None:
+        source = static.DatasetSource.USER
+
+    if display_name is None:
+        display_name = name
+
+    if metadata is None:
+        metadata = {}
+
+    quest_metadata = {
+        'name': name,
+        'collection': collection,
+        'catalog_entry': catalog_entry,
+        'source': source,
+        'display_name': display_name,
+        'description': description,
+        'file_path': file_path,
+        'metadata': metadata,
+    }
+    if source == static.DatasetSource.WEB_SERVICE:
+        quest_metadata.update({'status': static.DatasetStatus.NOT_STAGED})
+
+    return quest_metadata
+
+
+def _insert_datasets(datasets, raise_on_error=False):
+    """Helper function to insert new datasets, logging (or raising) the error of each one that fails.
+
+    Returns:
+        The names of the datasets that were inserted.
+    """
+    errors = insert_datasets(datasets)
+    _report_errors(errors, 'created', raise_on_error)
+    return [d['name'] for d in datasets if d['name'] not in errors]
+
+
+def _update_datasets(updates, raise_on_error=False):
+    """Helper function to update datasets, logging (or raising) the error of each one that fails.
+
+    Returns:
+        A dict with the error message of each dataset that could not be updated.
+    """
+    if not updates:
+        return {}
+    errors = update_datasets(updates)
+    _report_errors(errors, 'updated', raise_on_error)
+    return errors
+
+
+def _update_downloaded_datasets(updates, previous_keys):
+    """Helper function for `download_datasets` to write the results of downloads and release the download cache
+    references that datasets no longer hold.
+
+    A dataset that is updated no longer references the download it previously used, while a dataset
+    that could not be updated does not reference the download it was just given.
+    """
+    errors = _update_datasets(updates)
+    util.download_cache.release([
+        update.get('download_key') if name in errors else previous_keys.pop(name, None)
+        for name, update in updates.items()
+    ])
+
+
+def _download_folder(file_path, collection_path, dataset):
+    """Helper function for `download_datasets` to find the folder of a download, which is named after the dataset.
+
+    Returns:
+        The path of the folder, or None if the download was not written to a folder of its own.
+    """
+    if file_path is None:
+        return None
+
+    collection_path = os.path.normpath(collection_path)
+    folder = os.path.normpath(file_path)
+    while folder != collection_path and os.path.dirname(folder) != folder:
+        if os.path.basename(folder) == dataset:
+            return folder
+        folder = os.path.dirname(folder)
+
+    return None
+
+
+def _report_errors(errors, action, raise_on_error):
+    for name, message in errors.items():
+        util.logger.error('Dataset %s could not be %s: %s', name, action, message)
+
+    if errors and raise_on_error:
+        raise ValueError('{} dataset(s) could not be {}: {}'.format(
+            len(errors), action, '; '.join('{}: {}'.format(k, v) for k, v in errors.items())
+        ))
 
 
 def describe_dataset():
@@ -6,7 +6,7 @@ from .projects import _get_project_dir
 from .collections import get_collections
 from .metadata import get_metadata, update_metadata
 from ..static import UriType, DatasetSource
-from ..util import logger, classify_uris, uuid, parse_service_uri
+from ..util import logger, classify_uris, uuid, parse_service_uri, download_cache
 from ..database.database import get_db, db_session, select_datasets
 
 
@@ -47,9 +47,11 @@ def delete(uris):
 
             with db_session:
                 datasets = db.Dataset.select(lambda d: d.collection.name == uri)
+                download_keys = [d.download_key for d in datasets]
                 if datasets.count() > 0:
                     datasets.delete()
                 db.Collection[uri].delete()
+            download_cache.release(download_keys)
 
             path = _get_project_dir()
             path = os.path.join(path, uri)
@@ -68,10 +70,14 @@ def delete(uris):
                         _, _, catalog_id = parse_service_uri(dataset.catalog_entry)
                         db.QuestCatalog[catalog_id].delete()
 
-                try:
-                    os.remove(dataset.file_path)
-                except (OSError, TypeError):
-                    pass
+                if dataset.download_key:
+                    # the file is shared through the download cache
+                    download_cache.release([dataset.download_key])
+                else:
+                    try:
+                        os.remove(dataset.file_path)
+                    except (OSError, TypeError):
+                        pass
 
                 dataset.delete()
 
@@ -153,12 +159,19 @@ def _copy_dataset(dataset_metadata, collection_path, destination_collection_path
         db_metadata = db.Dataset[dataset_metadata['name']].to_dict()
         db_metadata.update(name=new_name)
         db.Dataset(**db_metadata)
-    
-    _update_dataset_file_location(shutil.copy2, db_metadata, collection_path, destination_collection_path)
+
+    if db_metadata['download_key']:
+        # the copy shares the file in the download cache
+        download_cache.acquire(db_metadata['download_key'])
+    else:
+        _update_dataset_file_location(shutil.copy2, db_metadata, collection_path, destination_collection_path)
     return new_name
 
 
 def _move_dataset(dataset_metadata, collection_path, destination_collection_path):
+    if dataset_metadata.get('download_key'):
+        # the file is in the download cache rather than the collection
+        return
     _update_dataset_file_location(shutil.move, dataset_metadata, collection_path, destination_collection_path)
 
 
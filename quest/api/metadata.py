@@ -3,7 +3,8 @@ import pandas as pd
 from ..static import UriType
 from ..plugins import load_providers
 from ..util import classify_uris, construct_service_uri, parse_service_uri
-from ..database import get_db, db_session, select_collections, select_datasets
+from ..util.catalog_cache import metadata_to_records
+from ..database import get_db, db_session, select_collections, query_datasets, update_datasets
 
 
 def get_metadata(uris, as_dataframe=False):
@@ -46,8 +47,14 @@ def get_metadata(uris, as_dataframe=False):
 
             selected_catalog_entries = grp.query('catalog_id == catalog_id').uri.tolist()
             if selected_catalog_entries:
-                catalog_entries = provider_plugin.search_catalog(service)
+                catalog_entries = provider_plugin.get_catalog_entries(service, grp['catalog_id'].dropna().tolist())
                 catalog_entries = catalog_entries.loc[selected_catalog_entries]
+                catalog_metadata = provider_plugin.get_catalog_metadata(
+                    service, service_ids=catalog_entries['service_id'].tolist()
+                )
+                catalog_entries = catalog_entries.assign(metadata=metadata_to_records(
+                    catalog_metadata.reindex(catalog_entries.index)
+                ))
                 metadata.append(catalog_entries)
 
     if UriType.PUBLISHER in grouped_uris.groups.keys():
@@ -71,7 +78,7 @@ def get_metadata(uris, as_dataframe=False):
 
     if UriType.DATASET in grouped_uris.groups.keys():
         tmp_df = grouped_uris.get_group(UriType.DATASET)
-        datasets = select_datasets(lambda c: c.name in tmp_df['uri'].tolist())
+        datasets = query_datasets({'name': tmp_df['uri'].tolist()})
         datasets = pd.DataFrame(datasets)
         datasets.set_index('name', inplace=True, drop=False)
         metadata.append(datasets)
@@ -84,6 +91,28 @@ def get_metadata(uris, as_dataframe=False):
     return metadata
 
 
+def _get_catalog_metadata(catalog_entries, columns=None, filters=None):
+    """Helper function to get the metadata side tables of the services of catalog_entries.
+
+    Args:
+        catalog_entries (pandas.DataFrame): catalog_entries with `service` and `service_id` columns
+        columns (list): metadata fields to get. Defaults to all fields.
+        filters (dict): search filters used to select the cached catalogs (see `search_catalog`)
+
+    Returns:
+        A list with a metadata DataFrame for each service, indexed by catalog_entry uri
+    """
+    tables = []
+    for service_uri, grp in catalog_entries.groupby('service'):
+        provider, service, _ = parse_service_uri(service_uri)
+        provider_plugin = load_providers()[provider]
+        tables.append(provider_plugin.get_catalog_metadata(
+            service, service_ids=grp['service_id'].tolist(), columns=columns, **(filters or {})
+        ))
+
+    return tables
+
+
 def update_metadata(uris, display_name=None, description=None,
                     metadata=None, quest_metadata=None):
     """Update metadata for resource(s)
@@ -145,6 +174,7 @@ def update_metadata(uris, display_name=None, description=None,
         metadata = [metadata]
         quest_metadata = [quest_metadata]
 
+    updates = {}
     for uri, name, desc, meta, quest_meta in zip(uris, display_name, description, metadata, quest_metadata):
         if quest_meta is None:
             quest_meta = {}
@@ -156,8 +186,16 @@ def update_metadata(uris, display_name=None, description=None,
         if meta:
             quest_meta.update({'metadata': meta})
 
+        updates[uri] = quest_meta
+
+    if resource == UriType.DATASET:
+        errors = update_datasets(updates)
+        if errors:
+            raise ValueError('; '.join('{}: {}'.format(k, v) for k, v in errors.items()))
+    else:
         with db_session:
-            entity = get_db_entity(uri)
-            entity.set(**quest_meta)
+            for uri, quest_meta in updates.items():
+                entity = get_db_entity(uri)
+                entity.set(**quest_meta)
 
     return get_metadata(uris)
@@ -4,7 +4,7 @@ from datetime import datetime
 
 import pandas as pd
 
-from ..util import logger, get_projects_dir, read_yaml, write_yaml
+from ..util import logger, get_projects_dir, read_yaml, write_yaml, download_cache
 from ..database.database import db_session, get_db, init_db
 
 
@@ -98,7 +98,8 @@ def new_project(name, display_name=None, description=None, metadata=None,
 def delete_project(name):
     """Delete a project.
 
-    Deletes a project and all data in the project folder.
+    Deletes a project and all data in the project folder. Downloads that datasets in the
+    project use from the download cache are released rather than removed.
 
     Args:
         name (string, Required):
@@ -120,6 +121,10 @@ def delete_project(name):
     else:
         path = folder
     if os.path.exists(path):
+        dbpath = os.path.join(path, PROJECT_DB_FILE)
+        if os.path.exists(dbpath):
+            download_cache.release(_get_download_keys(dbpath))
+
         logger.info('deleting all data under path: %s', path)
         shutil.rmtree(path)
 
@@ -341,6 +346,17 @@ def _load_project(name):
     return project
 
 
+def _get_download_keys(dbpath):
+    """Helper function to get the download cache key of each dataset in a project database.
+    """
+    db = init_db(dbpath)
+    with db_session:
+        download_keys = list(db.select('download_key FROM Dataset WHERE download_key IS NOT NULL'))
+
+    db.disconnect()
+    return download_keys
+
+
 def _load_projects():
     """load list of collections."""
     path = _get_projects_index_file()
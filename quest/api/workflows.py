@@ -5,7 +5,7 @@ from .datasets import stage_for_download, download_datasets, open_dataset, get_d
 from .catalog import search_catalog
 from .metadata import get_metadata
 from .tools import run_tool
-from ..database import get_db, db_session
+from ..database import query_datasets, hash_options
 from ..util import logger as log
 from ..static import DatasetStatus
 
@@ -18,6 +18,7 @@ def get_data(
         collection_name='default',
         expand=False,
         use_cache=True,
+        use_download_cache=False,
         max_catalog_entries=10,
         as_open_datasets=True,
         raise_on_error=False,
@@ -44,6 +45,10 @@ def get_data(
         use_cache (bool, optional, default=True):
             if True then previously downloaded datasets with the same download options will be returned
             rather than downloading new datasets
+        use_download_cache (bool, optional, default=False):
+            if True then data downloaded with the same options in any project is used rather than
+            downloading it again, and new downloads are stored in the download cache
+            (see :func:`quest.api.download_datasets`)
         max_catalog_entries (int, optional, default=10):
             the maximum number of datasets to allow in the search. If exceeded a Runtime error is raised.
         as_open_datasets (bool, optional, default=False):
@@ -97,7 +102,7 @@ def get_data(
         # download the staged datasets
         for dataset in datasets:
             try:
-                download_datasets(datasets=dataset, raise_on_error=True)
+                download_datasets(datasets=dataset, raise_on_error=True, use_cache=use_download_cache)
             except Exception as e:
                 log.exception('The following error was raised while downloading dataset {}'.format(dataset), exc_info=e)
                 if raise_on_error:
@@ -108,7 +113,7 @@ def get_data(
     if as_open_datasets:
         datasets = [open_dataset(dataset) for dataset in datasets]
     elif expand:
-        datasets = list(get_datasets(expand=True, queries=[f'name in {datasets}']).values())
+        datasets = list(get_datasets(expand=True, filters={'name': datasets}).values())
 
     return datasets
 
@@ -122,6 +127,7 @@ def get_seamless_data(
         collection_name='default',
         expand=False,
         use_cache=True,
+        use_download_cache=False,
         max_catalog_entries=10,
         as_open_dataset=True,
         raise_on_error=False,
@@ -154,6 +160,10 @@ def get_seamless_data(
         use_cache (bool, optional, default=True):
             if True then previously downloaded datasets with the same download options will be returned
             rather than downloading new datasets
+        use_download_cache (bool, optional, default=False):
+            if True then data downloaded with the same options in any project is used rather than
+            downloading it again, and new downloads are stored in the download cache
+            (see :func:`quest.api.download_datasets`)
         max_catalog_entries (int, optional, default=10):
             the maximum number of datasets to allow in the search. If exceeded a Runtime error is raised.
         as_open_dataset (bool, optional, default=False):
@@ -180,6 +190,7 @@ def get_seamless_data(
         download_options=download_options,
         collection_name=collection_name,
         use_cache=use_cache,
+        use_download_cache=use_download_cache,
         max_catalog_entries=max_catalog_entries,
         as_open_datasets=False,
         raise_on_error=raise_on_error,
@@ -227,17 +238,18 @@ def _get_cached_data(catalog_entries, download_options, collection=None):
     Returns:
         a dictionary of dataset ids mapped to provided catalog entries
     """
-    db = get_db()
-    with db_session:
-        # NOTE: d.options will not evaluate to None in the lambda expression. It therefore must be compared
-        # outside of it.
-        datasets = [d for d in db.Dataset.select(
-            lambda d: d.catalog_entry in catalog_entries and d.status == DatasetStatus.DOWNLOADED
-        ) if d.options == download_options]
-        if collection is not None:
-            datasets = [d for d in datasets if d.collection.name == collection]
+    filters = {
+        'catalog_entry': list(catalog_entries),
+        'status': DatasetStatus.DOWNLOADED,
+        'options_key': hash_options(download_options),
+    }
+    if collection is not None:
+        filters['collection'] = collection
+
+    datasets = query_datasets(filters, columns=['name', 'catalog_entry', 'options'])
 
-    return {d.catalog_entry: d.name for d in datasets}
+    # options are compared as well in case different options have the same hash
+    return {d['catalog_entry']: d['name'] for d in datasets if d['options'] == download_options}
 
 
 def _get_cached_derived_data(tool_name, tool_options):
@@ -258,11 +270,9 @@ def _get_cached_derived_data(tool_name, tool_options):
         'tool_applied': tool_name,
         'tool_options': tool_options,
     }
-    db = get_db()
-    with db_session:
-        datasets = [d.name for d in db.Dataset.select() if d.options == options] or None
+    datasets = query_datasets({'options_key': hash_options(options)}, columns=['name', 'options'])
 
-    return datasets
+    return [d['name'] for d in datasets if d['options'] == options] or None
 
 
 def _is_tile_service(service_uri):
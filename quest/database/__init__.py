@@ -1,8 +1,14 @@
 from .database import (
     init_db,
+    get_db_settings,
+    migrate_db,
+    hash_options,
     get_db,
     db_session,
     select_collections,
     select_datasets,
+    query_datasets,
     select_catalog_entries,
+    insert_datasets,
+    update_datasets,
 )
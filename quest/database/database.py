@@ -1,3 +1,7 @@
+import hashlib
+import json
+import sqlite3
+from contextlib import closing
 from datetime import datetime
 
 from pony import orm
@@ -5,6 +9,21 @@ from pony.orm import db_session
 import shapely.wkt
 
 _connection = None  # global var to hold persistant db connection
+_QUERY_BATCH_SIZE = 500  # max number of names bound to a single `in` query
+# dataset columns that `query_datasets` filters on in SQL
+DATASET_FILTER_COLUMNS = ['name', 'collection', 'status', 'datatype', 'source', 'catalog_entry', 'options_key']
+# dataset columns that are only used internally and are left out of selected datasets
+_INTERNAL_DATASET_COLUMNS = ['options_key']
+
+# default SQLite connection settings, each can be changed with the QUEST setting of the same name
+DB_SETTINGS = {
+    'DB_JOURNAL_MODE': 'WAL',  # lets readers in other processes run while a status update is written
+    'DB_SYNCHRONOUS': 'NORMAL',  # with WAL only checkpoints wait for the disk
+    'DB_BUSY_TIMEOUT': 30000,  # milliseconds to wait for a lock held by another connection
+    'DB_CACHE_SIZE': -16000,  # pages of page cache per connection, or KiB if negative
+}
+_JOURNAL_MODES = ['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF']
+_SYNCHRONOUS_MODES = ['OFF', 'NORMAL', 'FULL', 'EXTRA']
 
 
 def define_models(db):
@@ -42,15 +61,23 @@ def define_models(db):
         file_format = orm.Optional(str)
         source = orm.Optional(str)
         options = orm.Optional(orm.Json, nullable=True)
+        options_key = orm.Optional(str, nullable=True)  # see `hash_options`
         status = orm.Optional(str)
         message = orm.Optional(str)
         file_path = orm.Optional(str, nullable=True)
         visualization_path = orm.Optional(str)
+        download_key = orm.Optional(str, nullable=True)  # see `quest.util.download_cache`
 
         # setup relationships
         collection = orm.Required(Collection)
         catalog_entry = orm.Required(str)
 
+        def before_insert(self):
+            self.options_key = hash_options(self.options)
+
+        def before_update(self):
+            self.options_key = hash_options(self.options)
+
     class Providers(db.Entity):
         provider = orm.PrimaryKey(str)
         username = orm.Required(str)
@@ -103,12 +130,165 @@ def init_db(dbpath):
     """
     db = orm.Database()  # create new database object
     define_models(db)  # define entities for this database
+    db_settings = get_db_settings()
+
+    @db.on_connect(provider='sqlite')
+    def configure(db, connection):
+        configure_connection(connection, db_settings)
+
     db.bind('sqlite', dbpath, create_db=True)  # bind this database
-    db.generate_mapping(create_tables=True)
+    # tables are checked once existing databases are upgraded to the current models
+    db.generate_mapping(create_tables=True, check_tables=False)
+    migrate_db(dbpath)
+    db.check_tables()
 
     return db
 
 
+def get_db_settings():
+    """Get the settings used to configure connections to project databases.
+
+    Notes:
+        Defaults are given by `DB_SETTINGS` and can be changed with QUEST settings of the
+        same name (see :func:`quest.api.update_settings`). Changes apply to connections that
+        are opened after the database is reconnected.
+
+    Returns:
+        db_settings (dict):
+            value of each of the `DB_SETTINGS` keyed on setting name
+    """
+    from ..util.config import get_settings
+    settings = get_settings()
+
+    return {k: settings.get(k, v) for k, v in DB_SETTINGS.items()}
+
+
+def configure_connection(connection, db_settings=None):
+    """Configure a SQLite connection with the database settings.
+
+    Args:
+        connection (sqlite3.Connection, Required):
+            DB-API connection to a project database
+        db_settings (dict, Optional, Default=None):
+            database settings (see `get_db_settings`), defaults to the current settings
+    """
+    db_settings = db_settings or get_db_settings()
+
+    journal_mode = str(db_settings['DB_JOURNAL_MODE']).upper()
+    if journal_mode not in _JOURNAL_MODES:
+        raise ValueError('DB_JOURNAL_MODE must be one of {}'.format(', '.join(_JOURNAL_MODES)))
+
+    synchronous = str(db_settings['DB_SYNCHRONOUS']).upper()
+    if synchronous not in _SYNCHRONOUS_MODES:
+        raise ValueError('DB_SYNCHRONOUS must be one of {}'.format(', '.join(_SYNCHRONOUS_MODES)))
+
+    cursor = connection.cursor()
+    # the busy timeout is set first so that changing the journal mode waits for other connections
+    cursor.execute('PRAGMA busy_timeout = {:d}'.format(int(db_settings['DB_BUSY_TIMEOUT'])))
+    cursor.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+    cursor.execute('PRAGMA synchronous = {}'.format(synchronous))
+    cursor.execute('PRAGMA cache_size = {:d}'.format(int(db_settings['DB_CACHE_SIZE'])))
+    cursor.close()
+
+
+def migrate_db(dbpath):
+    """Upgrade the schema of a database in place to `SCHEMA_VERSION`.
+
+    Notes:
+        The schema version is stored as the `user_version` of the SQLite database. Each
+        migration that the database is missing is applied in order in a single transaction.
+        Migrations also run on new databases once Pony has created their tables, so they
+        must not fail if a change they make is already in place.
+
+    Args:
+        dbpath (string, Required):
+            path to the database
+
+    Returns:
+        version (int):
+            schema version of the database
+    """
+    with closing(sqlite3.connect(dbpath, isolation_level=None)) as connection:
+        configure_connection(connection)
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return version
+
+        dataset_table = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Dataset'"
+        ).fetchone()
+        if dataset_table is None:
+            # tables have not been created yet
+            return version
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for migration in MIGRATIONS[version:]:
+                migration(connection)
+            connection.execute('PRAGMA user_version = {:d}'.format(SCHEMA_VERSION))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    return SCHEMA_VERSION
+
+
+def hash_options(options):
+    """Hash the options of a dataset so that datasets with equal options can be looked up by index.
+
+    Args:
+        options (dict, Required):
+            options of the dataset
+
+    Returns:
+        key (string):
+            hex digest of the canonical JSON encoding of the options, or None if options is None
+    """
+    if options is None:
+        return None
+
+    encoded = json.dumps(options, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def _add_options_key(connection):
+    """Migration adding the hashed `options_key` of datasets and indexes for the common dataset lookups.
+    """
+    columns = [row[1] for row in connection.execute('PRAGMA table_info("Dataset")')]
+    if 'options_key' not in columns:
+        connection.execute('ALTER TABLE "Dataset" ADD COLUMN "options_key" TEXT')
+
+    rows = connection.execute('SELECT "name", "options" FROM "Dataset"').fetchall()
+    connection.executemany('UPDATE "Dataset" SET "options_key" = ? WHERE "name" = ?', [
+        (hash_options(None if options is None else json.loads(options)), name) for name, options in rows
+    ])
+
+    for name, columns in [('catalog_entry_status_options_key', ['catalog_entry', 'status', 'options_key']),
+                          ('collection_status', ['collection', 'status']),
+                          ('status', ['status']),
+                          ('options_key', ['options_key'])]:
+        connection.execute('CREATE INDEX IF NOT EXISTS "idx_dataset__{}" ON "Dataset" ({})'.format(
+            name, ', '.join('"{}"'.format(c) for c in columns)
+        ))
+
+
+def _add_download_key(connection):
+    """Migration adding the `download_key` of datasets whose file is stored in the download cache.
+    """
+    columns = [row[1] for row in connection.execute('PRAGMA table_info("Dataset")')]
+    if 'download_key' not in columns:
+        connection.execute('ALTER TABLE "Dataset" ADD COLUMN "download_key" TEXT')
+
+
+# MIGRATIONS[i] upgrades a database from schema version i to i + 1
+MIGRATIONS = [
+    _add_options_key,
+    _add_download_key,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
 def select_collections(select_func=None):
     """
     Args:
@@ -138,13 +318,60 @@ def select_datasets(select_func=None):
         else:
             datasets = db.Dataset.select(select_func)
 
-        return [dict(d.to_dict(), **{'collection': d.collection.name,
+        return [dict(d.to_dict(exclude=_INTERNAL_DATASET_COLUMNS), **{'collection': d.collection.name,
                                      'options': _convert_to_dict(d.options),
                                      'metadata': _convert_to_dict(d.metadata),
                                      }
                      ) for d in datasets]
 
 
+def query_datasets(filters=None, columns=None):
+    """Select datasets, filtering them in SQL and only loading the requested columns.
+
+    Args:
+        filters (dict, Optional, Default=None):
+            value that datasets must have keyed on any of `DATASET_FILTER_COLUMNS`. A list of
+            values matches datasets with any of the values.
+        columns (list, Optional, Default=None):
+            dataset fields to return, defaults to all fields
+
+    Returns:
+        datasets (list):
+            dicts of the requested fields of each matching dataset
+    """
+    db = get_db()
+    attrs = {attr.name: attr for attr in db.Dataset._attrs_ if attr.column}
+    columns = list(columns or [c for c in attrs if c not in _INTERNAL_DATASET_COLUMNS])
+    filters = dict(filters or {})
+
+    invalid = [c for c in columns if c not in attrs] + [f for f in filters if f not in DATASET_FILTER_COLUMNS]
+    if invalid:
+        raise ValueError('Invalid dataset fields: {}'.format(', '.join(invalid)))
+
+    # split the longest list of values into batches, so queries don't bind too many parameters
+    batched = max(filters, key=lambda f: len(filters[f]) if isinstance(filters[f], (list, tuple, set)) else 0,
+                  default=None)
+    batches = [filters]
+    if batched is not None and isinstance(filters[batched], (list, tuple, set)):
+        values = list(dict.fromkeys(filters[batched]))
+        batches = [dict(filters, **{batched: values[i:i + _QUERY_BATCH_SIZE]})
+                   for i in range(0, len(values), _QUERY_BATCH_SIZE)]
+
+    select = 'SELECT {} FROM "{}"'.format(', '.join('"{}"'.format(attrs[c].column) for c in columns),
+                                          db.Dataset._table_)
+    converters = [_sql_to_python(attrs[c]) for c in columns]
+
+    rows = []
+    with db_session:
+        cursor = db.get_connection().cursor()
+        for batch in batches:
+            where, params = _where_clause({attrs[f].column: v for f, v in batch.items()})
+            cursor.execute(select + where, params)
+            rows.extend(cursor.fetchall())
+
+    return [{c: convert(v) for c, convert, v in zip(columns, converters, row)} for row in rows]
+
+
 def select_catalog_entries(select_func=None):
     """
     Args:
@@ -163,6 +390,137 @@ def select_catalog_entries(select_func=None):
                      ) for e in catalog_entries]
 
 
+def insert_datasets(datasets):
+    """Insert datasets in a single transaction.
+
+    Notes:
+        Datasets that can't be inserted (i.e. their name already exists or their collection
+        doesn't) are skipped and reported, the rest are still inserted.
+
+    Args:
+        datasets (list):
+            dicts of the attributes of each dataset, each with at least `name`, `collection`
+            and `catalog_entry`
+
+    Returns:
+        errors (dict):
+            error message of each dataset that could not be inserted keyed on dataset name
+    """
+    db = get_db()
+    errors = {}
+    with db_session:
+        names = [d.get('name') for d in datasets]
+        existing = _select_names(db.Dataset, names)
+        collections = _select_names(db.Collection, {d.get('collection') for d in datasets})
+
+        for dataset in datasets:
+            name = dataset.get('name')
+            if name in existing:
+                errors[name] = 'Dataset {} already exists'.format(name)
+                continue
+            if dataset.get('collection') not in collections:
+                errors[name] = 'Collection {} does not exist'.format(dataset.get('collection'))
+                continue
+            try:
+                db.Dataset(**dataset)
+            except (ValueError, TypeError, orm.OrmError) as e:
+                errors[name] = str(e)
+                continue
+            existing.add(name)
+
+    return errors
+
+
+def update_datasets(updates):
+    """Update the attributes of datasets in a single transaction.
+
+    Notes:
+        Datasets that can't be updated (i.e. they don't exist or an attribute is invalid)
+        are left unchanged and reported, the rest are still updated.
+
+    Args:
+        updates (dict):
+            dicts of the attributes to set on each dataset keyed on dataset name
+
+    Returns:
+        errors (dict):
+            error message of each dataset that could not be updated keyed on dataset name
+    """
+    db = get_db()
+    errors = {}
+    with db_session:
+        names = list(updates)
+        datasets = {}
+        # load the datasets in batches rather than one query per dataset
+        for i in range(0, len(names), _QUERY_BATCH_SIZE):
+            batch = names[i:i + _QUERY_BATCH_SIZE]
+            datasets.update((d.name, d) for d in db.Dataset.select(lambda d: d.name in batch))
+
+        for name, attributes in updates.items():
+            dataset = datasets.get(name)
+            if dataset is None:
+                errors[name] = 'Dataset {} does not exist'.format(name)
+                continue
+            try:
+                dataset.set(**attributes)
+            except (ValueError, TypeError, orm.OrmError) as e:
+                errors[name] = str(e)
+
+    return errors
+
+
+def _select_names(entity, names):
+    """Helper function to get which of the names exist as entities, querying them in batches.
+    """
+    names = list(names)
+    existing = set()
+    for i in range(0, len(names), _QUERY_BATCH_SIZE):
+        batch = names[i:i + _QUERY_BATCH_SIZE]
+        existing.update(e.name for e in entity.select(lambda e: e.name in batch))
+
+    return existing
+
+
+def _where_clause(filters):
+    """Helper function to compile equality filters keyed on column into a SQL WHERE clause and its parameters.
+    """
+    conditions, params = [], []
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            value = list(value)
+            if value:
+                conditions.append('"{}" IN ({})'.format(column, ', '.join(['?'] * len(value))))
+            else:
+                conditions.append('0')
+            params.extend(value)
+        elif value is None:
+            conditions.append('"{}" IS NULL'.format(column))
+        else:
+            conditions.append('"{}" = ?'.format(column))
+            params.append(value)
+
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    return where, params
+
+
+def _sql_to_python(attr):
+    """Helper function to get a function that converts values of a raw query to the type of an attribute.
+    """
+    if attr.py_type is orm.Json:
+        return lambda v: v if v is None else json.loads(v)
+    if attr.py_type is datetime:
+        return lambda v: v if v is None else _sql_to_datetime(v)
+    return lambda v: v
+
+
+def _sql_to_datetime(value):
+    """Helper function to parse a datetime the way it is stored by SQLite, with or without microseconds.
+    """
+    fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S'
+    return datetime.strptime(value, fmt)
+
+
 def _convert_to_dict(tracked_dict):
     """
     Recursively convert a Pony ORM TrackedDict to a normal Python dict
@@ -14,6 +14,7 @@ class ProviderBase(metaclass=abc.ABCMeta):
     organization_name = None
     organization_abbr = None
     use_cache = True
+    update_frequency = None
 
     @property
     def services(self):
@@ -57,10 +58,12 @@ class ProviderBase(metaclass=abc.ABCMeta):
 
         return self._credentials
 
-    def __init__(self, name=None, use_cache=None, update_frequency='M'):
+    def __init__(self, name=None, use_cache=None, update_frequency=None):
         self.name = name or self.name
         self.use_cache = use_cache or self.use_cache
-        self.update_frequency = update_frequency  # not implemented
+        # pandas frequency alias of how often cached catalogs are refreshed, or None to never refresh them
+        # (see `ServiceBase.refresh_catalog`)
+        self.update_frequency = update_frequency or self.update_frequency
         self._services = None
         self._publishers = None
         self._credentials = None
@@ -73,9 +76,29 @@ class ProviderBase(metaclass=abc.ABCMeta):
         """
         return self.services[service].search_catalog_wrapper(update_cache=update_cache, **kwargs)
 
+    def get_catalog_entries(self, service, service_ids, update_cache=False, **kwargs):
+        """Get the catalog_entries associated with service that have the given service ids.
+        """
+        return self.services[service].get_catalog_entries(service_ids, update_cache=update_cache, **kwargs)
+
+    def get_catalog_metadata(self, service, service_ids=None, columns=None, update_cache=False, **kwargs):
+        """Get the metadata side table of catalog_entries associated with service.
+        """
+        return self.services[service].get_catalog_metadata(service_ids=service_ids, columns=columns,
+                                                           update_cache=update_cache, **kwargs)
+
+    def get_token_index(self, service, update_cache=False, **kwargs):
+        return self.services[service].get_token_index(update_cache=update_cache, **kwargs)
+
+    def refresh_catalog(self, service, **kwargs):
+        return self.services[service].refresh_catalog(**kwargs)
+
     def get_tags(self, service, update_cache=False):
         return self.services[service].get_tags(update_cache=update_cache)
 
+    def get_tag_index(self, service, update_cache=False, **kwargs):
+        return self.services[service].get_tag_index(update_cache=update_cache, **kwargs)
+
     def get_services(self):
         return {k: v.metadata for k, v in self.services.items()}
 
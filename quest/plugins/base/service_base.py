@@ -1,12 +1,14 @@
 import json
 import os
-import pickle
 
 import ulmo
 import param
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import box, Point
+import shapely
+import shapely.wkt
+from shapely.geometry import shape
 
 from quest import util
 
@@ -35,6 +37,25 @@ reserved_geometry_fields = [
 reserved_catalog_entry_fields.extend(reserved_geometry_fields)
 
 
+def _geometry_from_string(geometry):
+    try:
+        return shape(json.loads(geometry))
+    except ValueError:
+        return shapely.wkt.loads(geometry)
+
+
+def _chunks_or_empty(chunks):
+    """Helper function to yield the chunks of a catalog, or a single empty chunk if there are none.
+    """
+    empty = True
+    for chunk in chunks:
+        empty = False
+        yield chunk
+
+    if empty:
+        yield pd.DataFrame()
+
+
 class ServiceBase(param.Parameterized):  # TODO can I make this an abc and have it be a Paramitarized?
     """Base class for data providers
     """
@@ -47,7 +68,9 @@ class ServiceBase(param.Parameterized):  # TODO can I make this an abc and have
     datatype = None
     geographical_areas = None
     bounding_boxes = None
+    native_filters = None
     _parameter_map = None
+    _update_frequency = None
 
     # name = param.String(default='Service', precedence=-1)
 
@@ -63,6 +86,14 @@ class ServiceBase(param.Parameterized):  # TODO can I make this an abc and have
     def use_cache(self):
         return self.provider.use_cache
 
+    @property
+    def update_frequency(self):
+        return self._update_frequency or self.provider.update_frequency
+
+    @property
+    def catalog_cache_file(self):
+        return util.catalog_cache.catalog_cache_file(util.get_cache_dir(self.provider.name), self.name)
+
     @property
     def metadata(self):
         return {
@@ -125,40 +156,327 @@ class ServiceBase(param.Parameterized):  # TODO can I make this an abc and have
     def download(self, catalog_id, file_path, dataset, **kwargs):
         raise NotImplementedError()
 
-    def search_catalog_wrapper(self, update_cache=False, **kwargs):
+    def search_catalog_wrapper(self, update_cache=False, tolerance=None, **kwargs):
         """Get catalog_entries associated with service.
 
         Take a series of query parameters and return a list of
         locations as a geojson python dictionary
+
+        Search filters listed in `native_filters` are passed on to `search_catalog` when the
+        full catalog has not been cached yet, so that only the matching part of the catalog
+        is fetched. Partial catalogs are cached separately for each set of filters. The
+        returned catalog may still contain entries that do not match the filters; exact
+        filtering is done by `quest.api.search_catalog`.
+
+        Metadata fields are not included in the returned catalog, they are kept in a side
+        table that can be read with `get_catalog_metadata`.
+
+        Once the cached catalog is older than `update_frequency` it is still returned, but it
+        is refreshed in the background (see `refresh_catalog`).
+
+        With a `tolerance`, catalogs of lines or polygons are returned with the geometries
+        simplified to the tolerance that are stored in the cache instead of the exact geometries
+        (see `quest.util.catalog_cache.read_catalog`).
         """
-        cache_file = os.path.join(util.get_cache_dir(self.provider.name), self.name + '_catalog.p')
+        cache_file, filters = self._get_catalog_cache_file(**kwargs)
+
         if self.use_cache and not update_cache:
+            if util.catalog_cache.is_stale(cache_file, self.update_frequency):
+                util.catalog_cache.refresh_in_background(cache_file, self.refresh_catalog, cache_file=cache_file,
+                                                         **filters)
+
+            bbox = kwargs.get('bbox')
+            catalog_entries = util.catalog_cache.get_memoized_catalog(self.provider.name, self.name, cache_file,
+                                                                      bbox=bbox)
+            if catalog_entries is not None:
+                return self._simplify_geometries(catalog_entries, cache_file, tolerance)
+
             try:
-                catalog_entries = pd.read_pickle(cache_file)
+                if not os.path.exists(util.catalog_cache.metadata_cache_file(cache_file)):
+                    raise IOError('No metadata cache found for {}'.format(cache_file))
+
+                # only whole catalogs are memoized; bbox searches just read the rows they need
+                mtime = util.catalog_cache.catalog_mtime(cache_file)
+                catalog_entries = util.catalog_cache.read_catalog(cache_file, bbox=bbox, tolerance=tolerance)
                 self._label_catalog_entries(catalog_entries)
 
                 # convert to GeoPandas GeoDataFrame
                 catalog_entries = gpd.GeoDataFrame(catalog_entries, geometry='geometry')
 
+                if bbox is None and tolerance is None:
+                    util.catalog_cache.memoize_catalog(self.provider.name, self.name, cache_file, catalog_entries,
+                                                       mtime)
+
                 return catalog_entries
             except Exception as e:
                 util.logger.info(e)
                 util.logger.info('updating cache')
 
-        catalog_entries = self.search_catalog(**kwargs)
+        catalog_entries, _ = self._build_catalog(cache_file, filters)
+
+        return self._simplify_geometries(catalog_entries, cache_file, tolerance)
+
+    def get_catalog_entries(self, service_ids, update_cache=False, tolerance=None, **kwargs):
+        """Get the catalog_entries associated with service that have the given service ids.
+
+        Only the requested entries are read from the cached catalog, unless the whole
+        catalog is already in memory.
+
+        Args:
+            service_ids (list, Required):
+                service ids of the catalog_entries to get
+            update_cache (bool, Optional, Default=False):
+                if True, update the catalog cache
+            tolerance (float, Optional, Default=None):
+                tolerance of the simplified geometries to return (see `search_catalog_wrapper`)
+            **kwargs:
+                search filters used to select the cached catalog (see `search_catalog_wrapper`)
+
+        Returns:
+            catalog_entries (geopandas.GeoDataFrame):
+                the catalog_entries (see `search_catalog_wrapper`)
+        """
+        service_ids = [str(service_id) for service_id in util.listify(service_ids)]
+        cache_file, filters = self._get_catalog_cache_file(**kwargs)
+
+        if self.use_cache and not update_cache and os.path.exists(cache_file) \
+                and os.path.exists(util.catalog_cache.metadata_cache_file(cache_file)) \
+                and not util.catalog_cache.is_memoized(self.provider.name, self.name, cache_file):
+            if util.catalog_cache.is_stale(cache_file, self.update_frequency):
+                util.catalog_cache.refresh_in_background(cache_file, self.refresh_catalog, cache_file=cache_file,
+                                                         **filters)
+
+            catalog_entries = util.catalog_cache.read_catalog(cache_file, service_ids=service_ids, tolerance=tolerance)
+            self._label_catalog_entries(catalog_entries)
+
+            return gpd.GeoDataFrame(catalog_entries, geometry='geometry')
+
+        catalog_entries = self.search_catalog_wrapper(update_cache=update_cache, tolerance=tolerance, **kwargs)
+
+        return catalog_entries[catalog_entries['service_id'].isin(service_ids)]
+
+    def get_catalog_metadata(self, service_ids=None, columns=None, update_cache=False, **kwargs):
+        """Get the metadata of catalog_entries associated with service.
+
+        Metadata fields are stored as typed columns in a side table next to the cached
+        catalog, so metadata can be filtered on without building a dict for every entry.
+
+        Args:
+            service_ids (list, Optional, Default=None):
+                service ids of the catalog_entries to get metadata for. Defaults to all catalog_entries.
+            columns (list, Optional, Default=None):
+                metadata fields to get. Defaults to all fields.
+            update_cache (bool, Optional, Default=False):
+                if True, update the catalog cache
+            **kwargs:
+                search filters used to select the cached catalog (see `search_catalog_wrapper`)
+
+        Returns:
+            metadata (pandas.DataFrame):
+                metadata with a column for each field, indexed by catalog_entry uri
+        """
+        cache_file, filters = self._get_catalog_cache_file(**kwargs)
+
+        if self.use_cache and not update_cache and os.path.exists(cache_file) \
+                and os.path.exists(util.catalog_cache.metadata_cache_file(cache_file)):
+            metadata = util.catalog_cache.read_metadata(cache_file, columns=columns, service_ids=service_ids)
+        else:
+            _, metadata = self._build_catalog(cache_file, filters)
+            if service_ids is not None:
+                metadata = metadata[metadata['service_id'].isin([str(s) for s in util.listify(service_ids)])]
+            if columns is not None:
+                metadata = metadata[[c for c in metadata.columns if c in columns or c == 'service_id']]
+
+        metadata = metadata.set_index(util.construct_service_uri(self.provider.name, self.name) + '/'
+                                      + metadata['service_id'])
+        del metadata['service_id']
+
+        return metadata
+
+    def get_token_index(self, update_cache=False, **kwargs):
+        """Get an index of the words in the text fields and metadata of catalog_entries associated with service.
+
+        Args:
+            update_cache (bool, Optional, Default=False):
+                if True, update the catalog cache
+            **kwargs:
+                search filters used to select the cached catalog (see `search_catalog_wrapper`)
+
+        Returns:
+            index (quest.util.text_index.TokenIndex):
+                index of the catalog_entries by service_id
+        """
+        cache_file, filters = self._get_catalog_cache_file(**kwargs)
+
+        if self.use_cache and not update_cache and os.path.exists(cache_file) \
+                and os.path.exists(util.catalog_cache.metadata_cache_file(cache_file)):
+            return util.text_index.get_token_index(cache_file)
+
+        catalog_entries, metadata = self._build_catalog(cache_file, filters)
+        catalog_entries = pd.concat([pd.DataFrame(catalog_entries).reset_index(drop=True),
+                                     metadata.drop('service_id', axis=1)], axis=1)
+
+        return util.text_index.TokenIndex.build(catalog_entries)
+
+    def _get_catalog_cache_file(self, **kwargs):
+        """Helper function to select the cache file for a search and the filters to fetch it with.
+        """
+        cache_file = self.catalog_cache_file
+        filters = self._get_native_filters(**kwargs)
+        if filters and not os.path.exists(cache_file):
+            cache_file = util.catalog_cache.catalog_cache_file(
+                util.get_cache_dir(self.provider.name), self.name, filters=filters
+            )
+        else:
+            filters = {}
+
+        return cache_file, filters
+
+    def refresh_catalog(self, cache_file=None, **kwargs):
+        """Refresh the cached catalog.
+
+        Services that implement `get_catalog_updates` only fetch the catalog_entries that
+        changed since the last refresh and merge them into the cached catalog, otherwise
+        the whole catalog is fetched again.
+
+        Args:
+            cache_file (string, Optional, Default=None):
+                the cache file to refresh, which must have been fetched with the search filters.
+                Defaults to the cache file that the search filters select.
+            **kwargs:
+                search filters used to select the cached catalog (see `search_catalog_wrapper`)
+        """
+        if cache_file is None:
+            cache_file, filters = self._get_catalog_cache_file(**kwargs)
+        else:
+            filters = self._get_native_filters(**kwargs)
+        since = util.catalog_cache.catalog_refreshed_at(cache_file)
+        if since is not None:
+            try:
+                return self._update_catalog(cache_file, filters, since)
+            except NotImplementedError:
+                pass
+
+        self._write_catalog(cache_file, filters)
+
+    def get_catalog_updates(self, since, **kwargs):
+        """
+        should return catalog_entries that were added or changed since `since` in the
+        same format as `search_catalog`. Services that can query for changed entries
+        should override this to enable incremental refreshes of the cached catalog.
 
-        # convert geometry into shapely objects
+        `since` is a naive UTC pandas.Timestamp of the last refresh. Filters named in
+        `native_filters` are passed as kwargs like for `search_catalog`.
+        """
+        raise NotImplementedError()
+
+    def _update_catalog(self, cache_file, filters, since):
+        """Helper function to merge the catalog_entries that changed since the last refresh into the cache.
+        """
+        updates = self.get_catalog_updates(since, **filters)
+        if updates.empty:
+            # mark the cache as refreshed
+            os.utime(cache_file)
+            for index_file in [util.catalog_cache.id_index_file(cache_file),
+                               util.text_index.token_index_file(cache_file),
+                               util.tag_index.tag_index_file(cache_file)]:
+                if os.path.exists(index_file):
+                    os.utime(index_file)
+            return
+
+        updates, metadata = self._normalize_catalog(updates)
+        updated_ids = updates['service_id'].astype(str)
+
+        catalog_entries = util.catalog_cache.read_catalog(cache_file)
+        catalog_entries = pd.concat([
+            catalog_entries[~catalog_entries['service_id'].isin(updated_ids)],
+            updates.reset_index(drop=True),
+        ], ignore_index=True)
+        catalog_entries['parameters'] = catalog_entries['parameters'].astype(str).astype('category')
+
+        cached_metadata = util.catalog_cache.read_metadata(cache_file)
+        replaced = cached_metadata['service_id'].isin(updated_ids)
+        tags = util.tag_index.update_tag_index(util.tag_index.read_tag_index(cache_file),
+                                               removed=cached_metadata[replaced], added=metadata)
+        metadata = pd.concat([cached_metadata[~replaced], metadata], ignore_index=True)
+
+        util.catalog_cache.write_catalog(catalog_entries, cache_file, metadata=metadata)
+        util.text_index.write_token_index(cache_file, catalog_entries, metadata)
+        util.tag_index.write_tag_index(cache_file, tags)
+        util.catalog_cache.clear_memory_cache(self.provider.name, self.name)
+
+    def _build_catalog(self, cache_file, filters):
+        """Helper function to fetch and normalize the catalog and write it to the cache.
+
+        Returns:
+            A tuple of the labeled catalog_entries and the metadata side table.
+        """
+        if self.use_cache:
+            self._write_catalog(cache_file, filters)
+            mtime = util.catalog_cache.catalog_mtime(cache_file)
+            catalog_entries = util.catalog_cache.read_catalog(cache_file)
+            metadata = util.catalog_cache.read_metadata(cache_file)
+        else:
+            catalog_entries, metadata = self._normalize_catalog(self.search_catalog(**filters))
+
+        self._label_catalog_entries(catalog_entries)
+
+        # convert to GeoPandas GeoDataFrame
+        catalog_entries = gpd.GeoDataFrame(catalog_entries, geometry='geometry')
+
+        if self.use_cache:
+            util.catalog_cache.memoize_catalog(self.provider.name, self.name, cache_file, catalog_entries, mtime)
+
+        return catalog_entries, metadata.reset_index(drop=True)
+
+    def _write_catalog(self, cache_file, filters):
+        """Helper function to fetch the catalog a chunk at a time and write it to the cache.
+
+        Each chunk yielded by `search_catalog_chunks` is normalized and written on its own, and
+        the token and tag indexes are built up a chunk at a time, so the whole catalog is never
+        held in memory.
+        """
+        util.catalog_cache.clear_memory_cache(self.provider.name, self.name)
+        seen = set()
+        token_indexes = []
+        tags = None
+
+        with util.catalog_cache.CatalogWriter(cache_file) as writer:
+            for chunk in _chunks_or_empty(self.search_catalog_chunks(**filters)):
+                catalog_entries, metadata = self._normalize_catalog(pd.DataFrame(chunk))
+                service_ids = catalog_entries['service_id'].astype(str)
+                keep = (~service_ids.isin(seen) & ~service_ids.duplicated()).values
+                if not keep.all():
+                    catalog_entries, metadata = catalog_entries[keep], metadata[keep]
+                seen.update(service_ids[keep])
+
+                writer.write(catalog_entries, metadata=metadata)
+                token_indexes.append(util.text_index.build_token_index(catalog_entries, metadata))
+                if tags is None:
+                    tags = util.tag_index.build_tag_index(metadata)
+                else:
+                    tags = util.tag_index.update_tag_index(tags, added=metadata)
+
+        util.text_index.TokenIndex.concat(token_indexes).save(util.text_index.token_index_file(cache_file))
+        util.tag_index.write_tag_index(cache_file, tags)
+
+    def _normalize_catalog(self, catalog_entries):
+        """Helper function to convert catalog_entries returned by `search_catalog` to the cached format.
+
+        Returns:
+            A tuple of the catalog_entries and the metadata side table, both with a `service_id` column.
+        """
+        # convert geometry into shapely objects, building them from whole coordinate arrays at once
         if 'bbox' in catalog_entries.columns:
-            catalog_entries['geometry'] = catalog_entries['bbox'].apply(lambda row: box(*[float(x) for x in row]))
+            bounds = np.array(catalog_entries['bbox'].tolist(), dtype=float).reshape(-1, 4)
+            catalog_entries['geometry'] = shapely.box(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3])
             del catalog_entries['bbox']
 
         if {'latitude', 'longitude'}.issubset(catalog_entries.columns):
-            def fn(row):
-                return Point((
-                    float(row['longitude']),
-                    float(row['latitude'])
-                ))
-            catalog_entries['geometry'] = catalog_entries.apply(fn, axis=1)
+            catalog_entries['geometry'] = shapely.points(
+                pd.to_numeric(catalog_entries['longitude']).values.astype(float),
+                pd.to_numeric(catalog_entries['latitude']).values.astype(float),
+            )
             del catalog_entries['latitude']
             del catalog_entries['longitude']
 
@@ -170,9 +488,10 @@ class ServiceBase(param.Parameterized):  # TODO can I make this an abc and have
             # del catalog_entries['longitude']
 
         if 'geometry' in catalog_entries.columns:
-            pass
-            # The following line doesn't have any effect (except perhaps to validate the geometry)
-            # catalog_entries['geometry'].apply(shape)
+            # geometries can be provided as geojson or wkt strings
+            idx = catalog_entries['geometry'].apply(lambda x: isinstance(x, str))
+            if idx.any():
+                catalog_entries.loc[idx, 'geometry'] = catalog_entries.loc[idx, 'geometry'].apply(_geometry_from_string)
 
         if 'geometry' not in catalog_entries.columns:
             catalog_entries['geometry'] = None
@@ -184,35 +503,51 @@ class ServiceBase(param.Parameterized):  # TODO can I make this an abc and have
         if 'description' not in catalog_entries.columns:
             catalog_entries['description'] = ''
 
-        # merge extra data columns/fields into metadata as a dictionary
-        extra_fields = list(set(catalog_entries.columns.tolist()) - set(reserved_catalog_entry_fields))
-        # change NaN to None so it can be JSON serialized properly
-        catalog_entries['metadata'] = json.loads(catalog_entries[extra_fields].to_json(orient='records'))
-        catalog_entries.drop(extra_fields, axis=1, inplace=True)
-        columns = list(set(catalog_entries.columns.tolist()).intersection(reserved_geometry_fields))
-        catalog_entries.drop(columns, axis=1, inplace=True)
+        # move extra data columns/fields into the metadata side table
+        extra_fields = [c for c in catalog_entries.columns if c not in reserved_catalog_entry_fields]
+        metadata = catalog_entries[extra_fields]
+        columns = [c for c in catalog_entries.columns if c in reserved_geometry_fields]
+        catalog_entries = catalog_entries.drop(extra_fields + columns, axis=1)
 
         params = self.get_parameters(catalog_ids=catalog_entries)
         if isinstance(params, pd.DataFrame):
-            groups = params.groupby('service_id').groups
-            catalog_entries['parameters'] = catalog_entries.index.map(
-                lambda x: ','.join(filter(None, params.loc[groups[x]]['parameter'].tolist()))
-                if x in groups.keys() else ''
-            )
+            # join the parameters of all sites in a single groupby
+            params = params[params['parameter'].notnull() & (params['parameter'] != '')]
+            parameters = params['parameter'].astype(str).groupby(params['service_id'], sort=False).agg(','.join)
+            catalog_entries['parameters'] = catalog_entries.index.map(parameters).fillna('')
         else:
             catalog_entries['parameters'] = ','.join(params['parameters'])
 
-        if self.use_cache:
-            # write to cache_file
-            os.makedirs(os.path.split(cache_file)[0], exist_ok=True)
-            catalog_entries.to_pickle(cache_file)
+        # sites share a small number of distinct parameter combinations
+        catalog_entries['parameters'] = catalog_entries['parameters'].astype('category')
 
-        self._label_catalog_entries(catalog_entries)
+        if 'service_id' not in catalog_entries.columns:
+            catalog_entries['service_id'] = catalog_entries.index
+        metadata = metadata.assign(service_id=catalog_entries['service_id'].astype(str).values)
 
-        # convert to GeoPandas GeoDataFrame
-        catalog_entries = gpd.GeoDataFrame(catalog_entries, geometry='geometry')
+        return catalog_entries, metadata
+
+    def _simplify_geometries(self, catalog_entries, cache_file, tolerance):
+        """Helper function for `search_catalog_wrapper` to replace geometries with the simplified geometries in the
+        cache.
+        """
+        if tolerance is None or not self.use_cache or catalog_entries.empty:
+            return catalog_entries
+
+        geometries = util.catalog_cache.read_geometries(cache_file, tolerance)
+        if geometries is None:
+            return catalog_entries
 
-        return catalog_entries
+        return catalog_entries.assign(geometry=geometries.reindex(catalog_entries['service_id'].values).values)
+
+    def _get_native_filters(self, **kwargs):
+        """Helper function for `search_catalog_wrapper` to select the filters that `search_catalog` can evaluate.
+        """
+        filters = {k: v for k, v in kwargs.items() if k in (self.native_filters or []) and v is not None}
+        if 'bbox' in filters:
+            filters['bbox'] = [float(x) for x in util.listify(filters['bbox'])]
+
+        return filters
 
     def _label_catalog_entries(self, catalog_entries):
         catalog_entries['service'] = util.construct_service_uri(self.provider.name, self.name)
@@ -227,6 +562,11 @@ class ServiceBase(param.Parameterized):  # TODO can I make this an abc and have
         should return a pandas dataframe or a python dictionary with
         indexed by catalog_entry uid and containing the following columns
 
+        filters named in `native_filters` (e.g. bbox, parameter, geom_type) are
+        passed as kwargs and may be used to only fetch part of the catalog. The
+        result must include every entry that matches the filters, but may include
+        others.
+
         reserved column/field names
             display_name -> will be set to uid if not provided
             description -> will be set to '' if not provided
@@ -238,81 +578,62 @@ class ServiceBase(param.Parameterized):  # TODO can I make this an abc and have
                 3) geometry_type, latitudes, longitudes columns/fields
                 4) bbox column/field -> tuple with order (lon min, lat min, lon max, lat max)
 
-        all other columns/fields will be accumulated in a dict and placed
-        in a metadata field.
+        all other columns/fields will be stored as metadata fields in a
+        side table (see `get_catalog_metadata`).
         :param **kwargs:
 
         """
         raise NotImplementedError()
 
-    def get_tags(self, update_cache=False):
-        cache_file = os.path.join(util.get_cache_dir(self.provider.name), self.name + '_tags.p')
-        if self.use_cache and not update_cache:
-            try:
-                with open(cache_file, 'rb') as cache:
-                    tags = pickle.load(cache)
-                return tags
-            except:
-                util.logger.info('updating tag cache')
-
-        catalog_entries = self.search_catalog_wrapper(update_cache=update_cache)
-        metadata = pd.DataFrame(list(catalog_entries.metadata))
+    def search_catalog_chunks(self, **kwargs):
+        """
+        should yield the catalog in chunks (i.e. per state, page or file) in the same
+        format as `search_catalog`. The catalog cache is built a chunk at a time, so
+        services with large catalogs should override this to bound the memory used to
+        build the cache by the size of a chunk. Entries that are in more than one chunk
+        are taken from the first chunk they are in.
 
-        # drop metadata fields that are unusable as tag fields
-        metadata.drop(labels=['location', 'coverages'], axis=1, inplace=True, errors='ignore')
+        by default the whole catalog returned by `search_catalog` is a single chunk.
+        :param **kwargs:
 
-        tags = {}
-        for tag in metadata.columns:
-            try:
-                tags[tag] = list(metadata[tag].unique())
-
-                # make sure datetime values are serialized (for RPC server)
-                tags[tag] = json.loads(json.dumps(tags[tag], default=util.to_json_default_handler))
-            except TypeError:
-                values = list(metadata[tag])
-                new_tags = dict()
-                new_tags[tag] = list()
-                for v in values:
-                    if isinstance(v, dict):
-                        self._combine_dicts(new_tags, self._get_tags_from_dict(tag, v))
-                    else:
-                        new_tags[tag].append(v)
-                if not new_tags[tag]:
-                    del new_tags[tag]
-                tags.update({k: list(set(v)) for k, v in new_tags.items()})
+        """
+        yield self.search_catalog(**kwargs)
 
-        if self.use_cache:
-            # write to cache_file
-            with open(cache_file, 'wb') as cache:
-                pickle.dump(tags, cache)
+    def get_tags(self, update_cache=False):
+        """Get the values of the metadata fields (tags) of catalog_entries associated with service.
 
-        return tags
+        Args:
+            update_cache (bool, Optional, Default=False):
+                if True, update the catalog cache
 
-    def _get_tags_from_dict(self, tag, d):
-        """Helper function for `get_tags` to recursively parse dicts and add them as multi-indexed tags
+        Returns:
+            tags (dict):
+                dict keyed by tag of a list of values, from the most to the least common
         """
-        tags = dict()
-        for k, v in d.items():
-            new_tag = '{}:{}'.format(tag, k)
-            if isinstance(v, dict):
-                self._combine_dicts(tags, self._get_tags_from_dict(new_tag, v))
-            else:
-                tags[new_tag] = v
-
-        return tags
-
-    def _combine_dicts(self, this, other):
-        """Helper function for `get_tags` to combine dictionaries by aggregating values rather than overwriting them.
+        return util.tag_index.tags_to_dict(self.get_tag_index(update_cache=update_cache))
+
+    def get_tag_index(self, update_cache=False, **kwargs):
+        """Get the number of catalog_entries associated with service that have each value of each tag.
+
+        Args:
+            update_cache (bool, Optional, Default=False):
+                if True, update the catalog cache
+            **kwargs:
+                search filters used to select the cached catalog (see `search_catalog_wrapper`)
+
+        Returns:
+            index (pandas.DataFrame):
+                the `tag`, JSON encoded `value` and `count` of each tag value (see `quest.util.tag_index`)
         """
-        for k, other_v in other.items():
-            other_v = util.listify(other_v)
-            if k in this:
-                this_v = this[k]
-                if isinstance(this_v, list):
-                    other_v.extend(this_v)
-                else:
-                    other_v.append(this_v)
-            this[k] = other_v
+        cache_file, filters = self._get_catalog_cache_file(**kwargs)
+
+        if not (self.use_cache and not update_cache and os.path.exists(cache_file)
+                and os.path.exists(util.catalog_cache.metadata_cache_file(cache_file))):
+            catalog_entries, metadata = self._build_catalog(cache_file, filters)
+            if not self.use_cache:
+                return util.tag_index.build_tag_index(metadata)
+
+        return util.tag_index.read_tag_index(cache_file)
 
 
 class TimePeriodServiceBase(ServiceBase):
@@ -335,7 +656,7 @@ class SingleFileServiceBase(ServiceBase):
     """
     def download(self, catalog_id, file_path, dataset, **kwargs):
         service_uri = util.construct_service_uri(self.provider.name, self.name, catalog_id)
-        catalog_id = self.provider.search_catalog(self.name).loc[service_uri]
+        catalog_id = self.get_catalog_entries([catalog_id]).loc[service_uri]
         reserved = catalog_id.get('reserved')
         download_url = reserved['download_url']
         fmt = reserved.get('extract_from_zip', '')
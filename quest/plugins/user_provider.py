@@ -184,7 +184,7 @@ class UserProvider(ProviderBase):
     organization_name = None
     organization_abbr = None
 
-    def __init__(self, uri, name=None, use_cache=True, update_frequency='M'):
+    def __init__(self, uri, name=None, use_cache=True, update_frequency=None):
         super(UserProvider, self).__init__(name=name, use_cache=use_cache, update_frequency=update_frequency)
         self.uri = uri
         self.is_remote = is_remote_uri(uri)
@@ -10,6 +10,15 @@ class DatasetStatus:
     DERIVED = 'tool applied'
 
 
+class SearchStatus:
+    """
+    Enum of string constants representing the status of a service in a catalog search.
+    """
+    SUCCESS = 'success'
+    FAILED = 'failed'
+    TIMEOUT = 'timeout'
+
+
 class ServiceType:
     GEO_DISCRETE = 'geo-discrete'
     GEO_SEAMLESS = 'geo-seamless'
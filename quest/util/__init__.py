@@ -3,6 +3,12 @@ from .io import read_yaml, write_yaml
 from .config import get_settings, save_settings, update_settings, update_settings_from_file
 from .log import logger, log_to_console, log_to_file
 from . import param_util as param
+from . import catalog_cache
+from . import text_index
+from . import geojson_encoder
+from . import tag_index
+from . import global_index
+from . import download_cache
 from .param_util import (
     format_json_options,
     ProviderSelector,
@@ -0,0 +1,1089 @@
+import os
+import time
+import shutil
+import tempfile
+import hashlib
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from .log import logger
+from .config import get_settings
+from .misc import bbox2poly, listify, to_json_default_handler
+
+
+CATALOG_CACHE_EXT = '.parquet'
+ROW_GROUP_SIZE = 10000
+BOUNDS_COLUMNS = ['xmin', 'ymin', 'xmax', 'ymax']
+# tolerances (in the units of the coordinates) of the simplified geometries stored with catalogs of lines and polygons
+GEOMETRY_TOLERANCES = [0.001, 0.01, 0.1]
+_SCHEMA_METADATA_KEY = b'quest'
+# types of the columns that every catalog has
+_COLUMN_TYPES = {'service_id': pa.string(), 'display_name': pa.string(), 'description': pa.string(),
+                 'geometry': pa.binary()}
+
+# in-process LRU cache of labeled catalogs keyed on (provider, service, cache file)
+MEMORY_CACHE_SIZE = 8
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+_memory_cache_stats = {'hits': 0, 'misses': 0}
+
+# background refreshes of stale catalogs keyed on cache file
+REFRESH_WORKERS = 2
+REFRESH_RETRY_INTERVAL = 3600
+_refresh_executor = None
+_refreshes = dict()
+_refresh_failures = dict()
+_refresh_lock = threading.Lock()
+
+
+def catalog_cache_file(cache_dir, service, filters=None):
+    """Gets the path of the columnar catalog cache for a service.
+
+    Args:
+        cache_dir (string): The provider's cache directory (see `get_cache_dir`).
+        service (string): The name of the service.
+        filters (dict): Optional filters that were used to fetch a partial catalog. Partial
+        catalogs are cached separately for each distinct set of filters.
+
+    Returns:
+        A string of the path to the cache file.
+    """
+    name = service + '_catalog'
+    if filters:
+        key = json.dumps(filters, sort_keys=True, default=str).encode()
+        name += '_' + hashlib.md5(key).hexdigest()[:16]
+
+    return os.path.join(cache_dir, name + CATALOG_CACHE_EXT)
+
+
+def spatial_index_file(path):
+    """Gets the path of the spatial index that is persisted next to a catalog cache file.
+
+    Args:
+        path (string): Path of the catalog cache file.
+
+    Returns:
+        A string of the path to the spatial index file.
+    """
+    return os.path.splitext(path)[0] + '_sindex.npz'
+
+
+def id_index_file(path):
+    """Gets the path of the service id index that is persisted next to a Parquet cache file.
+
+    Args:
+        path (string): Path of the catalog cache file or of its metadata side table.
+
+    Returns:
+        A string of the path to the id index file.
+    """
+    return os.path.splitext(path)[0] + '_ids.npz'
+
+
+def metadata_cache_file(path):
+    """Gets the path of the metadata side table that is persisted next to a catalog cache file.
+
+    Args:
+        path (string): Path of the catalog cache file.
+
+    Returns:
+        A string of the path to the metadata cache file.
+    """
+    return os.path.splitext(path)[0] + '_metadata' + CATALOG_CACHE_EXT
+
+
+def write_catalog(catalog_entries, path, metadata=None):
+    """Writes a normalized catalog to a columnar (Parquet) cache file.
+
+    Notes:
+        Geometries are stored as WKB alongside their bounds (`xmin`, `ymin`, `xmax`, `ymax`)
+        so that bbox filters can be pushed down to the reader. Columns holding dicts or lists
+        (i.e. `reserved`) are stored as JSON strings. Rows are sorted by `service_id` so that
+        row group statistics can be used to look up individual entries. Catalogs of lines or
+        polygons also store their geometries simplified to each of `GEOMETRY_TOLERANCES` (see
+        `get_geometry_tiers`). A spatial index of the
+        bounds is written next to the cache file (see `SpatialIndex`), as is the metadata side
+        table (see `read_metadata`). Both files get an index of their service ids (see `IdIndex`).
+
+    Args:
+        catalog_entries (pandas.DataFrame): The normalized catalog with a `service_id` column.
+        path (string): Path of the cache file to write.
+        metadata (pandas.DataFrame): Optional metadata side table with a column for each metadata
+        field and a `service_id` column to join it with the catalog.
+    """
+    df = _prepare_catalog(catalog_entries)
+
+    os.makedirs(os.path.split(path)[0], exist_ok=True)
+    SpatialIndex(df[BOUNDS_COLUMNS].values).save(spatial_index_file(path))
+
+    if metadata is not None:
+        metadata = _prepare_metadata(metadata)
+        _write_table(metadata, metadata_cache_file(path))
+        IdIndex.build(metadata['service_id']).save(id_index_file(metadata_cache_file(path)))
+
+    _write_table(df, path)
+    IdIndex.build(df['service_id']).save(id_index_file(path))
+
+
+class CatalogWriter(object):
+    """Writes a normalized catalog to a columnar (Parquet) cache file a chunk at a time.
+
+    Notes:
+        Each chunk is converted like in `write_catalog` and written to a temporary file sorted
+        by `service_id`. When the writer is closed these sorted runs are merged into the cache
+        file (and its metadata side table) reading a batch of rows of each run at a time, so
+        memory use is bounded by the size of the chunks rather than the size of the catalog.
+        Columns missing from some chunks are filled with nulls and columns whose types differ
+        between chunks are promoted to a common type. The cache file is only replaced once
+        all chunks are merged, so a failed write leaves the previous cache in place.
+
+    Args:
+        path (string): Path of the cache file to write.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._tmp_dir = None
+        self._catalog_runs = []
+        self._metadata_runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, catalog_entries, metadata=None):
+        """Writes a chunk of the catalog.
+
+        Args:
+            catalog_entries (pandas.DataFrame): A chunk of the normalized catalog with a `service_id` column.
+            metadata (pandas.DataFrame): Optional metadata side table of the chunk (see `write_catalog`).
+        """
+        if self._tmp_dir is None:
+            os.makedirs(os.path.split(self.path)[0], exist_ok=True)
+            self._tmp_dir = tempfile.mkdtemp(prefix='.tmp_', dir=os.path.split(self.path)[0])
+
+        run = os.path.join(self._tmp_dir, 'catalog_{}{}'.format(len(self._catalog_runs), CATALOG_CACHE_EXT))
+        _write_table(_prepare_catalog(catalog_entries), run)
+        self._catalog_runs.append(run)
+
+        if metadata is not None:
+            run = os.path.join(self._tmp_dir, 'metadata_{}{}'.format(len(self._metadata_runs), CATALOG_CACHE_EXT))
+            _write_table(_prepare_metadata(metadata), run)
+            self._metadata_runs.append(run)
+
+    def close(self):
+        """Merges the chunks that were written into the cache file and writes its indexes.
+
+        Notes:
+            If no chunks were written an empty catalog (and metadata side table) is cached.
+        """
+        if not self._catalog_runs:
+            self.write(pd.DataFrame(columns=list(_COLUMN_TYPES), dtype=object),
+                       metadata=pd.DataFrame(columns=['service_id'], dtype=object))
+
+        try:
+            if self._metadata_runs:
+                metadata_path = metadata_cache_file(self.path)
+                _merge_runs(self._metadata_runs, metadata_path + '.tmp')
+                os.replace(metadata_path + '.tmp', metadata_path)
+                _write_id_index(metadata_path)
+
+            tmp_path = self.path + '.tmp'
+            _merge_runs(self._catalog_runs, tmp_path)
+            # the spatial index is written before the cache file, see `query_spatial_index`
+            bounds = pq.read_table(tmp_path, columns=BOUNDS_COLUMNS).to_pandas().values
+            SpatialIndex(bounds).save(spatial_index_file(self.path))
+            del bounds
+            # the merged file was written before the spatial index, so it is touched to be newer than the index
+            os.utime(tmp_path)
+            os.replace(tmp_path, self.path)
+            _write_id_index(self.path)
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Discards the chunks that were written.
+        """
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        self._tmp_dir = None
+        self._catalog_runs = []
+        self._metadata_runs = []
+
+
+def _prepare_catalog(catalog_entries):
+    """Helper function for `write_catalog` to sort a catalog and store its geometries as WKB and bounds.
+    """
+    df = pd.DataFrame(catalog_entries).reset_index(drop=True)
+    df['service_id'] = df['service_id'].astype(str)
+    df = df.sort_values('service_id', kind='mergesort').reset_index(drop=True)
+
+    geometry = gpd.GeoSeries(df['geometry'])
+    bounds = geometry.bounds
+    bounds.columns = BOUNDS_COLUMNS
+    df['geometry'] = geometry.to_wkb()
+
+    geometries = np.asarray(geometry.values, dtype=object)
+    if (shapely.get_num_coordinates(geometries) > 1).any():
+        for tolerance in GEOMETRY_TOLERANCES:
+            simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+            df[geometry_tier_column(tolerance)] = shapely.to_wkb(simplified)
+
+    return pd.concat([df, bounds], axis=1)
+
+
+def _prepare_metadata(metadata):
+    """Helper function for `write_catalog` to sort a metadata side table.
+    """
+    metadata = pd.DataFrame(metadata).reset_index(drop=True)
+    metadata.columns = metadata.columns.astype(str)
+    metadata['service_id'] = metadata['service_id'].astype(str)
+    return metadata.sort_values('service_id', kind='mergesort').reset_index(drop=True)
+
+
+def _write_table(df, path):
+    """Writes a DataFrame to a Parquet file, storing columns of dicts, lists or mixed types as JSON strings.
+    """
+    json_columns = []
+    for column in df.columns:
+        if column == 'geometry' or column in _geometry_tiers([column]) or df[column].dtype != object:
+            continue
+        if not df[column].map(lambda x: x is None or isinstance(x, str)).all():
+            df[column] = df[column].map(lambda x: json.dumps(x, default=to_json_default_handler))
+            json_columns.append(column)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for name, column_type in _COLUMN_TYPES.items():
+        # columns without any values (i.e. of an empty catalog) have no type to infer
+        if name in table.column_names and table.schema.field(name).type == pa.null():
+            table = table.set_column(table.column_names.index(name), name, table[name].cast(column_type))
+    metadata = dict(table.schema.metadata or {})
+    metadata[_SCHEMA_METADATA_KEY] = json.dumps({'json_columns': json_columns}).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+
+
+def _merge_runs(runs, path):
+    """Merges Parquet files that are sorted by `service_id` into one sorted file.
+
+    Notes:
+        Batches of rows are read from each run. Rows up to the smallest of the last service
+        ids of the current batches can't be preceded by rows that are still to be read, so
+        those rows are merged and written, and the batches that are used up are replaced.
+    """
+    if len(runs) == 1:
+        os.replace(runs[0], path)
+        return
+
+    files = [pq.ParquetFile(run, memory_map=True) for run in runs]
+    schema, json_columns = _unify_schemas([f.schema_arrow for f in files])
+    batch_size = max(ROW_GROUP_SIZE // len(files), 100)
+    batches = [_read_batches(f, schema, json_columns, batch_size) for f in files]
+    buffers = [next(b, None) for b in batches]
+
+    pending, n_pending = [], 0
+    with pq.ParquetWriter(path, schema) as writer:
+        while any(buffer is not None for buffer in buffers):
+            ids = [None if b is None else b.column('service_id').to_numpy(zero_copy_only=False) for b in buffers]
+            bound = min(i[-1] for i in ids if i is not None)
+            for n, buffer in enumerate(buffers):
+                if buffer is None:
+                    continue
+                stop = int(np.searchsorted(ids[n], bound, side='right'))
+                pending.append(buffer.slice(0, stop))
+                n_pending += stop
+                buffers[n] = buffer.slice(stop) if stop < len(buffer) else next(batches[n], None)
+
+            if n_pending >= ROW_GROUP_SIZE:
+                _write_sorted(writer, pending)
+                pending, n_pending = [], 0
+
+        if pending:
+            _write_sorted(writer, pending)
+
+
+def _write_sorted(writer, tables):
+    table = pa.concat_tables(tables)
+    writer.write_table(table.take(pc.sort_indices(table, sort_keys=[('service_id', 'ascending')])),
+                       row_group_size=ROW_GROUP_SIZE)
+
+
+def _read_batches(parquet_file, schema, json_columns, batch_size):
+    """Reads batches of a run with the columns of the merged file, see `_unify_schemas`.
+    """
+    file_json_columns = _json_columns(parquet_file.schema_arrow)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        if batch.num_rows == 0:
+            continue
+        arrays = []
+        for field in schema:
+            if field.name not in batch.schema.names:
+                if field.name in _geometry_tiers([field.name]):
+                    # chunks without lines or polygons have nothing to simplify
+                    arrays.append(batch.column('geometry').cast(field.type))
+                else:
+                    arrays.append(pa.nulls(batch.num_rows, type=field.type))
+                continue
+            array = batch.column(field.name)
+            if field.name in json_columns and field.name not in file_json_columns:
+                array = pa.array([None if v is None else json.dumps(v, default=to_json_default_handler)
+                                  for v in array.to_pylist()], type=pa.string())
+            arrays.append(array.cast(field.type))
+        yield pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _unify_schemas(schemas):
+    """Helper function for `_merge_runs` to find the columns and types of the merged file.
+    """
+    json_columns = sorted(set(c for s in schemas for c in _json_columns(s)))
+    names = list(OrderedDict((name, None) for s in schemas for name in s.names))
+
+    fields = []
+    for name in names:
+        types = [s.field(name).type for s in schemas if name in s.names]
+        types = [t for t in types if not pa.types.is_null(t)] or types
+        if name in json_columns:
+            type_ = pa.string()
+        elif all(t == types[0] for t in types):
+            type_ = types[0]
+        elif all(pa.types.is_dictionary(t) for t in types):
+            type_ = pa.dictionary(pa.int32(), pa.string())
+        elif all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+            type_ = pa.float64()
+        else:
+            type_ = pa.string()
+        fields.append(pa.field(name, type_))
+
+    metadata = {_SCHEMA_METADATA_KEY: json.dumps({'json_columns': json_columns}).encode()}
+    return pa.schema(fields, metadata=metadata), json_columns
+
+
+def _json_columns(schema):
+    return json.loads((schema.metadata or {}).get(_SCHEMA_METADATA_KEY, b'{}')).get('json_columns', [])
+
+
+def read_catalog(path, columns=None, service_ids=None, bbox=None, tolerance=None):
+    """Reads a catalog from a columnar (Parquet) cache file.
+
+    Notes:
+        `service_ids` are looked up in the id index of the cache file (see `IdIndex`)
+        and `bbox` searches are answered by its spatial index, so only the matching
+        rows are read. Otherwise the filters are pushed down to the Parquet reader, so
+        only the row groups that may contain matching entries are read. The `bbox`
+        filter only compares bounds; exact geometric refinement is left to the caller.
+
+    Args:
+        path (string): Path of the cache file to read.
+        columns (list): Optional list of columns to read. Defaults to all columns.
+        service_ids (list): Optional list of service ids to read.
+        bbox (list or string): Optional bounding box as `xmin, ymin, xmax, ymax`. Boxes
+        that span the 180 degree meridian are split (see `bbox2poly`).
+        tolerance (float): Optional tolerance of the geometries to read. The geometries are
+        read from the coarsest simplified geometries within the tolerance instead of the
+        exact geometries, if the cache file has any (see `get_geometry_tiers`).
+
+    Returns:
+        A pandas DataFrame with geometries converted to shapely objects.
+    """
+    names = pq.read_schema(path).names
+    tiers = _geometry_tiers(names)
+    if columns is None:
+        columns = [c for c in names if c not in tiers]
+    columns = list(columns)
+    if 'service_id' not in columns:
+        columns.append('service_id')
+
+    tier = _select_geometry_tier(tiers, tolerance)
+    if tier is not None and 'geometry' in columns:
+        columns = [tier if c == 'geometry' else c for c in columns]
+
+    if service_ids is not None and bbox is None:
+        table = _read_service_ids(path, service_ids, columns)
+    else:
+        rows = None
+        if bbox is not None and service_ids is None:
+            rows = query_spatial_index(path, bbox)
+
+        if rows is not None:
+            table = _read_rows(path, rows, columns)
+        else:
+            filters = _build_filters(service_ids, bbox)
+            table = pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+
+    if tier in table.column_names:
+        table = table.rename_columns(['geometry' if c == tier else c for c in table.column_names])
+
+    return _table_to_dataframe(table)
+
+
+def get_geometry_tiers(path):
+    """Gets the simplified geometries that are stored in a catalog cache file.
+
+    Args:
+        path (string): Path of the catalog cache file.
+
+    Returns:
+        A dict of the tolerance of the geometries in each simplified geometry column, keyed
+        by column name. Empty if the catalog has no lines or polygons.
+    """
+    return _geometry_tiers(pq.read_schema(path).names)
+
+
+def geometry_tier_column(tolerance):
+    """Gets the name of the column of geometries simplified to a tolerance.
+    """
+    return 'geometry_{:g}'.format(tolerance)
+
+
+def read_geometries(path, tolerance):
+    """Reads the geometries of a catalog cache file simplified to a tolerance.
+
+    Notes:
+        Geometries are kept in memory for as long as the cache file is not rewritten, so
+        catalogs that are already in memory (see `get_memoized_catalog`) can be given
+        simplified geometries without reading the whole catalog again.
+
+    Args:
+        path (string): Path of the catalog cache file.
+        tolerance (float): Tolerance of the geometries (see `read_catalog`).
+
+    Returns:
+        A pandas.Series of shapely geometries indexed by service id, or None if the cache file
+        has no simplified geometries within the tolerance.
+    """
+    return _load_geometries(path, _mtime(path), tolerance)
+
+
+@lru_cache(maxsize=MEMORY_CACHE_SIZE)
+def _load_geometries(path, catalog_mtime, tolerance):
+    tier = _select_geometry_tier(get_geometry_tiers(path), tolerance)
+    if tier is None:
+        return None
+
+    table = pq.read_table(path, columns=['service_id', tier], memory_map=True)
+    geometries = gpd.GeoSeries.from_wkb(table.column(tier).to_pandas()).values
+    return pd.Series(np.asarray(geometries, dtype=object), index=table.column('service_id').to_pandas())
+
+
+def _geometry_tiers(names):
+    tiers = dict()
+    for name in names:
+        if name.startswith('geometry_'):
+            try:
+                tiers[name] = float(name[len('geometry_'):])
+            except ValueError:
+                pass
+
+    return tiers
+
+
+def _select_geometry_tier(tiers, tolerance):
+    """Helper function to find the column of the coarsest simplified geometries within a tolerance.
+    """
+    if tolerance is None:
+        return None
+
+    within = {column: t for column, t in tiers.items() if t <= float(tolerance)}
+    return max(within, key=within.get) if within else None
+
+
+def read_metadata(path, columns=None, service_ids=None):
+    """Reads the metadata side table of a catalog cache file.
+
+    Notes:
+        Each metadata field is stored as a typed column, so only the fields that are
+        needed have to be read. Fields that are not in the side table are ignored.
+
+    Args:
+        path (string): Path of the catalog cache file.
+        columns (list): Optional list of metadata fields to read. Defaults to all fields.
+        service_ids (list): Optional list of service ids to read.
+
+    Returns:
+        A pandas DataFrame with a `service_id` column and a column for each metadata field.
+    """
+    path = metadata_cache_file(path)
+    if columns is not None:
+        names = pq.read_schema(path).names
+        columns = [c for c in names if c in columns or c == 'service_id']
+
+    if service_ids is not None:
+        table = _read_service_ids(path, service_ids, columns)
+    else:
+        table = pq.read_table(path, columns=columns, memory_map=True)
+
+    return _table_to_dataframe(table)
+
+
+def metadata_to_records(metadata):
+    """Converts a metadata side table to the dicts used for the `metadata` field of catalog entries.
+
+    Args:
+        metadata (pandas.DataFrame): The metadata side table without the `service_id` column.
+
+    Returns:
+        A list with a dict of metadata for each row. Missing values are set to None.
+    """
+    return json.loads(metadata.to_json(orient='records'))
+
+
+def _read_rows(path, rows, columns=None):
+    """Reads only the row groups of a Parquet file that contain `rows` and takes those rows.
+    """
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    metadata = parquet_file.metadata
+    offsets = np.cumsum([0] + [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)])
+    row_groups = np.unique(np.searchsorted(offsets, rows, side='right') - 1)
+    if len(row_groups) == 0:
+        return parquet_file.schema_arrow.empty_table().select(columns or parquet_file.schema_arrow.names)
+
+    table = parquet_file.read_row_groups(row_groups.tolist(), columns=columns)
+
+    # map rows in the file to rows in the concatenated row groups
+    local_offsets = np.cumsum([0] + [offsets[g + 1] - offsets[g] for g in row_groups])
+    group_positions = np.searchsorted(row_groups, np.searchsorted(offsets, rows, side='right') - 1)
+    local_rows = rows - offsets[row_groups[group_positions]] + local_offsets[group_positions]
+
+    return table.take(pa.array(local_rows))
+
+
+def _read_service_ids(path, service_ids, columns=None):
+    """Reads only the rows of a Parquet file with the given service ids, found with its id index.
+    """
+    service_ids = [str(s) for s in listify(service_ids)]
+    table = _read_rows(path, get_id_index(path).lookup(service_ids), columns)
+    # rows whose ids only share a hash with a requested id are dropped
+    return table.filter(pc.is_in(table['service_id'], value_set=pa.array(service_ids, type=pa.string())))
+
+
+def _table_to_dataframe(table):
+    metadata = json.loads((table.schema.metadata or {}).get(_SCHEMA_METADATA_KEY, b'{}'))
+
+    df = table.to_pandas()
+    df.drop(labels=BOUNDS_COLUMNS, axis=1, inplace=True, errors='ignore')
+
+    for column in metadata.get('json_columns', []):
+        if column in df.columns:
+            df[column] = df[column].map(lambda x: None if x is None else json.loads(x))
+
+    if 'geometry' in df.columns:
+        df['geometry'] = gpd.GeoSeries.from_wkb(df['geometry']).values
+
+    return df
+
+
+def _build_filters(service_ids=None, bbox=None):
+    """Builds Parquet filters in disjunctive normal form (list of lists of tuples).
+    """
+    conjunction = []
+    if service_ids is not None:
+        conjunction.append(('service_id', 'in', [str(s) for s in listify(service_ids)]))
+
+    if bbox is None:
+        return [conjunction] if conjunction else None
+
+    filters = []
+    for xmin, ymin, xmax, ymax in _split_bbox(bbox):
+        filters.append(conjunction + [
+            ('xmax', '>=', xmin),
+            ('xmin', '<=', xmax),
+            ('ymax', '>=', ymin),
+            ('ymin', '<=', ymax),
+        ])
+
+    return filters
+
+
+def _split_bbox(bbox):
+    """Splits a bounding box that spans the 180 degree meridian into the bounds of each part.
+    """
+    poly = bbox2poly(*[float(x) for x in listify(bbox)], as_shapely=True)
+    return [p.bounds for p in getattr(poly, 'geoms', [poly])]
+
+
+class SpatialIndex(object):
+    """Static packed R-tree of catalog entry bounds.
+
+    Notes:
+        Leaves are ordered with the Sort-Tile-Recursive (STR) algorithm and every
+        `node_size` consecutive nodes are packed into a parent node, so the tree is
+        fully described by the leaf order and the bounds of each level. These arrays
+        are persisted next to the catalog cache so the index is only built when the
+        catalog cache is written.
+
+    Args:
+        bounds (numpy.ndarray): (n, 4) array of `xmin, ymin, xmax, ymax` bounds. Entries
+        with NaN bounds (i.e. no geometry) never match a query.
+        node_size (int): The maximum number of children of each node.
+    """
+    def __init__(self, bounds=None, node_size=16, order=None, levels=None):
+        self.node_size = node_size
+        if bounds is not None:
+            order, levels = self._pack(np.asarray(bounds, dtype=float).reshape(-1, 4), node_size)
+        self.order = order
+        self.levels = levels
+
+    def __len__(self):
+        return len(self.order)
+
+    @staticmethod
+    def _pack(bounds, node_size):
+        n = len(bounds)
+        valid = np.where(~np.isnan(bounds).any(axis=1))[0]
+        if n == 0 or len(valid) == 0:
+            return np.array([], dtype=np.int64), []
+
+        # sort-tile-recursive ordering of the leaves
+        centers = (bounds[valid, :2] + bounds[valid, 2:]) / 2
+        n_slices = int(np.ceil(np.sqrt(np.ceil(len(valid) / node_size))))
+        slice_size = n_slices * node_size
+        by_x = np.argsort(centers[:, 0], kind='mergesort')
+        slices = np.arange(len(valid)) // slice_size
+        by_y = np.lexsort((centers[by_x, 1], slices))
+        order = valid[by_x[by_y]]
+
+        levels = [bounds[order]]
+        while len(levels[-1]) > 1:
+            children = levels[-1]
+            starts = np.arange(0, len(children), node_size)
+            levels.append(np.column_stack([
+                np.fmin.reduceat(children[:, 0], starts),
+                np.fmin.reduceat(children[:, 1], starts),
+                np.fmax.reduceat(children[:, 2], starts),
+                np.fmax.reduceat(children[:, 3], starts),
+            ]))
+
+        return order.astype(np.int64), levels
+
+    def query(self, bbox):
+        """Finds the entries whose bounds intersect a bounding box.
+
+        Args:
+            bbox (list or string): Bounding box as `xmin, ymin, xmax, ymax`. Boxes that
+            span the 180 degree meridian are split (see `bbox2poly`).
+
+        Returns:
+            A sorted numpy array of the row numbers of the matching entries.
+        """
+        if not self.levels:
+            return np.array([], dtype=np.int64)
+
+        matches = []
+        for xmin, ymin, xmax, ymax in _split_bbox(bbox):
+            nodes = np.array([0])
+            for level in reversed(range(len(self.levels))):
+                boxes = self.levels[level]
+                if level < len(self.levels) - 1:
+                    nodes = (nodes[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+                    nodes = nodes[nodes < len(boxes)]
+                b = boxes[nodes]
+                nodes = nodes[(b[:, 2] >= xmin) & (b[:, 0] <= xmax) & (b[:, 3] >= ymin) & (b[:, 1] <= ymax)]
+            matches.append(self.order[nodes])
+
+        return np.unique(np.concatenate(matches))
+
+    def save(self, path):
+        """Writes the index to a numpy `.npz` file.
+        """
+        level_sizes = np.array([len(level) for level in self.levels], dtype=np.int64)
+        boxes = np.concatenate(self.levels) if self.levels else np.empty((0, 4))
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, node_size=self.node_size, order=self.order, level_sizes=level_sizes, boxes=boxes)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written with `SpatialIndex.save`.
+        """
+        with np.load(path) as data:
+            offsets = np.cumsum(np.concatenate([[0], data['level_sizes']]))
+            boxes = data['boxes']
+            levels = [boxes[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+            return cls(node_size=int(data['node_size']), order=data['order'], levels=levels)
+
+
+def query_spatial_index(path, bbox, mtime=None):
+    """Finds the rows of a catalog cache file whose bounds intersect a bounding box.
+
+    Args:
+        path (string): Path of the catalog cache file.
+        bbox (list or string): Bounding box as `xmin, ymin, xmax, ymax`.
+        mtime (int): Optional modification time of the version of the cache file the rows are
+            applied to (see `catalog_mtime`). Defaults to the current modification time.
+
+    Returns:
+        A sorted numpy array of row numbers, or None if there is no spatial index for that
+        version of the cache file.
+    """
+    index = _load_spatial_index(spatial_index_file(path), _mtime(path) if mtime is None else mtime)
+    if index is None:
+        return None
+
+    return index.query(bbox)
+
+
+@lru_cache(maxsize=MEMORY_CACHE_SIZE)
+def _load_spatial_index(path, catalog_mtime):
+    # the index is written before the catalog, so an index newer than the catalog is from a failed write
+    # or from a later version of the catalog
+    index_mtime = _mtime(path)
+    if index_mtime is None or catalog_mtime is None or index_mtime > catalog_mtime:
+        return None
+
+    index = SpatialIndex.load(path)
+    if _mtime(path) != index_mtime:
+        # replaced while it was loaded
+        return None
+
+    return index
+
+
+class IdIndex(object):
+    """Hash index of the service ids of a Parquet cache file.
+
+    Notes:
+        Service ids are hashed to 64 bit integers that are kept in sorted order along with
+        the row of each id, so that the rows of any number of ids are found with a single
+        vectorized binary search instead of scanning the `service_id` column. Rows of ids
+        that share a hash with a requested id are also returned, so the caller should check
+        the ids of the rows it reads.
+
+    Args:
+        hashes (numpy.ndarray): Sorted hashes of the service ids.
+        rows (numpy.ndarray): The row of each hash.
+    """
+    def __init__(self, hashes, rows):
+        self.hashes = hashes
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def build(cls, service_ids):
+        """Builds an index of the service ids of each row of a file.
+        """
+        hashes = _hash_ids(service_ids)
+        order = np.argsort(hashes, kind='mergesort')
+        return cls(hashes[order], order.astype(np.int64))
+
+    def lookup(self, service_ids):
+        """Finds the rows that may have any of the service ids.
+
+        Returns:
+            A sorted numpy array of row numbers.
+        """
+        hashes = _hash_ids(service_ids)
+        starts = np.searchsorted(self.hashes, hashes, side='left')
+        counts = np.searchsorted(self.hashes, hashes, side='right') - starts
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return np.unique(self.rows[positions])
+
+    def save(self, path):
+        """Writes the index to a numpy `.npz` file.
+        """
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, hashes=self.hashes, rows=self.rows)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written with `IdIndex.save`.
+        """
+        with np.load(path) as data:
+            return cls(hashes=data['hashes'], rows=data['rows'])
+
+
+def get_id_index(path):
+    """Gets the service id index of a Parquet cache file.
+
+    Notes:
+        The index written next to the file is used if it is up to date, otherwise it is built
+        from the `service_id` column of the file and written. Indexes are kept in memory for
+        as long as the file is not rewritten.
+
+    Args:
+        path (string): Path of the catalog cache file or of its metadata side table.
+
+    Returns:
+        An IdIndex.
+    """
+    return _load_id_index(path, _mtime(path))
+
+
+@lru_cache(maxsize=2 * MEMORY_CACHE_SIZE)
+def _load_id_index(path, file_mtime):
+    # the index is written after the file, so an index older than the file is out of date
+    index_file = id_index_file(path)
+    index_mtime = _mtime(index_file)
+    if index_mtime is not None and index_mtime >= file_mtime:
+        return IdIndex.load(index_file)
+
+    return _write_id_index(path)
+
+
+def _write_id_index(path):
+    service_ids = pq.read_table(path, columns=['service_id']).column('service_id').to_pandas()
+    index = IdIndex.build(service_ids)
+    index.save(id_index_file(path))
+
+    return index
+
+
+def _hash_ids(service_ids):
+    return pd.util.hash_array(pd.Series(service_ids, dtype=object).astype(str).values)
+
+
+def get_memoized_catalog(provider, service, path, bbox=None):
+    """Gets a catalog from the in-process LRU cache.
+
+    Notes:
+        Entries are only valid for the modification time of the cache file they were loaded
+        from, so a catalog is reloaded whenever its cache file is rewritten.
+
+    Args:
+        provider (string): The name of the provider.
+        service (string): The name of the service.
+        path (string): Path of the cache file the catalog was loaded from.
+        bbox (list or string): Optional bounding box as `xmin, ymin, xmax, ymax`. The catalog is
+            narrowed down to the rows that the spatial index of the memoized version of the cache
+            file finds as candidates; exact intersection is left to the caller.
+
+    Returns:
+        A shallow copy of the cached catalog, or None if it is not cached or is stale.
+    """
+    key = (provider, service, path)
+    mtime = _mtime(path)
+    with _memory_cache_lock:
+        entry = _memory_cache.get(key)
+        if entry is None or entry[0] != mtime:
+            _memory_cache.pop(key, None)
+            _memory_cache_stats['misses'] += 1
+            return None
+
+        _memory_cache.move_to_end(key)
+        _memory_cache_stats['hits'] += 1
+
+    catalog_entries = entry[1]
+    if bbox is not None:
+        # the cache file may have been rewritten since it was checked, so use the index of the memoized version
+        rows = query_spatial_index(path, bbox, mtime=entry[0])
+        if rows is not None:
+            return catalog_entries.iloc[rows]
+
+    return catalog_entries.copy(deep=False)
+
+
+def is_memoized(provider, service, path):
+    """Checks whether a catalog is in the in-process LRU cache.
+
+    Notes:
+        Unlike `get_memoized_catalog` this does not count a hit or miss, copy the catalog or
+        remove stale entries.
+
+    Args:
+        provider (string): The name of the provider.
+        service (string): The name of the service.
+        path (string): Path of the cache file the catalog was loaded from.
+
+    Returns:
+        True if the catalog is cached for the current version of the cache file.
+    """
+    mtime = _mtime(path)
+    with _memory_cache_lock:
+        entry = _memory_cache.get((provider, service, path))
+
+    return entry is not None and entry[0] == mtime
+
+
+def memoize_catalog(provider, service, path, catalog_entries, mtime):
+    """Adds a catalog to the in-process LRU cache, evicting the least recently used catalogs.
+
+    Notes:
+        The maximum number of catalogs that are kept can be set with the
+        `CATALOG_MEMORY_CACHE_SIZE` setting. A size of 0 disables the cache.
+
+    Args:
+        provider (string): The name of the provider.
+        service (string): The name of the service.
+        path (string): Path of the cache file the catalog was loaded from.
+        catalog_entries (pandas.DataFrame): The labeled catalog.
+        mtime (int): Modification time of the cache file from before the catalog was read from it
+            (see `catalog_mtime`), so that a catalog read while the cache file was being rewritten
+            is never memoized under the modification time of the new version.
+    """
+    maxsize = get_settings().get('CATALOG_MEMORY_CACHE_SIZE', MEMORY_CACHE_SIZE)
+    if mtime is None or maxsize <= 0:
+        return
+
+    key = (provider, service, path)
+    with _memory_cache_lock:
+        _memory_cache[key] = (mtime, catalog_entries.copy(deep=False))
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > maxsize:
+            _memory_cache.popitem(last=False)
+
+
+def clear_memory_cache(provider=None, service=None):
+    """Removes catalogs from the in-process LRU cache.
+
+    Args:
+        provider (string): Optionally only remove catalogs for this provider.
+        service (string): Optionally only remove catalogs for this service.
+    """
+    with _memory_cache_lock:
+        for key in list(_memory_cache.keys()):
+            if provider in (None, key[0]) and service in (None, key[1]):
+                del _memory_cache[key]
+
+
+def memory_cache_info():
+    """Gets statistics for the in-process LRU cache.
+
+    Returns:
+        A dictionary with the number of `hits` and `misses`, the current number
+        of cached catalogs (`size`) and the maximum number of catalogs (`maxsize`).
+    """
+    with _memory_cache_lock:
+        return dict(_memory_cache_stats,
+                    size=len(_memory_cache),
+                    maxsize=get_settings().get('CATALOG_MEMORY_CACHE_SIZE', MEMORY_CACHE_SIZE))
+
+
+def catalog_mtime(path):
+    """Gets the modification time of a catalog cache file.
+
+    Args:
+        path (string): Path of the catalog cache file.
+
+    Returns:
+        The modification time in nanoseconds, or None if the cache file does not exist.
+    """
+    return _mtime(path)
+
+
+def catalog_refreshed_at(path):
+    """Gets the time a catalog cache file was last refreshed.
+
+    Args:
+        path (string): Path of the catalog cache file.
+
+    Returns:
+        A naive UTC pandas.Timestamp, or None if the cache file does not exist.
+    """
+    mtime = _mtime(path)
+    if mtime is None:
+        return None
+
+    return pd.Timestamp(mtime, unit='ns')
+
+
+def is_stale(path, update_frequency):
+    """Checks whether a catalog cache file is due for a refresh.
+
+    Notes:
+        A cache is stale once the current period of `update_frequency` is later than the
+        period it was last refreshed in, e.g. with 'M' a cache is refreshed once a calendar
+        month and with 'D' once a day.
+
+    Args:
+        path (string): Path of the catalog cache file.
+        update_frequency (string): A pandas frequency alias, or None to never refresh.
+
+    Returns:
+        True if the cache file exists and is stale.
+    """
+    refreshed_at = catalog_refreshed_at(path)
+    if refreshed_at is None or not update_frequency:
+        return False
+
+    now = pd.Timestamp(time.time(), unit='s')
+    return pd.Period(refreshed_at, update_frequency) < pd.Period(now, update_frequency)
+
+
+def refresh_in_background(path, fn, *args, **kwargs):
+    """Runs a catalog refresh in a background thread.
+
+    Notes:
+        Only one refresh runs at a time for each cache file. After a refresh fails it
+        is not retried for `REFRESH_RETRY_INTERVAL` seconds so that unreachable services
+        do not slow down every search.
+
+    Args:
+        path (string): Path of the catalog cache file that is refreshed.
+        fn (callable): The function that refreshes the cache file.
+        *args: Arguments to pass to `fn`.
+        **kwargs: Keyword arguments to pass to `fn`.
+
+    Returns:
+        The concurrent.futures.Future of the refresh, or None if it was not scheduled.
+    """
+    global _refresh_executor
+
+    with _refresh_lock:
+        future = _refreshes.get(path)
+        if future is not None and not future.done():
+            return future
+
+        if time.time() - _refresh_failures.get(path, 0) < REFRESH_RETRY_INTERVAL:
+            return None
+
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS,
+                                                   thread_name_prefix='quest-catalog-refresh')
+
+        future = _refresh_executor.submit(_run_refresh, path, fn, *args, **kwargs)
+        _refreshes[path] = future
+
+    return future
+
+
+def _run_refresh(path, fn, *args, **kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        logger.error('Refreshing the catalog cache {} failed: {}'.format(path, e))
+        with _refresh_lock:
+            _refresh_failures[path] = time.time()
+        raise
+
+
+def wait_for_refreshes(timeout=None):
+    """Waits until the scheduled background refreshes are done.
+
+    Args:
+        timeout (float): Optional maximum number of seconds to wait.
+    """
+    with _refresh_lock:
+        futures = list(_refreshes.values())
+
+    wait(futures, timeout=timeout)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
@@ -0,0 +1,244 @@
+"""Download cache shared by all projects.
+
+Downloaded files are stored once under the cache directory, keyed by a hash of the catalog
+entry and download options they were downloaded with, so that a dataset downloaded with the
+same options in any project can use the stored file instead of downloading it again.
+
+An index of the stored downloads is kept in a SQLite database next to the files. Each entry
+counts the datasets that reference it; entries that are no longer referenced are evicted,
+least recently used first, once the stored files exceed the `DOWNLOAD_CACHE_SIZE` setting.
+"""
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from .config import get_settings
+from .misc import get_cache_dir
+from ..database.database import configure_connection, hash_options
+
+
+DOWNLOAD_CACHE_SIZE = 5 * 2 ** 30  # bytes
+_INDEX_FILE = 'downloads.db'
+
+
+def download_cache_dir():
+    """Gets the directory that downloads are stored in.
+
+    Returns:
+        A string of the path to the download cache directory.
+    """
+    return os.path.join(get_cache_dir(), 'downloads')
+
+
+def download_key(catalog_entry, options):
+    """Gets the key of a download in the cache.
+
+    Args:
+        catalog_entry (string): Uri of the catalog entry that is downloaded.
+        options (dict): Download options. Options that only differ in the order of their keys
+        have the same key.
+
+    Returns:
+        A string of the hex digest of the catalog entry and options.
+    """
+    return hash_options([catalog_entry, options or {}])
+
+
+def acquire(key):
+    """Gets a stored download and adds a reference to it.
+
+    Args:
+        key (string): Key of the download (see `download_key`).
+
+    Returns:
+        A dict of the metadata returned by the download with the `file_path` of the stored file,
+        or None if the download is not stored.
+    """
+    with _connect() as connection:
+        row = connection.execute('SELECT path, metadata FROM downloads WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        path, metadata = row
+        file_path = os.path.join(download_cache_dir(), path)
+        if not os.path.exists(file_path):
+            # the stored file was removed outside of quest
+            connection.execute('DELETE FROM downloads WHERE key = ?', (key,))
+            return None
+
+        connection.execute('UPDATE downloads SET refcount = refcount + 1, last_used = ? WHERE key = ?',
+                           (time.time(), key))
+
+    metadata = json.loads(metadata)
+    metadata['file_path'] = file_path
+
+    return metadata
+
+
+def store(key, catalog_entry, options, metadata, folder=None):
+    """Moves a downloaded file into the cache and adds a reference to it.
+
+    Notes:
+        If the download was already stored (i.e. by another process) the stored file is used
+        and the downloaded file is removed.
+
+    Args:
+        key (string): Key of the download (see `download_key`).
+        catalog_entry (string): Uri of the catalog entry that was downloaded.
+        options (dict): Download options.
+        metadata (dict): Metadata returned by the download, with the `file_path` of the downloaded file.
+        folder (string): Optional folder that contains the downloaded file and any other files of the
+            download. The whole folder is stored, otherwise only the downloaded file is stored.
+
+    Returns:
+        The path of the stored file, or None if the download has no file to store.
+    """
+    file_path = metadata.get('file_path')
+    if file_path is None or not os.path.exists(file_path):
+        return None
+
+    source = os.path.normpath(folder or file_path)
+    path = os.path.normpath(os.path.join(_key_dir(key), os.path.basename(source),
+                                         os.path.relpath(file_path, source)))
+    stored_path = os.path.join(download_cache_dir(), path)
+    encoded = json.dumps({k: v for k, v in metadata.items() if k != 'file_path'}, default=str)
+
+    with _connect() as connection:
+        row = connection.execute('SELECT path FROM downloads WHERE key = ?', (key,)).fetchone()
+        if row is not None and os.path.exists(os.path.join(download_cache_dir(), row[0])):
+            connection.execute('UPDATE downloads SET refcount = refcount + 1, last_used = ? WHERE key = ?',
+                               (time.time(), key))
+            _remove(source)
+            return os.path.join(download_cache_dir(), row[0])
+
+        key_dir = os.path.join(download_cache_dir(), _key_dir(key))
+        _remove(key_dir)
+        os.makedirs(key_dir)
+        shutil.move(source, os.path.join(key_dir, os.path.basename(source)))
+        connection.execute(
+            'INSERT OR REPLACE INTO downloads (key, catalog_entry, options, path, size, metadata, refcount, last_used) '
+            'VALUES (?, ?, ?, ?, ?, ?, 1, ?)',
+            (key, catalog_entry, json.dumps(options, sort_keys=True, default=str), path, _size(key_dir),
+             encoded, time.time())
+        )
+
+    evict()
+
+    return stored_path
+
+
+def release(keys):
+    """Removes references to stored downloads.
+
+    Args:
+        keys (list): Key of the download of each reference that is removed. Keys can be repeated.
+    """
+    keys = [key for key in keys if isinstance(key, str) and key]
+    if not keys:
+        return
+
+    with _connect() as connection:
+        connection.executemany('UPDATE downloads SET refcount = MAX(refcount - 1, 0) WHERE key = ?',
+                               [(key,) for key in keys])
+
+    evict()
+
+
+def evict(max_size=None):
+    """Removes the least recently used downloads that are no longer referenced until the cache fits a size.
+
+    Args:
+        max_size (int): Optional size of the cache in bytes. Defaults to the `DOWNLOAD_CACHE_SIZE` setting.
+
+    Returns:
+        A list of the keys of the evicted downloads.
+    """
+    if max_size is None:
+        max_size = get_settings().get('DOWNLOAD_CACHE_SIZE', DOWNLOAD_CACHE_SIZE)
+
+    evicted = []
+    with _connect() as connection:
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM downloads').fetchone()[0]
+        if total <= max_size:
+            return evicted
+
+        unused = connection.execute(
+            'SELECT key, size FROM downloads WHERE refcount <= 0 ORDER BY last_used'
+        ).fetchall()
+        for key, size in unused:
+            if total <= max_size:
+                break
+            connection.execute('DELETE FROM downloads WHERE key = ?', (key,))
+            _remove(os.path.join(download_cache_dir(), _key_dir(key)))
+            total -= size
+            evicted.append(key)
+
+    return evicted
+
+
+def get_download_cache_entries():
+    """Gets the index of stored downloads.
+
+    Returns:
+        A list of dicts with the `key`, `catalog_entry`, `options`, `path`, `size`, `refcount`
+        and `last_used` of each stored download, from the most to the least recently used.
+    """
+    with _connect() as connection:
+        cursor = connection.execute(
+            'SELECT key, catalog_entry, options, path, size, refcount, last_used FROM downloads ORDER BY last_used DESC'
+        )
+        columns = [c[0] for c in cursor.description]
+        entries = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    for entry in entries:
+        entry['options'] = json.loads(entry['options'])
+        entry['path'] = os.path.join(download_cache_dir(), entry['path'])
+
+    return entries
+
+
+@contextmanager
+def _connect():
+    """Helper function to open a transaction on the index of the download cache.
+    """
+    os.makedirs(download_cache_dir(), exist_ok=True)
+    with closing(sqlite3.connect(os.path.join(download_cache_dir(), _INDEX_FILE), isolation_level=None)) as connection:
+        configure_connection(connection)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS downloads ('
+            'key TEXT PRIMARY KEY, catalog_entry TEXT, options TEXT, path TEXT, size INTEGER, '
+            'metadata TEXT, refcount INTEGER, last_used REAL)'
+        )
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+
+def _key_dir(key):
+    """Helper function to get the folder a download is stored in, relative to the download cache directory.
+    """
+    return os.path.join(key[:2], key)
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,221 @@
+"""Vectorized GeoJSON encoding of catalog frames.
+
+Features are assembled from strings that are encoded a column at a time: point coordinates
+are formatted straight from the coordinate arrays, other geometries are written by GEOS and
+each property column is encoded once per distinct value where possible.
+"""
+import io
+import json
+import re
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from .misc import to_json_default_handler
+
+
+CHUNK_SIZE = 10000
+_ESCAPE = re.compile(r'["\\\x00-\x1f]')
+
+
+def write_geojson(df, fp=None, precision=None, compact=False, chunksize=CHUNK_SIZE):
+    """Writes a frame of catalog entries as a GeoJSON FeatureCollection.
+
+    Notes:
+        Features are keyed by the index of the frame and have a property for every column
+        except `geometry`, which may hold shapely geometries, WKT strings, GeoJSON dicts or
+        None. Missing values are written as null.
+
+    Args:
+        df (pandas.DataFrame): The catalog entries.
+        fp (string or file): Optional path or binary file object to write to.
+        precision (int): Optional number of decimal places to round coordinates to.
+        compact (bool): If True, leave out the whitespace after separators.
+        chunksize (int): Number of features to encode at a time.
+
+    Returns:
+        The encoded bytes if `fp` is None.
+    """
+    if fp is None:
+        buffer = io.BytesIO()
+        write_geojson(df, buffer, precision=precision, compact=compact, chunksize=chunksize)
+        return buffer.getvalue()
+
+    if isinstance(fp, str):
+        with open(fp, 'wb') as f:
+            return write_geojson(df, f, precision=precision, compact=compact, chunksize=chunksize)
+
+    item_sep, key_sep = (',', ':') if compact else (', ', ': ')
+    fp.write('{{"type"{1}"FeatureCollection"{0}"features"{1}['.format(item_sep, key_sep).encode())
+    for start in range(0, len(df), chunksize):
+        if start > 0:
+            fp.write(item_sep.encode())
+        features = encode_features(df.iloc[start:start + chunksize], precision=precision, compact=compact)
+        fp.write(item_sep.join(features).encode('utf-8'))
+    fp.write(b']}')
+
+
+def encode_features(df, precision=None, compact=False):
+    """Encodes the rows of a frame of catalog entries as GeoJSON features.
+
+    Args:
+        df (pandas.DataFrame): The catalog entries (see `write_geojson`).
+        precision (int): Optional number of decimal places to round coordinates to.
+        compact (bool): If True, leave out the whitespace after separators.
+
+    Returns:
+        A numpy array with the JSON string of each feature.
+    """
+    item_sep, key_sep = (',', ':') if compact else (', ', ': ')
+    n = len(df)
+
+    properties = np.full(n, '{', dtype=object)
+    columns = [c for c in df.columns if c != 'geometry']
+    for i, column in enumerate(columns):
+        key = (item_sep if i else '') + json.dumps(str(column)) + key_sep
+        properties = properties + key + encode_column(df[column], compact=compact)
+    properties = properties + '}'
+
+    if 'geometry' in df.columns:
+        geometry = encode_geometries(df['geometry'].values, precision=precision)
+    else:
+        geometry = np.full(n, 'null', dtype=object)
+
+    ids = _encode_strings(df.index.astype(str).values)
+
+    return ('{"id"' + key_sep + ids + item_sep + '"type"' + key_sep + '"Feature"' + item_sep
+            + '"properties"' + key_sep + properties + item_sep + '"geometry"' + key_sep + geometry + '}')
+
+
+def encode_geometries(values, precision=None):
+    """Encodes geometries as GeoJSON.
+
+    Args:
+        values (array like): Shapely geometries, WKT strings, GeoJSON dicts or None.
+        precision (int): Optional number of decimal places to round coordinates to.
+
+    Returns:
+        A numpy array with the JSON string of each geometry, `null` for missing or empty geometries.
+    """
+    if precision is None and all(v is None or isinstance(v, dict) for v in values):
+        # already GeoJSON
+        return _encode_objects(values, compact=True)
+
+    geometries = _to_geometry_array(values)
+    if precision is not None:
+        geometries = shapely.transform(geometries, partial(np.round, decimals=precision))
+
+    encoded = np.full(len(geometries), 'null', dtype=object)
+    type_ids = shapely.get_type_id(geometries)
+    valid = (type_ids >= 0) & ~shapely.is_empty(geometries)
+
+    points = valid & (type_ids == shapely.GeometryType.POINT)
+    if points.any():
+        coords = shapely.get_coordinates(geometries[points])
+        x, y = _encode_floats(coords[:, 0]), _encode_floats(coords[:, 1])
+        encoded[points] = '{"type":"Point","coordinates":[' + x + ',' + y + ']}'
+
+    others = valid & ~points
+    if others.any():
+        encoded[others] = shapely.to_geojson(geometries[others])
+
+    return encoded
+
+
+def encode_column(values, compact=False):
+    """Encodes the values of a column as JSON.
+
+    Args:
+        values (pandas.Series): The column.
+        compact (bool): If True, leave out the whitespace after separators in nested values.
+
+    Returns:
+        A numpy array with the JSON string of each value.
+    """
+    values = pd.Series(values)
+    dtype = values.dtype
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        categories = np.append(encode_column(pd.Series(values.cat.categories), compact=compact), 'null')
+        return categories[values.cat.codes.values]
+
+    if pd.api.types.is_extension_array_dtype(dtype) and values.hasnans:
+        # nullable dtypes (i.e. Int64 or boolean) hold missing values as pd.NA, which can't be formatted
+        missing = values.isna().values
+        encoded = np.full(len(values), 'null', dtype=object)
+        encoded[~missing] = encode_column(values[~missing], compact=compact)
+        return encoded
+
+    if pd.api.types.is_bool_dtype(dtype):
+        return np.where(values.values, 'true', 'false').astype(object)
+
+    if pd.api.types.is_integer_dtype(dtype):
+        return values.values.astype(str).astype(object)
+
+    if pd.api.types.is_float_dtype(dtype):
+        return _encode_floats(values.values)
+
+    try:
+        codes, uniques = pd.factorize(values)
+    except TypeError:
+        # values that can't be hashed, i.e. dicts
+        return _encode_objects(values.values, compact)
+
+    uniques = np.asarray(uniques, dtype=object)
+    if pd.api.types.infer_dtype(uniques, skipna=False) == 'string':
+        encoded = _encode_strings(uniques)
+    else:
+        encoded = _encode_objects(uniques, compact)
+
+    return np.append(encoded, 'null')[codes]
+
+
+def _encode_floats(values):
+    values = np.asarray(values, dtype=float)
+    encoded = values.astype(str).astype(object)
+    encoded[~np.isfinite(values)] = 'null'
+    return encoded
+
+
+def _encode_strings(values):
+    values = np.asarray(values, dtype=object)
+    encoded = '"' + values + '"'
+    # most strings don't have characters that have to be escaped, so can just be quoted
+    if _ESCAPE.search(''.join(values)):
+        escape = pd.Series(values).str.contains(_ESCAPE.pattern, regex=True).values
+        encoded[escape] = [json.dumps(v) for v in values[escape]]
+    return encoded
+
+
+def _encode_objects(values, compact):
+    encoder = json.JSONEncoder(separators=(',', ':') if compact else (', ', ': '), default=_default)
+    return np.array([
+        'null' if v is None or (isinstance(v, float) and not np.isfinite(v)) else encoder.encode(v)
+        for v in values
+    ], dtype=object)
+
+
+def _default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return to_json_default_handler(obj)
+
+
+def _to_geometry_array(values):
+    geometries = np.asarray(values, dtype=object)
+    if shapely.is_valid_input(geometries).all():
+        return geometries
+
+    geometries = np.array([v if isinstance(v, shapely.Geometry) else None for v in values], dtype=object)
+    for kind, parse in [(str, shapely.from_wkt), (dict, _from_geojson)]:
+        idx = np.array([isinstance(v, kind) for v in values], dtype=bool)
+        if idx.any():
+            geometries[idx] = parse(np.asarray(values, dtype=object)[idx])
+
+    return geometries
+
+
+def _from_geojson(values):
+    return shapely.from_geojson(_encode_objects(values, compact=True).astype(str))
@@ -0,0 +1,155 @@
+"""Index of the catalog entries of all cached service catalogs.
+
+The index holds a lightweight record (service, service_id, parameters and bounds) of every
+entry of every cached catalog, so that spatial and parameter searches across services can
+find the matching entries without loading each catalog. The full entries are then read
+from the per-service caches.
+"""
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from . import catalog_cache
+from .misc import get_cache_dir, listify
+
+
+INDEX_COLUMNS = ['service', 'service_id', 'parameters'] + catalog_cache.BOUNDS_COLUMNS
+_SOURCES_METADATA_KEY = b'quest_sources'
+_update_lock = threading.Lock()
+
+
+def global_index_file(cache_dir=None):
+    """Gets the path of the global catalog index.
+
+    Args:
+        cache_dir (string): Optional cache directory. Defaults to the `CACHE_DIR` setting.
+
+    Returns:
+        A string of the path to the global index file.
+    """
+    return os.path.join(cache_dir or get_cache_dir(), 'catalog_index' + catalog_cache.CATALOG_CACHE_EXT)
+
+
+def update_global_index(cache_files, path=None):
+    """Brings the global index up to date with the catalog caches of services.
+
+    Notes:
+        The modification time of each catalog cache is recorded in the index, so only the
+        records of catalogs that changed since the last update are read again. Services
+        that are not in `cache_files` (or whose cache no longer exists) are dropped.
+
+    Args:
+        cache_files (dict): Path of the catalog cache file keyed by service uri.
+        path (string): Optional path of the index. Defaults to `global_index_file()`.
+
+    Returns:
+        The index as a pandas.DataFrame with `INDEX_COLUMNS`, sorted by service and service_id. The
+        modification time of the index file the frame was loaded from is kept in its `attrs`.
+    """
+    path = path or global_index_file()
+    mtimes = {service: catalog_cache._mtime(cache_file) for service, cache_file in cache_files.items()}
+    mtimes = {service: mtime for service, mtime in mtimes.items() if mtime is not None}
+
+    with _update_lock:
+        index, sources = _load_global_index(path, catalog_cache._mtime(path))
+        if sources == mtimes:
+            return index
+
+        changed = [service for service, mtime in mtimes.items() if sources.get(service) != mtime]
+        records = [index[index['service'].isin(set(mtimes) - set(changed))]]
+        records.extend(_read_records(service, cache_files[service]) for service in changed)
+
+        index = pd.concat(records, ignore_index=True)
+        index['parameters'] = index['parameters'].astype(str).astype('category')
+        index = index.sort_values(['service', 'service_id'], kind='mergesort').reset_index(drop=True)
+        _write_global_index(index, mtimes, path)
+        index.attrs['mtime'] = catalog_cache._mtime(path)
+
+    return index
+
+
+def query_global_index(index, bbox=None, parameter=None, services=None, path=None):
+    """Finds the entries of the global index that may match a search.
+
+    Args:
+        index (pandas.DataFrame): The global index (see `update_global_index`).
+        bbox (list or string): Optional bounding box as `xmin, ymin, xmax, ymax`. Entries whose
+        bounds intersect the bounding box are returned, exact intersection is left to the caller.
+        parameter (string): Optional parameter that the entries must have.
+        services (list): Optional service uris to limit the search to.
+        path (string): Optional path of the index. Defaults to `global_index_file()`.
+
+    Returns:
+        A pandas.DataFrame of the matching records of the index.
+    """
+    mask = np.ones(len(index), dtype=bool)
+
+    if bbox is not None:
+        # the spatial index is only used if it matches the version of the index file the frame was loaded from
+        mtime = index.attrs.get('mtime')
+        rows = None if mtime is None else catalog_cache.query_spatial_index(path or global_index_file(), bbox,
+                                                                             mtime=mtime)
+        if rows is None:
+            bounds = index[catalog_cache.BOUNDS_COLUMNS].values
+            rows = catalog_cache.SpatialIndex(bounds).query(bbox)
+        bbox_mask = np.zeros(len(index), dtype=bool)
+        bbox_mask[rows] = True
+        mask &= bbox_mask
+
+    if parameter is not None:
+        codes, combinations = pd.factorize(index['parameters'])
+        matches = np.array([parameter in str(c).split(',') for c in combinations] + [False])
+        mask &= matches[codes]
+
+    if services is not None:
+        mask &= index['service'].isin(listify(services)).values
+
+    return index[mask]
+
+
+@lru_cache(maxsize=1)
+def _load_global_index(path, index_mtime):
+    if index_mtime is None:
+        return pd.DataFrame(columns=INDEX_COLUMNS), dict()
+
+    table = pq.read_table(path)
+    sources = json.loads(table.schema.metadata[_SOURCES_METADATA_KEY].decode())
+    index = table.to_pandas()
+    index.attrs['mtime'] = index_mtime
+
+    return index, sources
+
+
+def _read_records(service, cache_file):
+    columns = ['service_id', 'parameters'] + catalog_cache.BOUNDS_COLUMNS
+    records = pq.read_table(cache_file, columns=columns).to_pandas()
+    records['parameters'] = records['parameters'].astype(str)
+    records.insert(0, 'service', service)
+    return records
+
+
+def _write_global_index(index, sources, path):
+    os.makedirs(os.path.split(path)[0], exist_ok=True)
+    # the spatial index is written before the index, see `catalog_cache.query_spatial_index`
+    catalog_cache.SpatialIndex(index[catalog_cache.BOUNDS_COLUMNS].values.astype(float)).save(
+        catalog_cache.spatial_index_file(path)
+    )
+
+    table = pa.Table.from_pandas(index[INDEX_COLUMNS], preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_SOURCES_METADATA_KEY] = json.dumps(sources).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path, row_group_size=catalog_cache.ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
@@ -7,7 +7,7 @@ import shapely.geometry
 import geopandas as gpd
 import pandas as pd
 import numpy as np
-from geojson import LineString, Point, Polygon, Feature, FeatureCollection, MultiPolygon
+from geojson import Polygon, FeatureCollection, MultiPolygon
 
 try:
     import simplejson as json
@@ -351,37 +351,41 @@ def to_geojson(df):
     Returns:
         A geojson object is what is being returned.
     """
-    _func = {
-        'LineString': LineString,
-        'Point': Point,
-        'Polygon': Polygon,
-    }
-    features = []
-    if not df.empty:
-        # TODO what is this code doing and is it now obsolete with the new DB?
-        idx = df.columns.str.startswith('_')
-        r = {field: field[1:] for field in df.columns[idx]}
-        for uid, row in df.iterrows():
-            metadata = json.loads(row[~idx].dropna().to_json())
-            row = row[idx].rename(index=r)
-
-            # create geojson geometry
-            geometry = None
-            if row['geom_type'] is not None:
-                coords = row['geom_coords']
-                if not isinstance(coords, (list, tuple)):
-                    coords = json.loads(coords)
-                geometry = _func[row['geom_type']](coords)
-            del row['geom_type']
-            del row['geom_coords']
-
-            # split fields into properties and metadata
-            properties = json.loads(row.dropna().to_json())
-            properties.update({'metadata': metadata})
-            features.append(Feature(geometry=geometry, properties=properties,
-                                    id=uid))
-
-    return FeatureCollection(features)
+    from .geojson_encoder import write_geojson
+
+    if df.empty:
+        return FeatureCollection([])
+
+    # TODO what is this code doing and is it now obsolete with the new DB?
+    idx = df.columns.str.startswith('_')
+    properties = df.loc[:, idx].rename(columns={field: field[1:] for field in df.columns[idx]})
+
+    # create geojson geometry
+    properties['geometry'] = [
+        None if geom_type is None else
+        {'type': geom_type, 'coordinates': coords if isinstance(coords, (list, tuple)) else json.loads(coords)}
+        for geom_type, coords in zip(properties.pop('geom_type'), properties.pop('geom_coords'))
+    ]
+
+    # split fields into properties and metadata
+    fields = df.columns[~idx]
+    properties['metadata'] = [{k: v for k, v in zip(fields, values) if not _is_null(v)}
+                              for values in zip(*[df[field].values for field in fields])]
+
+    # coordinates are rounded to the same precision as geojson geometries
+    features = json.loads(write_geojson(properties, precision=6).decode('utf-8'))['features']
+    for feature in features:
+        feature['properties'] = {k: v for k, v in feature['properties'].items() if v is not None}
+
+    # assigned after construction so that the features aren't converted to geojson objects one by one
+    feature_collection = FeatureCollection([])
+    feature_collection['features'] = features
+
+    return feature_collection
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
 
 
 def to_json_default_handler(obj):
@@ -33,7 +33,8 @@ class DatasetSelector(QuestSelector):
         datasets = quest.api.get_datasets(
             filters=self.filters,
             queries=self.queries,
-            expand=True
+            expand=True,
+            columns=['display_name'],
         )
         return {v['display_name']: k for k, v in datasets.items()}
 
@@ -56,7 +57,8 @@ class DatasetListSelector(QuestSelector, param.ListSelector):
         datasets = quest.api.get_datasets(
             filters=self.filters,
             queries=self.queries,
-            expand=True
+            expand=True,
+            columns=['display_name'],
         )
         return {v['display_name']: k for k, v in datasets.items()}
 
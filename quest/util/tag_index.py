@@ -0,0 +1,175 @@
+import json
+import os
+from functools import lru_cache
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from . import catalog_cache
+from .geojson_encoder import encode_column
+
+
+# metadata fields that are unusable as tag fields
+EXCLUDED_FIELDS = ['location', 'coverages']
+TAG_INDEX_COLUMNS = ['tag', 'value', 'count']
+
+
+def tag_index_file(path):
+    """Gets the path of the tag index that is persisted next to a catalog cache file.
+
+    Args:
+        path (string): Path of the catalog cache file.
+
+    Returns:
+        A string of the path to the tag index file.
+    """
+    return os.path.splitext(path)[0] + '_tags' + catalog_cache.CATALOG_CACHE_EXT
+
+
+def build_tag_index(metadata):
+    """Counts the catalog entries that have each value of each tag.
+
+    Notes:
+        Each metadata field is a tag. Fields holding dicts are split into multi-index tags
+        where the keys of nested dicts are joined with ':' (i.e. `location:county`), and
+        values that are lists count for each of their items. Values are stored JSON encoded.
+
+    Args:
+        metadata (pandas.DataFrame): The metadata side table of a catalog.
+
+    Returns:
+        A pandas.DataFrame with `tag`, `value` and `count` columns, sorted by tag and from
+        the most to the least common value.
+    """
+    counts = []
+    for field in metadata.columns:
+        if field == 'service_id' or field in EXCLUDED_FIELDS:
+            continue
+        for tag, values in _flatten(str(field), metadata[field].reset_index(drop=True)):
+            counts.append(_count_values(tag, values))
+
+    return _sort(pd.concat(counts, ignore_index=True) if counts else pd.DataFrame(columns=TAG_INDEX_COLUMNS))
+
+
+def update_tag_index(index, removed=None, added=None):
+    """Updates the counts of a tag index for catalog entries that were removed or added.
+
+    Args:
+        index (pandas.DataFrame): The tag index (see `build_tag_index`).
+        removed (pandas.DataFrame): Optional metadata of the catalog entries that were removed.
+        added (pandas.DataFrame): Optional metadata of the catalog entries that were added.
+
+    Returns:
+        The updated tag index. Values that are no longer used are dropped.
+    """
+    parts = [index[TAG_INDEX_COLUMNS]]
+    if removed is not None and not removed.empty:
+        removed = build_tag_index(removed)
+        parts.append(removed.assign(count=-removed['count']))
+    if added is not None and not added.empty:
+        parts.append(build_tag_index(added))
+
+    index = pd.concat(parts, ignore_index=True).groupby(['tag', 'value'], sort=False)['count'].sum().reset_index()
+
+    return _sort(index[index['count'] > 0])
+
+
+def write_tag_index(path, index):
+    """Writes a tag index next to a catalog cache file.
+
+    Args:
+        path (string): Path of the catalog cache file.
+        index (pandas.DataFrame): The tag index (see `build_tag_index`).
+    """
+    catalog_cache._write_table(index[TAG_INDEX_COLUMNS].reset_index(drop=True), tag_index_file(path))
+
+
+def read_tag_index(path):
+    """Reads the tag index of a catalog cache file.
+
+    Notes:
+        The index written next to the cache file is used if it is up to date, otherwise it is
+        built from the metadata side table of the cache and written. Indexes are kept in
+        memory for as long as the cache file is not rewritten.
+
+    Args:
+        path (string): Path of the catalog cache file.
+
+    Returns:
+        The tag index (see `build_tag_index`).
+    """
+    return _load_tag_index(path, catalog_cache._mtime(path)).copy()
+
+
+def tags_to_dict(index, as_count=False):
+    """Converts a tag index to a dict of the values of each tag.
+
+    Args:
+        index (pandas.DataFrame): The tag index (see `build_tag_index`).
+        as_count (bool): If True, map the decoded values of each tag to their counts instead.
+
+    Returns:
+        A dict keyed by tag of a list of values (or dict of counts).
+    """
+    tags = dict()
+    for tag, values, counts in zip(index['tag'], index['value'], index['count']):
+        value = json.loads(values)
+        if as_count:
+            tags.setdefault(tag, dict())[_hashable(value)] = int(counts)
+        else:
+            tags.setdefault(tag, list()).append(value)
+
+    return tags
+
+
+@lru_cache(maxsize=catalog_cache.MEMORY_CACHE_SIZE)
+def _load_tag_index(path, catalog_mtime):
+    index_file = tag_index_file(path)
+    index_mtime = catalog_cache._mtime(index_file)
+    if index_mtime is not None and index_mtime >= catalog_mtime:
+        return pq.read_table(index_file).to_pandas()
+
+    index = build_tag_index(catalog_cache.read_metadata(path))
+    write_tag_index(path, index)
+
+    return index
+
+
+def _flatten(tag, values):
+    """Helper function for `build_tag_index` to split the nested dicts of a field into multi-index tags.
+    """
+    is_dict = values.map(lambda v: isinstance(v, dict)).values.astype(bool)
+    if not is_dict.any():
+        yield tag, values
+        return
+
+    if not is_dict.all():
+        yield tag, values[~is_dict]
+
+    nested = pd.json_normalize(list(values[is_dict]), sep=':')
+    nested.index = values.index[is_dict]
+    for key in nested.columns:
+        # keys that are missing from an entry are not counted
+        yield '{}:{}'.format(tag, key), nested[key].dropna()
+
+
+def _count_values(tag, values):
+    """Helper function for `build_tag_index` to count the entries that have each value of a tag.
+    """
+    if values.map(lambda v: isinstance(v, (list, tuple))).any():
+        values = values.explode()
+
+    # count each entry once per value
+    encoded = pd.DataFrame({'row': values.index, 'value': encode_column(values, compact=True)}).drop_duplicates()
+    counts = encoded['value'].value_counts(sort=False)
+
+    return pd.DataFrame({'tag': tag, 'value': counts.index.astype(str), 'count': counts.values.astype('int64')})
+
+
+def _sort(index):
+    index = index.sort_values(['tag', 'count', 'value'], ascending=[True, False, True], kind='mergesort')
+    return index.reset_index(drop=True)
+
+
+def _hashable(value):
+    return json.dumps(value) if isinstance(value, (list, dict)) else value
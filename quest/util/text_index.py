@@ -0,0 +1,335 @@
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from . import catalog_cache
+
+
+TOKEN_PATTERN = r'\w+'
+# columns that are not searched with search terms
+UNINDEXED_COLUMNS = ['geometry', 'reserved', 'service', 'name'] + catalog_cache.BOUNDS_COLUMNS
+# relative weight of a token occurring in each column when ranking keyword searches
+FIELD_WEIGHTS = {'display_name': 3.0, 'description': 2.0}
+_REGEX_CHARS = set('.^$*+?{}[]|()\\')
+
+
+def tokenize(text):
+    """Splits text into lower case word tokens.
+
+    Args:
+        text (string): The text to tokenize.
+
+    Returns:
+        A list of tokens.
+    """
+    return re.findall(TOKEN_PATTERN, str(text).lower())
+
+
+class TokenIndex(object):
+    """Inverted index of the word tokens in the text columns of a catalog.
+
+    Notes:
+        The index maps every distinct token (the vocabulary, kept in sorted order) to the
+        rows of the catalog that contain it. Postings are stored as a single array of row
+        numbers grouped by token with `offsets` marking where the rows of each token start.
+
+    Args:
+        service_ids (numpy.ndarray): The service id of each row of the catalog.
+        vocabulary (numpy.ndarray): The sorted distinct tokens.
+        offsets (numpy.ndarray): Start of the postings of each token, with a final end offset.
+        postings (numpy.ndarray): Sorted row numbers of each token.
+        weights (numpy.ndarray): Number of times each token occurs in each row, weighted by
+        the `FIELD_WEIGHTS` of the columns it occurs in.
+    """
+    def __init__(self, service_ids, vocabulary, offsets, postings, weights=None):
+        self.service_ids = service_ids
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.postings = postings
+        self.weights = np.ones(len(postings)) if weights is None else weights
+
+    def __len__(self):
+        return len(self.service_ids)
+
+    @classmethod
+    def build(cls, catalog_entries):
+        """Builds an index of a catalog.
+
+        Args:
+            catalog_entries (pandas.DataFrame): The catalog with a `service_id` column. All
+            columns except `UNINDEXED_COLUMNS` are indexed as text.
+
+        Returns:
+            A TokenIndex.
+        """
+        n = len(catalog_entries)
+        rows, tokens, weights = [], [], []
+        for column in catalog_entries.columns:
+            if column in UNINDEXED_COLUMNS:
+                continue
+            values = pd.Series(catalog_entries[column].values).dropna().astype(str).str.lower()
+            column_tokens = values.str.findall(TOKEN_PATTERN).explode().dropna()
+            rows.append(column_tokens.index.values.astype(np.int64))
+            tokens.append(column_tokens.values)
+            weights.append(np.full(len(column_tokens), FIELD_WEIGHTS.get(column, 1.0)))
+
+        rows = np.concatenate(rows) if rows else np.array([], dtype=np.int64)
+        tokens = np.concatenate(tokens) if tokens else np.array([], dtype=object)
+        weights = np.concatenate(weights) if weights else np.array([], dtype=float)
+        codes, vocabulary = pd.factorize(tokens)
+        vocabulary = np.asarray(vocabulary, dtype=object)
+
+        # renumber tokens in sorted order and merge repeated tokens of a row
+        order = np.argsort(vocabulary, kind='mergesort')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        keys, inverse = np.unique(rank[codes] * max(n, 1) + rows, return_inverse=True)
+        weights = np.bincount(inverse, weights=weights, minlength=len(keys))
+        codes, rows = keys // max(n, 1), keys % max(n, 1)
+
+        offsets = np.searchsorted(codes, np.arange(len(vocabulary) + 1))
+        service_ids = catalog_entries['service_id'].astype(str).values
+
+        return cls(service_ids, vocabulary[order], offsets, rows, weights)
+
+    @classmethod
+    def concat(cls, indexes):
+        """Combines the indexes of consecutive parts of a catalog into an index of the whole catalog.
+
+        Args:
+            indexes (list): The TokenIndex of each part.
+
+        Returns:
+            A TokenIndex.
+        """
+        vocabulary = np.unique(np.concatenate([index.vocabulary for index in indexes]))
+        row_offsets = np.cumsum([0] + [len(index) for index in indexes[:-1]])
+
+        codes = np.concatenate([
+            np.repeat(np.searchsorted(vocabulary, index.vocabulary), np.diff(index.offsets)) for index in indexes
+        ])
+        rows = np.concatenate([index.postings + offset for index, offset in zip(indexes, row_offsets)])
+        weights = np.concatenate([index.weights for index in indexes])
+
+        # the postings of each token stay sorted since the parts are consecutive
+        order = np.argsort(codes, kind='stable')
+        offsets = np.searchsorted(codes[order], np.arange(len(vocabulary) + 1))
+        service_ids = np.concatenate([index.service_ids for index in indexes])
+
+        return cls(service_ids, vocabulary, offsets, rows[order].astype(np.int64), weights[order])
+
+    def save(self, path):
+        """Writes the index to a numpy `.npz` file.
+        """
+        tmp_path = path + '.tmp.npz'
+        service_ids, service_id_lengths = _encode_strings(self.service_ids)
+        vocabulary, vocabulary_lengths = _encode_strings(self.vocabulary)
+        np.savez(tmp_path, service_ids=service_ids, service_id_lengths=service_id_lengths,
+                 vocabulary=vocabulary, vocabulary_lengths=vocabulary_lengths, offsets=self.offsets,
+                 postings=self.postings, weights=self.weights)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written with `TokenIndex.save`.
+        """
+        with np.load(path) as data:
+            return cls(service_ids=_decode_strings(data['service_ids'], data['service_id_lengths']),
+                       vocabulary=_decode_strings(data['vocabulary'], data['vocabulary_lengths']),
+                       offsets=data['offsets'],
+                       postings=data['postings'], weights=data['weights'])
+
+    def rows(self, token_ids):
+        """Gets the sorted rows that contain any of the tokens.
+        """
+        if len(token_ids) == 0:
+            return np.array([], dtype=np.int64)
+
+        return np.unique(np.concatenate([self.postings[self.offsets[i]:self.offsets[i + 1]] for i in token_ids]))
+
+    def candidates(self, term):
+        """Finds the rows that may contain a search term.
+
+        Notes:
+            A term that occurs in a text value only occurs within tokens of the value that
+            contain each token of the term, so the rows containing such tokens are a superset
+            of the rows that contain the term. The caller should check the candidates.
+
+        Args:
+            term (string): The search term.
+
+        Returns:
+            A sorted numpy array of candidate rows, or None if the index can't be used for
+            the term (i.e. it has no tokens or is a regular expression).
+        """
+        term_tokens = tokenize(term)
+        if not term_tokens or _REGEX_CHARS.intersection(term):
+            return None
+
+        vocabulary = pd.Series(self.vocabulary)
+        rows = None
+        for token in set(term_tokens):
+            token_ids = np.flatnonzero(vocabulary.str.contains(token, regex=False).values)
+            token_rows = self.rows(token_ids)
+            rows = token_rows if rows is None else np.intersect1d(rows, token_rows, assume_unique=True)
+
+        return rows
+
+    def lookup(self, token, prefix=False):
+        """Gets the ids of the tokens in the vocabulary that equal, or start with, a token.
+        """
+        return np.arange(*self._token_range(token, prefix=prefix))
+
+    def _token_range(self, token, prefix=False):
+        # the vocabulary is sorted, so matching tokens are contiguous
+        start = np.searchsorted(self.vocabulary, token, side='left')
+        stop = np.searchsorted(self.vocabulary, token + '\U0010ffff' if prefix else token, side='right')
+        return start, stop
+
+    def search(self, keywords, prefix=True, match_all=True):
+        """Ranks the rows that contain keywords.
+
+        Notes:
+            Rows are scored with the sum over the keywords of the weighted number of times a
+            keyword occurs in the row (see `FIELD_WEIGHTS`) times the inverse document
+            frequency of the keyword, so that rare keywords and keywords that occur in the
+            name of an entry rank higher.
+
+        Args:
+            keywords (string or list): The keywords. Each keyword is tokenized (see `tokenize`).
+            prefix (bool): If True, keywords also match tokens that start with the keyword.
+            match_all (bool): If True, only rows that contain all keywords are returned,
+            otherwise rows that contain any of the keywords are returned.
+
+        Returns:
+            A tuple of a sorted numpy array of matching rows and an array of their scores.
+        """
+        if isinstance(keywords, str):
+            keywords = [keywords]
+        tokens = sorted(set(token for keyword in keywords for token in tokenize(keyword)))
+
+        n = len(self)
+        scores = np.zeros(n)
+        counts = np.zeros(n, dtype=np.int64)
+        for token in tokens:
+            start, stop = self._token_range(token, prefix=prefix)
+            frequencies = np.diff(self.offsets[start:stop + 1])
+            idf = np.repeat(np.log(1 + n / np.maximum(frequencies, 1)), frequencies)
+            postings = slice(self.offsets[start], self.offsets[stop])
+            token_scores = np.bincount(self.postings[postings], weights=self.weights[postings] * idf, minlength=n)
+            counts += token_scores > 0
+            scores += token_scores
+
+        if not tokens:
+            rows = np.array([], dtype=np.int64)
+        elif match_all:
+            rows = np.flatnonzero(counts == len(tokens))
+        else:
+            rows = np.flatnonzero(counts)
+
+        return rows, scores[rows]
+
+
+def token_index_file(path):
+    """Gets the path of the token index that is persisted next to a catalog cache file.
+
+    Args:
+        path (string): Path of the catalog cache file.
+
+    Returns:
+        A string of the path to the token index file.
+    """
+    return os.path.splitext(path)[0] + '_tokens.npz'
+
+
+def build_token_index(catalog_entries, metadata=None):
+    """Builds the token index of a catalog.
+
+    Args:
+        catalog_entries (pandas.DataFrame): The normalized catalog with a `service_id` column.
+        metadata (pandas.DataFrame): Optional metadata side table with a `service_id` column.
+
+    Returns:
+        The TokenIndex.
+    """
+    return TokenIndex.build(_join_metadata(catalog_entries, metadata))
+
+
+def write_token_index(path, catalog_entries, metadata=None):
+    """Builds the token index of a catalog and writes it next to its cache file.
+
+    Args:
+        path (string): Path of the catalog cache file.
+        catalog_entries (pandas.DataFrame): The normalized catalog with a `service_id` column.
+        metadata (pandas.DataFrame): Optional metadata side table with a `service_id` column.
+
+    Returns:
+        The TokenIndex.
+    """
+    index = build_token_index(catalog_entries, metadata)
+    index.save(token_index_file(path))
+    return index
+
+
+def get_token_index(path):
+    """Gets the token index of a catalog cache file.
+
+    Notes:
+        The index written next to the cache file is used if it is up to date, otherwise it is
+        built from the cached catalog and its metadata side table and written. Indexes are kept
+        in memory for as long as the cache file is not rewritten.
+
+    Args:
+        path (string): Path of the catalog cache file.
+
+    Returns:
+        A TokenIndex.
+    """
+    return _load_token_index(path, catalog_cache._mtime(path))
+
+
+@lru_cache(maxsize=catalog_cache.MEMORY_CACHE_SIZE)
+def _load_token_index(path, catalog_mtime):
+    index_file = token_index_file(path)
+    index_mtime = catalog_cache._mtime(index_file)
+    if index_mtime is not None and index_mtime >= catalog_mtime:
+        try:
+            return TokenIndex.load(index_file)
+        except KeyError:
+            # written by a version that did not store the lengths of the strings
+            pass
+
+    tiers = catalog_cache.get_geometry_tiers(path)
+    columns = [c for c in pq.read_schema(path).names if c not in UNINDEXED_COLUMNS and c not in tiers]
+    catalog_entries = catalog_cache.read_catalog(path, columns=columns)
+    metadata = catalog_cache.read_metadata(path)
+
+    return write_token_index(path, catalog_entries, metadata)
+
+
+def _join_metadata(catalog_entries, metadata=None):
+    catalog_entries = pd.DataFrame(catalog_entries).reset_index(drop=True)
+    if metadata is None:
+        return catalog_entries
+
+    metadata = pd.DataFrame(metadata).set_index('service_id')
+    metadata.index = metadata.index.astype(str)
+    metadata = metadata.reindex(catalog_entries['service_id'].astype(str).values).reset_index(drop=True)
+    return pd.concat([catalog_entries, metadata], axis=1)
+
+
+def _encode_strings(values):
+    # tokens and service ids are stored as a single buffer of utf-8 strings and the length of each string
+    encoded = [str(value).encode('utf-8') for value in values]
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), np.array([len(e) for e in encoded], dtype=np.int64)
+
+
+def _decode_strings(buffer, lengths):
+    data = buffer.tobytes()
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+    return np.array([data[start:stop].decode('utf-8') for start, stop in zip(offsets[:-1], offsets[1:])],
+                    dtype=object)
@@ -40,9 +40,8 @@ class HSGeoService(HSServiceBase):
     def search_catalog(self, **kwargs):
 
         catalog = self.provider.search_catalog('hs_norm')
-        metadata = pd.DataFrame(catalog.metadata.tolist(), index=catalog.index)
+        metadata = self.provider.get_catalog_metadata('hs_norm')
         catalog = pd.concat([catalog, metadata], axis=1)
-        del catalog['metadata']
 
         idx = catalog['coverages'].apply(lambda x: x == x and len([c for c in x if c['type'] != 'period']) > 0)
         catalog = catalog[idx]
@@ -1,6 +1,9 @@
 import os
+import time
 
 import param
+import requests
+import numpy as np
 import pandas as pd
 import concurrent.futures
 from ulmo.usgs import nwis
@@ -15,6 +18,7 @@ BASE_PATH = 'usgs-nwis'
 
 
 class NwisServiceBase(TimePeriodServiceBase):
+    native_filters = ['bbox', 'parameter']
     period = param.String(default='P365D', precedence=4, doc='time period (e.g. P365D = 365 days or P4W = 4 weeks)')
 
     def download(self, catalog_id, file_path, dataset, **kwargs):
@@ -84,26 +88,53 @@ class NwisServiceBase(TimePeriodServiceBase):
 
         return metadata
 
-    def search_catalog(self, **kwargs):
+    def search_catalog(self, bbox=None, parameter=None, **kwargs):
+        return self._search_sites(bbox=bbox, parameter=parameter)
+
+    def search_catalog_chunks(self, bbox=None, parameter=None, **kwargs):
+        # each state (or bbox tile) is a chunk, so the cache is built without merging all sites in memory
+        return self._iter_sites(bbox=bbox, parameter=parameter)
+
+    def get_catalog_updates(self, since, bbox=None, parameter=None, **kwargs):
+        # the site service takes a period rather than a date, round it up to whole days so it overlaps the last refresh
+        days = int(np.ceil((pd.Timestamp(time.time(), unit='s') - since) / pd.Timedelta(days=1))) + 1
+        return self._search_sites(bbox=bbox, parameter=parameter, modifiedSince='P{}D'.format(days))
+
+    def _search_sites(self, bbox=None, parameter=None, **extra):
+        chunks = [df for df in self._iter_sites(bbox=bbox, parameter=parameter, **extra) if not df.empty]
+        if not chunks:
+            return pd.DataFrame()
+
+        df = pd.concat(chunks)
+        return df[~df.index.duplicated(keep='last')]
+
+    def _iter_sites(self, bbox=None, parameter=None, **extra):
+        """Yields a DataFrame of the sites returned by each query, as the queries complete.
+        """
+        queries = [dict(extra, state_code=state) for state in _states()]
+        if bbox is not None:
+            tiles = _bbox_tiles(bbox)
+            if len(tiles) < len(queries):
+                queries = [dict(extra, bounding_box=tile) for tile in tiles]
+
+        # only filter by parameter if it maps to a single nwis parameter code
+        parameter_code = self.parameter_map(invert=True).get(parameter)
+        if parameter_code is not None:
+            for query in queries:
+                query['parameter_code'] = parameter_code.split(':')[0]
+
         func = partial(_nwis_catalog_entries, service=self.service_name)
         with concurrent.futures.ProcessPoolExecutor() as executor:
-            sites = executor.map(func, _states())
-
-        sites = {k: v for d in sites for k, v in d.items()}
-        df = pd.DataFrame.from_dict(sites, orient='index')
-
-        for col in ['latitude', 'longitude']:
-            df[col] = df['location'].apply(lambda x: float(x[col]))
-
-        df.rename(columns={
-                    'code': 'service_id',
-                    'name': 'display_name',
-
-                    }, inplace=True)
-        return df
+            futures = {executor.submit(func, query) for query in queries}
+            for future in concurrent.futures.as_completed(futures):
+                # drop the reference to each result once it is used
+                futures.discard(future)
+                yield _sites_to_dataframe(future.result())
 
     def get_parameters(self, catalog_ids=None):
-        df = self.search_catalog()
+        df = catalog_ids if catalog_ids is not None else self.search_catalog()
+        if df.empty:
+            return pd.DataFrame(columns=['service_id', 'parameter'])
 
         chunks = list(_chunks(df.index.tolist()))
         func = partial(_site_info, service=self.service_name)
@@ -162,7 +193,8 @@ class NwisServiceIV(NwisServiceBase):
                 '00065': 'gage_height',
                 '00010': 'water_temperature',
     }
-    parameter = param.ObjectSelector(default=None, doc='parameter', precedence=1, objects=sorted(_parameter_map.values()))
+    parameter = param.ObjectSelector(default=None, doc='parameter', precedence=1,
+                                     objects=sorted(_parameter_map.values()))
 
 
 class NwisServiceDV(NwisServiceBase):
@@ -186,7 +218,8 @@ class NwisServiceDV(NwisServiceBase):
             '00010:00002': 'water_temperature:daily:max',
             '00010:00003': 'water_temperature:daily:mean',
     }
-    parameter = param.ObjectSelector(default=None, doc='parameter', precedence=1, objects=sorted(_parameter_map.values()))
+    parameter = param.ObjectSelector(default=None, doc='parameter', precedence=1,
+                                     objects=sorted(_parameter_map.values()))
 
 
 class NwisProvider(ProviderBase):
@@ -198,14 +231,55 @@ class NwisProvider(ProviderBase):
     name = 'usgs-nwis'
 
 
+def _sites_to_dataframe(sites):
+    df = pd.DataFrame.from_dict(sites, orient='index')
+    if df.empty:
+        return df
+
+    for col in ['latitude', 'longitude']:
+        df[col] = df['location'].apply(lambda x: float(x[col]))
+
+    df.rename(columns={
+                'code': 'service_id',
+                'name': 'display_name',
+
+                }, inplace=True)
+    return df
+
+
 def _chunks(l, n=100):
     """Yield successive n-sized chunks from l."""
     for i in range(0, len(l), n):
         yield l[i:i+n]
 
 
-def _nwis_catalog_entries(state, service):
-    return nwis.get_sites(state_code=state, service=service)
+def _nwis_catalog_entries(query, service):
+    try:
+        return nwis.get_sites(service=service, **query)
+    except requests.exceptions.HTTPError as e:
+        # the site service responds with 404 when no sites match the query
+        if e.response is not None and e.response.status_code == 404:
+            return {}
+        raise
+
+
+def _bbox_tiles(bbox, max_area=25):
+    """Split a bbox into tiles that are small enough for the NWIS site service bBox filter."""
+    tiles = []
+    poly = util.bbox2poly(*bbox, as_shapely=True)
+    size = max_area ** 0.5
+    for xmin, ymin, xmax, ymax in [p.bounds for p in getattr(poly, 'geoms', [poly])]:
+        ymin, ymax = max(ymin, -90), min(ymax, 90)
+        for x in _tile_starts(xmin, xmax, size):
+            for y in _tile_starts(ymin, ymax, size):
+                tiles.append('{:.7f},{:.7f},{:.7f},{:.7f}'.format(x, y, min(x + size, xmax), min(y + size, ymax)))
+
+    return tiles
+
+
+def _tile_starts(start, stop, size):
+    """Get the start of each tile along an axis, with a single tile when the range has no width (e.g. a point)."""
+    return np.arange(start, stop, size) if stop > start else [start]
 
 
 def _nwis_parameters(site, service):
@@ -253,7 +327,8 @@ def _stat_codes():
 
 def _site_info(sites, service):
     base_url = 'http://waterservices.usgs.gov/nwis/site/?format=rdb,1.0&sites=%s'
-    url = base_url % ','.join(sites) + '&seriesCatalogOutput=true&outputDataTypeCd=%s&hasDataTypeCd=%s' % (service, service)
+    url = base_url % ','.join(sites) \
+        + '&seriesCatalogOutput=true&outputDataTypeCd=%s&hasDataTypeCd=%s' % (service, service)
     return _parse_rdb(url)
 
 
@@ -0,0 +1,112 @@
+"""Benchmarks rebuilding the catalog cache of a service with a large synthetic catalog.
+
+Usage:
+    python benchmark_catalog_build.py [number of sites]
+
+The geometry step is timed both with the row-wise construction that quest used to do and
+with the vectorized construction in `ServiceBase.search_catalog_wrapper`, followed by the
+time for a full cache rebuild and for a keyword search of the rebuilt cache. The peak memory
+allocated to refresh the cache is measured with the catalog fetched in one and in many chunks.
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import box, Point
+
+import quest
+from quest.plugins import ProviderBase, ServiceBase
+
+N_SITES = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+CHUNK_SIZE = 50000
+
+
+def synthetic_catalog(n, start=0):
+    rng = np.random.RandomState(start)
+    ids = np.arange(start, start + n).astype(str)
+    return pd.DataFrame({
+        'display_name': np.char.add('Site ', ids),
+        'longitude': rng.uniform(-125, -65, n),
+        'latitude': rng.uniform(25, 50, n),
+        'state': rng.choice(['TX', 'LA', 'MS', 'AL'], n),
+    }, index=np.char.add('site', ids))
+
+
+class BenchmarkService(ServiceBase):
+    service_name = 'points'
+    display_name = 'Synthetic Points Service'
+    description = 'Synthetic catalog for benchmarking'
+    _parameter_map = {'00060': 'streamflow'}
+    chunksize = None
+
+    def search_catalog(self, **kwargs):
+        return synthetic_catalog(N_SITES)
+
+    def search_catalog_chunks(self, **kwargs):
+        chunksize = self.chunksize or N_SITES
+        for start in range(0, N_SITES, chunksize):
+            yield synthetic_catalog(min(chunksize, N_SITES - start), start)
+
+    def get_parameters(self, catalog_ids=None):
+        return pd.DataFrame({'service_id': catalog_ids.index, 'parameter': 'streamflow'})
+
+
+class BenchmarkProvider(ProviderBase):
+    service_list = [BenchmarkService]
+    display_name = 'Benchmark Provider'
+    description = 'Synthetic provider for benchmarking'
+    name = 'benchmark'
+
+
+def timeit(label, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    print('{:<40} {:>8.2f} s'.format(label, time.perf_counter() - start))
+    return result
+
+
+def peak_memory(label, fn, *args, **kwargs):
+    tracemalloc.start()
+    fn(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<40} {:>8.0f} MB'.format(label, peak / 1e6))
+
+
+def rowwise_geometry(catalog_entries, bounds):
+    catalog_entries.apply(lambda row: Point((float(row['longitude']), float(row['latitude']))), axis=1)
+    bounds.apply(lambda row: box(*[float(x) for x in row]))
+
+
+def vectorized_geometry(catalog_entries, bounds):
+    import shapely
+    shapely.points(catalog_entries['longitude'].values, catalog_entries['latitude'].values)
+    coords = np.array(bounds.tolist(), dtype=float)
+    shapely.box(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3])
+
+
+if __name__ == '__main__':
+    catalog_entries = synthetic_catalog(N_SITES)
+    bounds = pd.Series(list(zip(
+        catalog_entries['longitude'], catalog_entries['latitude'],
+        catalog_entries['longitude'] + 0.1, catalog_entries['latitude'] + 0.1,
+    )))
+    print('{} sites'.format(N_SITES))
+    timeit('geometry (row-wise)', rowwise_geometry, catalog_entries, bounds)
+    timeit('geometry (vectorized)', vectorized_geometry, catalog_entries, bounds)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        quest.api.update_settings({'CACHE_DIR': cache_dir})
+        service = BenchmarkProvider().services['points']
+        timeit('cache rebuild', service.search_catalog_wrapper, update_cache=True)
+        quest.util.catalog_cache.clear_memory_cache()
+        timeit('cache read', service.search_catalog_wrapper)
+        index = timeit('token index load', service.get_token_index)
+        timeit('keyword search', index.search, ['site 1234', 'tx'])
+
+        peak_memory('cache refresh peak (one chunk)', service.refresh_catalog)
+        service.chunksize = CHUNK_SIZE
+        peak_memory('cache refresh peak ({} per chunk)'.format(CHUNK_SIZE), service.refresh_catalog)
@@ -0,0 +1,66 @@
+"""Benchmarks serializing catalog search results to GeoJSON.
+
+Usage:
+    python benchmark_geojson.py [number of sites]
+
+Times the previous `search_catalog(as_geojson=True)` path (`GeoDataFrame.to_json` followed by
+`json.loads`) and `util.to_geojson` against `util.geojson_encoder.write_geojson`.
+"""
+import io
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from quest import util
+
+N_SITES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+
+def synthetic_catalog(n):
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(-125, -65, n), rng.uniform(25, 50, n)
+    uris = np.char.add('svc://usgs-nwis:iv/', np.arange(n).astype(str))
+    return gpd.GeoDataFrame({
+        'display_name': np.char.add('Site ', np.arange(n).astype(str)),
+        'description': '',
+        'service': 'svc://usgs-nwis:iv',
+        'service_id': np.arange(n).astype(str),
+        'parameters': pd.Categorical(rng.choice(['streamflow', 'streamflow,gage_height'], n)),
+        'metadata': [{'state': s} for s in rng.choice(['TX', 'LA', 'MS', 'AL'], n)],
+        'geometry': shapely.points(x, y),
+    }, index=uris)
+
+
+def timeit(label, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    print('{:<40} {:>8.2f} s'.format(label, time.perf_counter() - start))
+    return result
+
+
+def previous_to_geojson_frame(catalog_entries):
+    # the column layout that util.to_geojson expects
+    coords = shapely.get_coordinates(catalog_entries.geometry.values)
+    df = pd.DataFrame(catalog_entries.drop(['geometry', 'metadata'], axis=1))
+    df.insert(0, '_geom_type', 'Point')
+    df.insert(1, '_geom_coords', coords.tolist())
+    return df
+
+
+if __name__ == '__main__':
+    catalog_entries = synthetic_catalog(N_SITES)
+    print('{} sites'.format(N_SITES))
+    timeit('to_json + json.loads', lambda: json.loads(catalog_entries.to_json(default=util.to_json_default_handler)))
+    timeit('write_geojson (bytes)', util.geojson_encoder.write_geojson, catalog_entries)
+    timeit('write_geojson (compact, precision=5)', util.geojson_encoder.write_geojson, catalog_entries,
+           precision=5, compact=True)
+    timeit('write_geojson + json.loads', lambda: json.loads(util.geojson_encoder.write_geojson(catalog_entries)))
+    timeit('write_geojson (file object)', util.geojson_encoder.write_geojson, catalog_entries, io.BytesIO())
+
+    df = previous_to_geojson_frame(catalog_entries)
+    timeit('util.to_geojson', util.to_geojson, df)
@@ -7,6 +7,9 @@ from time import time
 
 import pytest
 import quest
+import pandas as pd
+from shapely.geometry import Point
+from quest.plugins import ProviderBase, ServiceBase
 
 from data import CACHED_SERVICES, DATASET
 
@@ -52,7 +55,7 @@ def get_or_generate_test_cache(update=False, skip=False):
             continue
         provider_plugin = provider_plugins[provider]
 
-        cache_file = os.path.join(quest.util.get_cache_dir(provider_plugin.name), service + '_catalog.p')
+        cache_file = provider_plugin.services[service].catalog_cache_file
         if update or not os.path.exists(cache_file):
             try:
                 print('Updating test cache for service: {0}'.format(name))
@@ -138,3 +141,117 @@ def dataset_save_path(api, reset_projects_dir):
     api.update_metadata(uris=DATASET, quest_metadata={'file_path': save_path})
 
     return save_path
+
+
+class SyntheticService(ServiceBase):
+    """Offline service with a generated catalog of 1000 point sites on a regular grid."""
+    service_name = 'points'
+    display_name = 'Synthetic Points Service'
+    description = 'Synthetic catalog used for testing'
+    native_filters = ['bbox']
+    _parameter_map = {'00060': 'streamflow', '00065': 'gage_height'}
+
+    def __init__(self, provider, **kwargs):
+        super(SyntheticService, self).__init__(provider, **kwargs)
+        self.search_catalog_calls = []
+        self.download_calls = []
+        self.catalog_updates = None
+        self.chunksize = None
+
+    def search_catalog(self, **kwargs):
+        self.search_catalog_calls.append(kwargs)
+        n = 1000
+        df = pd.DataFrame({
+            'display_name': ['Site {}'.format(i) for i in range(n)],
+            'longitude': [-100 + (i % 40) * 0.5 for i in range(n)],
+            'latitude': [25 + (i // 40) * 0.8 for i in range(n)],
+            'state': [['TX', 'LA', 'MS'][i % 3] for i in range(n)],
+            'elevation': [float(i) for i in range(n)],
+        }, index=['{:05d}'.format(i) for i in range(n)])
+
+        bbox = kwargs.get('bbox')
+        if bbox is not None:
+            df = df[(df.longitude >= bbox[0] - 1) & (df.longitude <= bbox[2] + 1)]
+
+        return df
+
+    def download(self, catalog_id, file_path, dataset, **kwargs):
+        self.download_calls.append((catalog_id, kwargs))
+        file_path = os.path.join(file_path, 'synthetic', self.service_name, dataset, '{}.csv'.format(dataset))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            f.write('site,value\n{},{}\n'.format(catalog_id, kwargs.get('parameter')))
+        # downloads can be made of several files
+        with open(os.path.join(os.path.dirname(file_path), 'site.txt'), 'w') as f:
+            f.write(catalog_id)
+
+        return {
+            'file_path': file_path,
+            'file_format': 'csv',
+            'datatype': 'timeseries',
+            'parameter': kwargs.get('parameter'),
+            'metadata': {'site': catalog_id},
+        }
+
+    def search_catalog_chunks(self, **kwargs):
+        if self.chunksize is None:
+            yield from super(SyntheticService, self).search_catalog_chunks(**kwargs)
+            return
+
+        df = self.search_catalog(**kwargs)
+        for start in range(0, len(df), self.chunksize):
+            # consecutive chunks share an entry
+            yield df.iloc[max(start - 1, 0):start + self.chunksize]
+        yield df.iloc[:0]
+
+    def get_catalog_updates(self, since, **kwargs):
+        if self.catalog_updates is None:
+            raise NotImplementedError()
+
+        return self.catalog_updates
+
+    def get_parameters(self, catalog_ids=None):
+        service_ids = catalog_ids.index.tolist()
+        params = [('streamflow' if int(i) % 2 == 0 else None) for i in service_ids] + ['gage_height'] * len(service_ids)
+        return pd.DataFrame({'service_id': service_ids * 2, 'parameter': params})
+
+
+class SyntheticPolygonService(ServiceBase):
+    """Offline service with a generated catalog of 100 detailed polygons."""
+    service_name = 'polygons'
+    display_name = 'Synthetic Polygons Service'
+    description = 'Synthetic catalog of polygons used for testing'
+    _parameter_map = {'00060': 'streamflow'}
+
+    def search_catalog(self, **kwargs):
+        n = 100
+        return pd.DataFrame({
+            'display_name': ['Basin {}'.format(i) for i in range(n)],
+            'geometry': [Point(-100 + (i % 10), 30 + (i // 10)).buffer(0.4, 256) for i in range(n)],
+        }, index=['{:03d}'.format(i) for i in range(n)])
+
+    def get_parameters(self, catalog_ids=None):
+        return pd.DataFrame({'service_id': catalog_ids.index.tolist(), 'parameter': 'streamflow'})
+
+
+class SyntheticProvider(ProviderBase):
+    service_list = [SyntheticService, SyntheticPolygonService]
+    display_name = 'Synthetic Provider'
+    description = 'Offline provider used for testing'
+    name = 'synthetic'
+
+
+@pytest.fixture
+def synthetic_provider(reset_settings, request):
+    cache_dir_obj = tempfile.TemporaryDirectory()
+    quest.api.update_settings({'CACHE_DIR': cache_dir_obj.name})
+    provider = SyntheticProvider()
+    quest.plugins.load_providers()[provider.name] = provider
+
+    def cleanup():
+        quest.plugins.load_providers().pop(provider.name, None)
+        quest.util.catalog_cache.clear_memory_cache(provider.name)
+        cache_dir_obj.cleanup()
+
+    request.addfinalizer(cleanup)
+    return provider
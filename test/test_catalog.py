@@ -1,6 +1,13 @@
+import os
+import time
+
 import pytest
+import quest
+import pandas as pd
+import shapely
+from quest import util
 
-from quest.static import GeomType
+from quest.static import GeomType, SearchStatus
 from data import SERVICES_CATALOG_COUNT, CACHED_SERVICES
 
 ACTIVE_PROJECT = 'project1'
@@ -100,3 +107,450 @@ def test_get_tags(api, service):
     for value in tags.values():
         assert isinstance(value, list)
 
+
+def test_search_catalog_native_filters(api, synthetic_provider):
+    service = synthetic_provider.services['points']
+    bbox = [-90, 30, -85, 35]
+
+    # without a cached catalog, native filters are passed on and the partial catalog is cached
+    catalog_entries = api.search_catalog('svc://synthetic:points', filters={'bbox': bbox, 'state': 'TX'})
+    assert service.search_catalog_calls == [{'bbox': bbox}]
+    assert len(catalog_entries) == 22
+    assert not os.path.exists(service.catalog_cache_file)
+
+    api.search_catalog('svc://synthetic:points', filters={'bbox': ','.join(str(x) for x in bbox)})
+    assert len(service.search_catalog_calls) == 1
+
+    # once the full catalog is cached it is used for all searches
+    assert len(api.search_catalog('svc://synthetic:points')) == 1000
+    assert service.search_catalog_calls[-1] == {}
+    assert os.path.exists(service.catalog_cache_file)
+    actual = api.search_catalog('svc://synthetic:points', filters={'bbox': bbox, 'state': 'TX'})
+    assert actual == catalog_entries
+    assert len(service.search_catalog_calls) == 2
+
+
+def test_search_catalog_metadata(api, synthetic_provider):
+    service = synthetic_provider.services['points']
+    catalog_entries = api.search_catalog('svc://synthetic:points', as_dataframe=True)
+    assert 'state' not in catalog_entries.columns
+    assert catalog_entries['metadata'].iloc[0] == {'state': 'TX', 'elevation': 0.0}
+
+    metadata = service.get_catalog_metadata(service_ids=['00001', '00002'], columns=['state'])
+    assert metadata.to_dict(orient='index') == {
+        'svc://synthetic:points/00001': {'state': 'LA'},
+        'svc://synthetic:points/00002': {'state': 'MS'},
+    }
+
+    catalog_entries = api.search_catalog('svc://synthetic:points', filters={'state': 'MS', 'elevation': 5.0})
+    assert catalog_entries == ['svc://synthetic:points/00005']
+    assert api.search_catalog('svc://synthetic:points', filters={'missing': 'MS'}) == []
+    assert len(api.search_catalog('svc://synthetic:points', filters={'search_terms': ['LA']})) == 333
+
+    tags = api.get_tags('svc://synthetic:points')
+    assert sorted(tags['state']) == ['LA', 'MS', 'TX']
+
+
+def test_search_catalog_search_terms_in_unindexed_text(api, synthetic_provider):
+    # the service uri, the name and the metadata field names are not in the token index
+    assert len(api.search_catalog('svc://synthetic:points', filters={'search_terms': ['synthetic']})) == 1000
+    assert api.search_catalog('svc://synthetic:points', filters={'search_terms': ['points/00005']}) == \
+        ['svc://synthetic:points/00005']
+    assert len(api.search_catalog('svc://synthetic:points', filters={'search_terms': ['elevation']})) == 1000
+    assert api.search_catalog('svc://synthetic:points', filters={'search_terms': ['not_a_term']}) == []
+
+
+def test_search_catalog_parameter(api, synthetic_provider):
+    catalog_entries = api.search_catalog('svc://synthetic:points', as_dataframe=True)
+    assert catalog_entries.loc['svc://synthetic:points/00000', 'parameters'] == 'streamflow,gage_height'
+    assert catalog_entries.loc['svc://synthetic:points/00001', 'parameters'] == 'gage_height'
+
+    assert len(api.search_catalog('svc://synthetic:points', filters={'parameter': 'streamflow'})) == 500
+    assert len(api.search_catalog('svc://synthetic:points', filters={'parameter': 'gage_height'})) == 1000
+    # parameters are matched exactly
+    assert api.search_catalog('svc://synthetic:points', filters={'parameter': 'stream'}) == []
+
+
+def test_search_catalog_refresh(api, synthetic_provider):
+    service = synthetic_provider.services['points']
+    api.search_catalog('svc://synthetic:points')
+    cache_file = service.catalog_cache_file
+
+    # catalogs are not refreshed unless the provider opts in
+    os.utime(cache_file, (time.time() - 40 * 86400,) * 2)
+    assert service.update_frequency is None
+    assert not quest.util.catalog_cache.is_stale(cache_file, service.update_frequency)
+    synthetic_provider.update_frequency = 'M'
+
+    # stale catalogs are refreshed in the background, merging only the updated entries
+    service.catalog_updates = pd.DataFrame({
+        'display_name': ['Updated', 'New'],
+        'longitude': [0.0, 1.0],
+        'latitude': [0.0, 1.0],
+        'state': ['TX', 'TX'],
+        'elevation': [-1.0, -2.0],
+    }, index=['00000', '01000'])
+    os.utime(cache_file, (time.time() - 40 * 86400,) * 2)
+    assert quest.util.catalog_cache.is_stale(cache_file, service.update_frequency)
+    api.search_catalog('svc://synthetic:points')
+    quest.util.catalog_cache.wait_for_refreshes()
+
+    assert not quest.util.catalog_cache.is_stale(cache_file, service.update_frequency)
+    assert len(service.search_catalog_calls) == 1
+    catalog_entries = api.search_catalog('svc://synthetic:points', as_dataframe=True)
+    assert len(catalog_entries) == 1001
+    assert catalog_entries.loc['svc://synthetic:points/00000', 'display_name'] == 'Updated'
+    assert catalog_entries.loc['svc://synthetic:points/01000', 'metadata'] == {'state': 'TX', 'elevation': -2.0}
+    assert catalog_entries.loc['svc://synthetic:points/01000', 'parameters'] == 'streamflow,gage_height'
+
+    # services without incremental updates fetch the whole catalog again
+    service.catalog_updates = None
+    os.utime(cache_file, (time.time() - 40 * 86400,) * 2)
+    api.search_catalog('svc://synthetic:points')
+    quest.util.catalog_cache.wait_for_refreshes()
+    assert len(service.search_catalog_calls) == 2
+    assert len(api.search_catalog('svc://synthetic:points')) == 1000
+
+
+@pytest.mark.parametrize('chunks', [[], [pd.DataFrame(), pd.DataFrame()]])
+def test_search_catalog_empty(api, synthetic_provider, monkeypatch, chunks):
+    service = synthetic_provider.services['points']
+    monkeypatch.setattr(service, 'search_catalog_chunks', lambda **kwargs: iter(chunks))
+
+    assert api.search_catalog('svc://synthetic:points') == []
+    assert os.path.exists(quest.util.catalog_cache.metadata_cache_file(service.catalog_cache_file))
+    assert os.path.exists(quest.util.text_index.token_index_file(service.catalog_cache_file))
+    assert os.path.exists(quest.util.tag_index.tag_index_file(service.catalog_cache_file))
+
+    # the empty catalog is read from the cache
+    monkeypatch.setattr(service, 'search_catalog_chunks', lambda **kwargs: pytest.fail('catalog was fetched again'))
+    assert api.search_catalog('svc://synthetic:points', filters={'bbox': [0, 0, 1, 1], 'search_terms': ['a']}) == []
+    assert api.get_tags('svc://synthetic:points') == {}
+
+
+def test_refresh_partial_catalog(api, synthetic_provider):
+    service = synthetic_provider.services['points']
+    bbox = '-95,30,-90,35'
+    partial_cache_file, _ = service._get_catalog_cache_file(bbox=bbox)
+    api.search_catalog('svc://synthetic:points', filters={'bbox': bbox})
+    api.search_catalog('svc://synthetic:points')
+    assert os.path.exists(partial_cache_file) and os.path.exists(service.catalog_cache_file)
+
+    # the stale partial cache is refreshed, not the full cache that now exists
+    os.utime(partial_cache_file, (time.time() - 40 * 86400,) * 2)
+    full_mtime = os.path.getmtime(service.catalog_cache_file)
+    service.refresh_catalog(cache_file=partial_cache_file, bbox=bbox)
+    assert os.path.getmtime(partial_cache_file) > time.time() - 3600
+    assert os.path.getmtime(service.catalog_cache_file) == full_mtime
+    assert service.search_catalog_calls[-1]['bbox'] == [-95.0, 30.0, -90.0, 35.0]
+
+
+def test_search_catalog_status(api, synthetic_provider, monkeypatch):
+    c = api.new_catalog_entry(geom_type=GeomType.POINT, geom_coords=[-94.2, 23.4])
+    service = synthetic_provider.services['points']
+    uris = ['svc://quest:quest', 'svc://synthetic:points']
+
+    def fail(**kwargs):
+        raise ValueError('service unavailable')
+
+    monkeypatch.setattr(service, 'search_catalog', fail)
+    with pytest.raises(ValueError):
+        api.search_catalog(uris)
+
+    catalog_entries, status = api.search_catalog(uris, raise_on_error=False, return_status=True)
+    assert catalog_entries == [c]
+    assert status['svc://quest:quest']['status'] == SearchStatus.SUCCESS
+    assert status['svc://synthetic:points'] == {'status': SearchStatus.FAILED,
+                                                 'message': 'ValueError: service unavailable'}
+
+    def slow(**kwargs):
+        time.sleep(1)
+        raise ValueError('service unavailable')
+
+    monkeypatch.setattr(service, 'search_catalog', slow)
+    catalog_entries, status = api.search_catalog(uris, timeout=0.2, raise_on_error=False, return_status=True)
+    assert catalog_entries == [c]
+    assert status['svc://synthetic:points']['status'] == SearchStatus.TIMEOUT
+
+
+def test_search_catalog_filter_plan(api, synthetic_provider):
+    filters = {
+        'search_terms': ['Site 1', 'MS'],
+        'display_name': '0$',
+        'parameter': 'streamflow',
+        'bbox': [-100, 25, -95, 30],
+    }
+    queries = ['service_id < "00300"']
+    catalog_entries = api.search_catalog('svc://synthetic:points', filters=filters, queries=queries)
+
+    all_entries = api.search_catalog('svc://synthetic:points', as_dataframe=True)
+    idx = all_entries.intersects(util.bbox2poly(*filters['bbox'], as_shapely=True)) \
+        & all_entries.parameters.str.split(',').map(lambda x: 'streamflow' in x) \
+        & all_entries.display_name.str.contains('0$') \
+        & (all_entries.display_name.str.contains('Site 1') | all_entries.metadata.map(lambda x: x['state'] == 'MS')) \
+        & (all_entries.service_id < '00300')
+    expected = all_entries.index[idx].tolist()
+    assert 0 < len(expected) < 20
+    assert catalog_entries == expected
+
+
+def test_search_catalog_description(api, synthetic_provider):
+    catalog_entries = api.search_catalog('svc://synthetic:points', filters={'description': 'Site 1'})
+    assert catalog_entries == []
+
+
+def test_search_keywords(api, synthetic_provider):
+    cache_file = synthetic_provider.services['points'].catalog_cache_file
+    catalog_entries = api.search_keywords('site 12', uris='svc://synthetic:points')
+    assert os.path.exists(quest.util.text_index.token_index_file(cache_file))
+    # '12' also matches words that start with it
+    assert catalog_entries[0] == 'svc://synthetic:points/00012'
+    assert sorted(catalog_entries) == ['svc://synthetic:points/{:05d}'.format(i)
+                                       for i in range(1000) if str(i).startswith('12')]
+
+    catalog_entries = api.search_keywords('12', uris='svc://synthetic:points', prefix=False)
+    assert catalog_entries == ['svc://synthetic:points/00012']
+
+    catalog_entries = api.search_keywords(['12', 'ms'], uris='svc://synthetic:points', limit=3,
+                                          as_dataframe=True)
+    assert catalog_entries.index.tolist() == ['svc://synthetic:points/00122', 'svc://synthetic:points/00125',
+                                              'svc://synthetic:points/00128']
+    assert (catalog_entries['score'] > 0).all()
+
+    filters = {'keywords': ['12', 'ms'], 'parameter': 'streamflow'}
+    catalog_entries = api.search_catalog('svc://synthetic:points', filters=filters)
+    assert catalog_entries == ['svc://synthetic:points/00122', 'svc://synthetic:points/00128']
+
+
+def test_search_catalog_pages(api, synthetic_provider):
+    uri = 'svc://synthetic:points'
+    filters = {'search_terms': ['LA']}
+    expected = api.search_catalog(uri, filters=filters)
+    assert len(expected) == 333
+
+    assert api.search_catalog(uri, filters=filters, limit=10) == expected[:10]
+    assert api.search_catalog(uri, filters=filters, limit=10, offset=330) == expected[330:]
+    assert api.search_catalog(uri, filters=filters, limit=10, cursor=expected[9]) == expected[10:20]
+    # an entry that is not in the results
+    assert api.search_catalog(uri, filters=filters, limit=2, cursor=uri + '/00002') == expected[1:3]
+
+    pages, cursor = [], None
+    while True:
+        page = api.search_catalog(uri, filters=filters, limit=100, cursor=cursor)
+        if not page:
+            break
+        pages.extend(page)
+        cursor = page[-1]
+    assert pages == expected
+
+    actual = api.search_catalog(uri, filters=filters, limit=5, as_geojson=True)
+    assert [f['id'] for f in actual['features']] == expected[:5]
+
+    actual = api.search_keywords('site', uris=uri, filters=filters, limit=5, offset=5)
+    assert actual == expected[5:10]
+
+
+def test_search_catalog_stream(api, synthetic_provider):
+    uri = 'svc://synthetic:points'
+    filters = {'search_terms': ['LA']}
+    expected = api.search_catalog(uri, filters=filters)
+
+    stream = api.search_catalog(uri, filters=filters, stream=True)
+    assert not isinstance(stream, list)
+    assert list(stream) == expected
+
+    chunks = list(api.search_catalog(uri, filters=filters, stream=True, chunksize=100, as_dataframe=True))
+    assert [len(chunk) for chunk in chunks] == [100, 100, 100, 33]
+    assert pd.concat(chunks).index.tolist() == expected
+    assert chunks[0]['metadata'].iloc[0]['state'] == 'LA'
+
+    features = api.search_catalog(uri, filters=filters, stream=True, chunksize=100, as_geojson=True, limit=150)
+    features = list(features)
+    assert [f['id'] for f in features] == expected[:150]
+    assert features[0]['type'] == 'Feature'
+
+
+def test_get_tag_index(api, synthetic_provider):
+    service = synthetic_provider.services['points']
+    tags = api.get_tags('svc://synthetic:points')
+    cache_file = service.catalog_cache_file
+    assert os.path.exists(quest.util.tag_index.tag_index_file(cache_file))
+    assert tags['state'] == ['TX', 'LA', 'MS']
+    assert api.get_tags('svc://synthetic:points', as_count=True)['elevation'] == 1000
+
+    index = synthetic_provider.get_tag_index('points')
+    assert index[index.tag == 'state'][['value', 'count']].values.tolist() == [['"TX"', 334], ['"LA"', 333],
+                                                                               ['"MS"', 333]]
+
+    # refreshing the catalog updates the counts
+    service.catalog_updates = pd.DataFrame({
+        'display_name': ['Updated', 'New'],
+        'longitude': [0.0, 1.0],
+        'latitude': [0.0, 1.0],
+        'state': ['LA', 'TX'],
+        'elevation': [-1.0, -2.0],
+    }, index=['00000', '01000'])
+    service.refresh_catalog()
+
+    index = synthetic_provider.get_tag_index('points')
+    assert index[index.tag == 'state'][['value', 'count']].values.tolist() == [['"LA"', 334], ['"TX"', 334],
+                                                                               ['"MS"', 333]]
+    expected = quest.util.tag_index.build_tag_index(quest.util.catalog_cache.read_metadata(cache_file))
+    pd.testing.assert_frame_equal(index, expected)
+
+
+def test_search_catalog_facets(api, synthetic_provider):
+    uri = 'svc://synthetic:points'
+    filters = {'bbox': [-100, 25, -95, 30]}
+    expected = api.search_catalog(uri, filters=filters, as_dataframe=True)
+
+    catalog_entries, facets = api.search_catalog(uri, filters=filters, limit=5,
+                                                 facets=['parameter', 'geom_type', 'state', 'service'])
+    assert catalog_entries == expected.index.tolist()[:5]
+    assert list(facets) == ['parameter', 'geom_type', 'state', 'service']
+    assert facets['parameter'] == {
+        'gage_height': len(expected),
+        'streamflow': expected.parameters.str.contains('streamflow').sum(),
+    }
+    assert facets['geom_type'] == {'Point': len(expected)}
+    states = expected.metadata.map(lambda x: x['state']).value_counts()
+    assert facets['state'] == states.to_dict()
+    assert list(facets['state'].values()) == sorted(states.values, reverse=True)
+    assert facets['service'] == {uri: len(expected)}
+
+    # drilling down on a facet value
+    filters['state'] = 'MS'
+    catalog_entries, facets, status = api.search_catalog(uri, filters=filters, facets='state', return_status=True)
+    assert facets == {'state': {'MS': states['MS']}}
+    assert len(catalog_entries) == states['MS']
+    assert status[uri]['status'] == SearchStatus.SUCCESS
+
+    _, facets = api.search_catalog(uri, filters={'state': 'none'}, facets=['state', 'parameter'])
+    assert facets == {'state': {}, 'parameter': {}}
+
+
+def test_search_catalog_global_index(api, synthetic_provider):
+    uri = 'svc://synthetic:points'
+    service = synthetic_provider.services['points']
+    filters = {'bbox': [-100, 25, -95, 30], 'parameter': 'streamflow', 'state': 'LA'}
+    # only whole catalogs are indexed
+    api.search_catalog(uri)
+    expected = api.search_catalog(uri, filters=filters)
+    assert expected
+
+    assert api.search_catalog(uri, filters=filters, use_global_index=True) == expected
+    index_file = quest.util.global_index.global_index_file()
+    assert os.path.exists(index_file)
+    # all cached catalogs are searched when no uris are given
+    assert api.search_catalog(filters=filters, use_global_index=True) == expected
+    assert api.search_catalog(uri, filters={'bbox': [0, 0, 1, 1]}, use_global_index=True) == []
+
+    actual = api.search_catalog(uri, filters=filters, use_global_index=True, as_dataframe=True)
+    assert actual.equals(api.search_catalog(uri, filters=filters, as_dataframe=True))
+
+    # the index picks up refreshed catalogs
+    service.catalog_updates = pd.DataFrame({
+        'display_name': ['New'], 'longitude': [-99.0], 'latitude': [26.0], 'state': ['LA'], 'elevation': [0.0],
+    }, index=['01000'])
+    service.refresh_catalog()
+    assert api.search_catalog(uri, filters=filters, use_global_index=True) == expected + [uri + '/01000']
+    assert len(service.search_catalog_calls) == 1
+
+
+def test_merge_catalog_entries():
+    from quest.api.catalog import _merge_catalog_entries
+
+    a = pd.DataFrame({'source': 'a'}, index=['svc://p:s1/3', 'svc://p:s1/1', 'svc://p:s1/2'])
+    b = pd.DataFrame({'source': 'b'}, index=['svc://p:s2/1', 'svc://p:s2/2'])
+    c = pd.DataFrame({'source': 'c'}, index=['svc://p:s1/2', 'svc://p:s2/0', 'svc://p:s2/2'])
+
+    assert _merge_catalog_entries([]).empty
+    assert _merge_catalog_entries([a.iloc[:0]]).empty
+
+    single = b.sort_index()
+    assert _merge_catalog_entries([single]).index.tolist() == single.index.tolist()
+
+    actual = _merge_catalog_entries([b, a])
+    assert actual.index.tolist() == sorted(a.index.tolist() + b.index.tolist())
+
+    # overlapping sources keep the entry of the first source
+    actual = _merge_catalog_entries([a, b, c])
+    expected = pd.concat([a, b, c])
+    expected = expected[~expected.index.duplicated()].sort_index()
+    assert actual.index.tolist() == expected.index.tolist()
+    assert actual['source'].tolist() == expected['source'].tolist()
+
+
+def test_get_catalog_entries(api, synthetic_provider):
+    uri = 'svc://synthetic:points'
+    service = synthetic_provider.services['points']
+    api.search_catalog(uri)
+    quest.util.catalog_cache.clear_memory_cache()
+    calls = len(service.search_catalog_calls)
+
+    uris = [uri + '/00999', uri + '/00003', uri + '/missing', uri + '/00003']
+    assert api.get_catalog_entries(uris) == [uri + '/00999', uri + '/00003']
+    # only the requested entries are read from the cache
+    assert quest.util.catalog_cache.memory_cache_info()['size'] == 0
+
+    actual = api.get_catalog_entries(uris, as_dataframe=True)
+    assert actual['display_name'].tolist() == ['Site 999', 'Site 3']
+    assert actual['metadata'][uri + '/00003']['state'] == 'TX'
+    assert api.get_metadata(uris[:2])[uri + '/00999']['display_name'] == 'Site 999'
+    assert len(service.search_catalog_calls) == calls
+
+
+def test_search_catalog_chunks(api, synthetic_provider):
+    uri = 'svc://synthetic:points'
+    service = synthetic_provider.services['points']
+    expected = api.search_catalog(uri, as_dataframe=True)
+    expected_tags = api.get_tags(uri)
+
+    service.chunksize = 300
+    service.refresh_catalog()
+    quest.util.catalog_cache.clear_memory_cache()
+    actual = api.search_catalog(uri, as_dataframe=True)
+
+    assert actual.index.tolist() == expected.index.tolist()
+    assert actual.drop(columns='geometry').equals(expected.drop(columns='geometry'))
+    assert actual.geometry.geom_equals(expected.geometry).all()
+    assert api.get_tags(uri) == expected_tags
+    assert api.search_keywords('site 12', uri, limit=1) == [uri + '/00012']
+    assert len(api.search_catalog(uri, filters={'bbox': [-100, 25, -99, 26]})) == 6
+
+
+def test_search_catalog_tolerance(api, synthetic_provider):
+    uri = 'svc://synthetic:polygons'
+    exact = api.search_catalog(uri, as_dataframe=True)
+    n_coords = shapely.get_num_coordinates(exact.geometry.values)
+    assert (n_coords > 1000).all()
+
+    for tolerance in [0.01, 0.05]:
+        # the coarsest stored geometries within the tolerance are used
+        actual = api.search_catalog(uri, as_dataframe=True, tolerance=tolerance)
+        assert actual.index.tolist() == exact.index.tolist()
+        assert (shapely.get_num_coordinates(actual.geometry.values) < n_coords / 10).all()
+        assert (shapely.hausdorff_distance(actual.geometry.values, exact.geometry.values) <= tolerance).all()
+
+    # tolerances finer than all stored geometries return the exact geometries
+    actual = api.search_catalog(uri, as_dataframe=True, tolerance=0.0001)
+    assert actual.geometry.geom_equals_exact(exact.geometry, 0).all()
+
+    bbox = [-100, 30, -99.55, 30.5]
+    assert api.search_catalog(uri, filters={'bbox': bbox}, tolerance=0.01) == [uri + '/000']
+    features = api.search_catalog(uri, filters={'bbox': bbox}, as_geojson=True, tolerance=0.01)['features']
+    assert len(features[0]['geometry']['coordinates'][0]) < 100
+
+    # after the catalog is in memory and when entries are looked up by id
+    quest.util.catalog_cache.clear_memory_cache()
+    assert api.search_catalog(uri, filters={'bbox': bbox}, tolerance=0.01) == [uri + '/000']
+    api.search_catalog(uri)
+    actual = api.search_catalog(uri, as_dataframe=True, tolerance=0.01)
+    assert (shapely.get_num_coordinates(actual.geometry.values) < n_coords / 10).all()
+    actual = synthetic_provider.get_catalog_entries('polygons', ['005'], tolerance=0.01)
+    assert shapely.get_num_coordinates(actual.geometry.values)[0] < n_coords[5] / 10
+
+    # catalogs of points have no simplified geometries
+    cache_file = synthetic_provider.services['points'].catalog_cache_file
+    api.search_catalog('svc://synthetic:points', tolerance=0.01)
+    assert quest.util.catalog_cache.get_geometry_tiers(cache_file) == {}
@@ -0,0 +1,140 @@
+"""Tests for functions in database.py"""
+import multiprocessing
+import os
+import shutil
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pytest
+
+from quest.api.workflows import _get_cached_data, _get_cached_derived_data
+from quest.database import database, db_session
+from quest.static import DatasetStatus
+
+from data import CATALOG_ENTRY, DATASET
+
+ACTIVE_PROJECT = 'test_data'
+FILES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'files')
+
+pytestmark = pytest.mark.usefixtures('reset_projects_dir', 'set_active_project')
+
+DOWNLOAD_OPTIONS = {'end': '2018-09-15 12:00:00', 'parameter': 'streamflow', 'start': '2018-08-15 12:00:00'}
+
+
+def test_hash_options():
+    assert database.hash_options(None) is None
+    assert database.hash_options({'a': 1, 'b': [1, 2]}) == database.hash_options({'b': [1, 2], 'a': 1})
+    assert database.hash_options({'a': 1}) != database.hash_options({'a': '1'})
+    assert database.hash_options({}) != database.hash_options(None)
+
+
+def test_migrate_db(tmpdir):
+    dbpath = str(tmpdir.join('metadata.db'))
+    shutil.copy(os.path.join(FILES_DIR, 'projects_template', 'test_data', 'metadata.db'), dbpath)
+
+    with sqlite3.connect(dbpath) as connection:
+        assert connection.execute('PRAGMA user_version').fetchone()[0] == 0
+
+    assert database.migrate_db(dbpath) == database.SCHEMA_VERSION
+    db = database.init_db(dbpath)
+    db.disconnect()
+
+    with sqlite3.connect(dbpath) as connection:
+        assert connection.execute('PRAGMA user_version').fetchone()[0] == database.SCHEMA_VERSION
+        options_key = connection.execute('SELECT options_key FROM Dataset WHERE name = ?', (DATASET,)).fetchone()[0]
+        assert options_key == database.hash_options(DOWNLOAD_OPTIONS)
+
+        indexes = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        assert 'idx_dataset__catalog_entry_status_options_key' in indexes
+        assert 'idx_dataset__options_key' in indexes
+
+        plan = connection.execute(
+            'EXPLAIN QUERY PLAN SELECT name FROM Dataset WHERE catalog_entry IN (?) AND status = ? AND options_key = ?',
+            (CATALOG_ENTRY, DatasetStatus.DOWNLOADED, options_key)
+        ).fetchall()
+        assert 'idx_dataset__catalog_entry_status_options_key' in str(plan)
+
+    # migrating again is a no-op
+    assert database.migrate_db(dbpath) == database.SCHEMA_VERSION
+
+
+def test_query_datasets_parses_datetimes():
+    created_at = database.query_datasets({'name': DATASET}, columns=['created_at'])[0]['created_at']
+    assert isinstance(created_at, datetime)
+    assert database._sql_to_datetime('2018-08-15 12:00:00') == datetime(2018, 8, 15, 12)
+    assert database._sql_to_datetime('2018-08-15 12:00:00.000250') == datetime(2018, 8, 15, 12, 0, 0, 250)
+
+
+def test_options_key_is_updated(api):
+    options = {'parameter': 'gage_height'}
+    api.update_metadata(DATASET, quest_metadata={'options': options})
+    assert _get_cached_data([CATALOG_ENTRY], DOWNLOAD_OPTIONS) == {}
+    assert _get_cached_data([CATALOG_ENTRY], options) == {CATALOG_ENTRY: DATASET}
+    assert 'options_key' not in api.get_metadata(DATASET)[DATASET]
+
+
+def test_get_cached_data(api):
+    assert _get_cached_data([CATALOG_ENTRY], DOWNLOAD_OPTIONS) == {CATALOG_ENTRY: DATASET}
+    assert _get_cached_data([CATALOG_ENTRY], DOWNLOAD_OPTIONS, collection='col1') == {CATALOG_ENTRY: DATASET}
+    assert _get_cached_data([CATALOG_ENTRY], DOWNLOAD_OPTIONS, collection='col2') == {}
+    assert _get_cached_data([CATALOG_ENTRY], dict(DOWNLOAD_OPTIONS, parameter='gage_height')) == {}
+    assert _get_cached_data([CATALOG_ENTRY], None) == {}
+
+    assert _get_cached_derived_data('not_a_tool', {}) is None
+
+
+def _update_status(dbpath, names, rounds):
+    """Worker for `test_concurrent_status_updates` that repeatedly updates and reads the status of datasets.
+    """
+    database.get_db(dbpath, reconnect=True)
+    errors = {}
+    for i in range(rounds):
+        errors.update(database.update_datasets({name: {'status': 'round-{}'.format(i)} for name in names}))
+        database.query_datasets({'name': names}, columns=['status'])
+
+    return errors
+
+
+def test_configure_connection(api, tmpdir):
+    dbpath = str(tmpdir.join('metadata.db'))
+    db = database.init_db(dbpath)
+    db.disconnect()
+
+    with sqlite3.connect(dbpath) as connection:
+        assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+        api.update_settings({'DB_BUSY_TIMEOUT': 1234, 'DB_SYNCHRONOUS': 'full'})
+        try:
+            database.configure_connection(connection)
+            assert connection.execute('PRAGMA busy_timeout').fetchone()[0] == 1234
+            assert connection.execute('PRAGMA synchronous').fetchone()[0] == 2
+
+            api.update_settings({'DB_JOURNAL_MODE': 'not_a_mode'})
+            with pytest.raises(ValueError):
+                database.configure_connection(connection)
+        finally:
+            for key in database.DB_SETTINGS:
+                api.get_settings().pop(key, None)
+
+
+def test_concurrent_status_updates(tmpdir):
+    n_workers, rounds = 4, 20
+    dbpath = str(tmpdir.join('metadata.db'))
+    db = database.init_db(dbpath)
+    names = ['d{:031d}'.format(i) for i in range(n_workers * 25)]
+    with db_session:
+        collection = db.Collection(name='col1')
+        for name in names:
+            db.Dataset(name=name, collection=collection, catalog_entry=CATALOG_ENTRY)
+    db.disconnect()
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(n_workers, mp_context=context) as executor:
+        batches = [names[i::n_workers] for i in range(n_workers)]
+        errors = list(executor.map(_update_status, [dbpath] * n_workers, batches, [rounds] * n_workers))
+
+    assert errors == [{}] * n_workers
+    with sqlite3.connect(dbpath) as connection:
+        statuses = connection.execute('SELECT DISTINCT status FROM Dataset').fetchall()
+    assert statuses == [('round-{}'.format(rounds - 1),)]
@@ -1,3 +1,4 @@
+import os
 import pytest
 from types import ModuleType
 
@@ -5,6 +6,8 @@ from pandas import DataFrame
 
 from data import DOWNLOAD_OPTIONS_FROM_ALL_SERVICES, SERVICE, CATALOG_ENTRY, DATASET, DATASET_METADATA
 
+from quest import util
+from quest.database import insert_datasets, update_datasets
 from quest.static import DatasetStatus
 
 ACTIVE_PROJECT = 'test_data'
@@ -76,6 +79,35 @@ def test_get_datasets_with_query(api):
     assert len(datasets) == expected
 
 
+def test_get_datasets_with_filters(api, synthetic_provider):
+    catalog_entries = api.search_catalog('svc://synthetic:points')[:10]
+    datasets = api.add_datasets('col1', catalog_entries)
+    try:
+        api.stage_for_download(datasets[:4], options={'parameter': 'streamflow'})
+
+        actual = api.get_datasets(filters={'collection': 'col1', 'status': DatasetStatus.STAGED})
+        assert sorted(actual) == sorted(datasets[:4])
+
+        actual = api.get_datasets(filters={'catalog_entry': catalog_entries[5:7]})
+        assert sorted(actual) == sorted(datasets[5:7])
+
+        # filters on fields that aren't filtered by the database are combined with those that are
+        actual = api.get_datasets(filters={'status': DatasetStatus.STAGED, 'parameter': 'streamflow'})
+        assert sorted(actual) == sorted(datasets[:4])
+
+        actual = api.get_datasets(expand=True, filters={'name': datasets[8:]}, columns=['display_name'])
+        assert actual == {d: {'display_name': d} for d in datasets[8:]}
+
+        actual = api.get_datasets(as_dataframe=True, filters={'status': DatasetStatus.STAGED},
+                                  queries=['display_name.str.contains("streamflow")'], columns=['status'])
+        assert list(actual.columns) == ['status']
+        assert sorted(actual.index) == sorted(datasets[:4])
+
+        assert api.get_datasets(filters={'status': 'not_a_status'}) == []
+    finally:
+        api.delete(datasets)
+
+
 def test_new_dataset(api):
     new_dataset = api.new_dataset(CATALOG_ENTRY, 'col1')
     datasets = api.get_datasets()
@@ -128,6 +160,141 @@ def test_stage_for_download(api):
         api.delete(new_datasets)
 
 
+def test_add_datasets(api, synthetic_provider):
+    catalog_entries = api.search_catalog('svc://synthetic:points')[:20]
+    datasets = api.add_datasets('col1', catalog_entries)
+    try:
+        assert len(datasets) == 20
+        metadata = api.get_metadata(datasets)
+        assert sorted(m['catalog_entry'] for m in metadata.values()) == sorted(catalog_entries)
+        assert all(m['status'] == DatasetStatus.NOT_STAGED for m in metadata.values())
+
+        options = [{'parameter': 'streamflow'}] * 10 + [{'parameter': 'gage_height'}] * 10
+        api.stage_for_download(datasets, options=options)
+        metadata = api.get_metadata(datasets)
+        for dataset, option in zip(datasets, options):
+            assert metadata[dataset]['status'] == DatasetStatus.STAGED
+            assert metadata[dataset]['options'] == option
+            assert metadata[dataset]['display_name'] == 'synthetic-{}-{}'.format(option['parameter'], dataset[:7])
+
+        with pytest.raises(ValueError):
+            api.stage_for_download(datasets + [util.uuid('dataset')])
+    finally:
+        api.delete(datasets)
+
+    with pytest.raises(ValueError):
+        api.add_datasets('not_a_collection', catalog_entries)
+
+
+def test_insert_and_update_datasets(api):
+    names = [util.uuid('dataset') for _ in range(3)]
+    records = [{'name': name, 'collection': 'col1', 'catalog_entry': CATALOG_ENTRY} for name in names]
+    records.append({'name': DATASET, 'collection': 'col1', 'catalog_entry': CATALOG_ENTRY})
+    records.append({'name': util.uuid('dataset'), 'collection': 'not_a_collection', 'catalog_entry': CATALOG_ENTRY})
+    records.append({'name': util.uuid('dataset'), 'collection': 'col1', 'catalog_entry': CATALOG_ENTRY,
+                    'not_an_attribute': 1})
+
+    errors = insert_datasets(records)
+    try:
+        # the rows that failed are reported and the rest are still inserted
+        assert set(errors) == {r['name'] for r in records[3:]}
+        assert set(names) <= set(api.get_datasets())
+        assert not set(errors) - {DATASET} & set(api.get_datasets())
+
+        updates = {name: {'status': DatasetStatus.STAGED} for name in names}
+        updates[names[0]]['not_an_attribute'] = 1
+        missing = util.uuid('dataset')
+        updates[missing] = {'status': DatasetStatus.STAGED}
+        errors = update_datasets(updates)
+        assert set(errors) == {names[0], missing}
+
+        metadata = api.get_metadata(names)
+        assert metadata[names[0]]['status'] != DatasetStatus.STAGED
+        assert all(metadata[name]['status'] == DatasetStatus.STAGED for name in names[1:])
+    finally:
+        api.delete(names)
+
+
+def test_download_datasets_with_cache(api, synthetic_provider):
+    service = synthetic_provider.services['points']
+    catalog_entries = api.search_catalog('svc://synthetic:points')[:2]
+    options = {'parameter': 'streamflow'}
+
+    datasets = api.add_datasets('col1', catalog_entries)
+    status = api.download_datasets(datasets, options=options, use_cache=True)
+    assert set(status.values()) == {DatasetStatus.DOWNLOADED}
+    assert len(service.download_calls) == 2
+    metadata = api.get_metadata(datasets)
+
+    # the whole folder of the download is stored
+    stored_folder = os.path.dirname(metadata[datasets[0]]['file_path'])
+    assert stored_folder.startswith(util.download_cache.download_cache_dir())
+    assert os.path.exists(os.path.join(stored_folder, 'site.txt'))
+
+    # the same data is used from the download cache in another project
+    api.set_active_project('project1')
+    try:
+        api.new_collection('col1', exists_ok=True)
+        other_datasets = api.add_datasets('col1', catalog_entries[:1])
+        api.download_datasets(other_datasets, options=options, use_cache=True)
+        assert len(service.download_calls) == 2
+
+        other_metadata = api.get_metadata(other_datasets[0])[other_datasets[0]]
+        assert other_metadata['status'] == DatasetStatus.DOWNLOADED
+        assert other_metadata['file_path'] == metadata[datasets[0]]['file_path']
+        assert other_metadata['metadata'] == {'site': catalog_entries[0].split('/')[-1]}
+
+        # other options are downloaded
+        api.download_datasets(other_datasets, options={'parameter': 'gage_height'}, use_cache=True)
+        assert len(service.download_calls) == 3
+        api.delete(other_datasets)
+    finally:
+        api.set_active_project(ACTIVE_PROJECT)
+
+    entries = {e['catalog_entry']: e for e in util.download_cache.get_download_cache_entries()}
+    assert entries[catalog_entries[0]]['refcount'] == 1
+    assert entries[catalog_entries[1]]['refcount'] == 1
+
+    # deleting datasets releases the stored files rather than removing them
+    api.delete(datasets)
+    assert os.path.exists(metadata[datasets[0]]['file_path'])
+    assert {e['refcount'] for e in util.download_cache.get_download_cache_entries()} == {0}
+
+
+def test_download_datasets_with_cache_releases_on_failed_update(api, synthetic_provider, monkeypatch):
+    catalog_entries = api.search_catalog('svc://synthetic:points')[:1]
+    datasets = api.add_datasets('col1', catalog_entries)
+    api.stage_for_download(datasets, options={'parameter': 'streamflow'})
+
+    monkeypatch.setattr('quest.api.datasets.update_datasets', lambda updates: {name: 'error' for name in updates})
+    api.download_datasets(datasets, use_cache=True)
+    assert [e['refcount'] for e in util.download_cache.get_download_cache_entries()] == [0]
+
+
+def test_delete_project_releases_downloads(api, synthetic_provider):
+    catalog_entries = api.search_catalog('svc://synthetic:points')[:2]
+    options = {'parameter': 'streamflow'}
+
+    api.set_active_project('project1')
+    try:
+        api.new_collection('col1', exists_ok=True)
+        datasets = api.add_datasets('col1', catalog_entries)
+        api.download_datasets(datasets, options=options, use_cache=True)
+        file_paths = [m['file_path'] for m in api.get_metadata(datasets).values()]
+    finally:
+        api.set_active_project(ACTIVE_PROJECT)
+
+    assert {e['refcount'] for e in util.download_cache.get_download_cache_entries()} == {1}
+
+    api.delete_project('project1')
+    assert {e['refcount'] for e in util.download_cache.get_download_cache_entries()} == {0}
+
+    evicted = util.download_cache.evict(max_size=0)
+    assert len(evicted) == 2
+    assert util.download_cache.get_download_cache_entries() == []
+    assert not any(os.path.exists(file_path) for file_path in file_paths)
+
+
 def test_describe_dataset(api):
     pass
 
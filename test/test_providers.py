@@ -40,3 +40,15 @@ def test_download(api, catalog_entry, options):
     api.stage_for_download(d, options=options)
     result = api.download_datasets(d, raise_on_error=True)
     assert result[d] == DatasetStatus.DOWNLOADED
+
+
+def test_nwis_bbox_tiles():
+    from quest_provider_plugins.usgs_nwis import _bbox_tiles
+
+    assert _bbox_tiles([-100, 30, -90, 35]) == [
+        '-100.0000000,30.0000000,-95.0000000,35.0000000',
+        '-95.0000000,30.0000000,-90.0000000,35.0000000',
+    ]
+    # a bbox without width or height still queries the sites on it
+    assert _bbox_tiles([-95, 30, -95, 30]) == ['-95.0000000,30.0000000,-95.0000000,30.0000000']
+    assert _bbox_tiles([-100, 30, -95, 30]) == ['-100.0000000,30.0000000,-95.0000000,30.0000000']
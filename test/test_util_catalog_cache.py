@@ -0,0 +1,289 @@
+import os
+import tempfile
+
+import pytest
+import numpy as np
+import quest
+import pandas as pd
+from shapely.geometry import Point, box
+
+from quest.util import catalog_cache
+
+
+@pytest.fixture
+def cache_file(request):
+    folder_obj = tempfile.TemporaryDirectory()
+    request.addfinalizer(folder_obj.cleanup)
+
+    catalog_entries = pd.DataFrame({
+        'service_id': ['c', 'a', 'b', 'd'],
+        'display_name': ['C', 'A', 'B', 'D'],
+        'description': ['', '', '', ''],
+        'geometry': [Point(-95, 30), Point(170, 10), box(-179, -5, -175, 5), None],
+        'parameters': ['streamflow', 'streamflow,gage_height', '', ''],
+        'metadata': [{'state': 'TX'}, {'state': 'HI'}, {'state': None}, {}],
+    })
+
+    path = catalog_cache.catalog_cache_file(folder_obj.name, 'test')
+    catalog_cache.write_catalog(catalog_entries, path)
+
+    return path
+
+
+def test_write_read_catalog(cache_file):
+    assert os.path.basename(cache_file) == 'test_catalog.parquet'
+
+    actual = catalog_cache.read_catalog(cache_file)
+    assert actual['service_id'].tolist() == ['a', 'b', 'c', 'd']
+    assert actual['metadata'].tolist() == [{'state': 'HI'}, {'state': None}, {'state': 'TX'}, {}]
+    assert actual['geometry'][2].equals(Point(-95, 30))
+    assert actual['geometry'][3] is None
+    assert 'xmin' not in actual.columns
+
+
+def test_read_catalog_columns(cache_file):
+    actual = catalog_cache.read_catalog(cache_file, columns=['display_name'])
+    assert sorted(actual.columns) == ['display_name', 'service_id']
+
+
+def test_read_catalog_service_ids(cache_file):
+    actual = catalog_cache.read_catalog(cache_file, service_ids=['d', 'b', 'x'])
+    assert actual['service_id'].tolist() == ['b', 'd']
+
+
+def test_read_catalog_bbox(cache_file):
+    actual = catalog_cache.read_catalog(cache_file, bbox=[-100, 25, -90, 35])
+    assert actual['service_id'].tolist() == ['c']
+
+    # bbox spanning the 180 degree meridian
+    actual = catalog_cache.read_catalog(cache_file, bbox='160,-20,200,20')
+    assert actual['service_id'].tolist() == ['a', 'b']
+
+
+def test_read_metadata(request):
+    folder_obj = tempfile.TemporaryDirectory()
+    request.addfinalizer(folder_obj.cleanup)
+
+    catalog_entries = pd.DataFrame({'service_id': ['b', 'a'], 'geometry': [None, Point(0, 0)]})
+    metadata = pd.DataFrame({
+        'service_id': ['b', 'a'],
+        'elevation': [1.5, None],
+        'state': ['TX', None],
+        'location': [{'county': 'Travis'}, None],
+    })
+    path = catalog_cache.catalog_cache_file(folder_obj.name, 'test')
+    catalog_cache.write_catalog(catalog_entries, path, metadata=metadata)
+    assert os.path.exists(catalog_cache.metadata_cache_file(path))
+
+    actual = catalog_cache.read_metadata(path)
+    assert actual['service_id'].tolist() == ['a', 'b']
+    assert actual['elevation'].dtype == float
+    assert actual['location'].tolist() == [None, {'county': 'Travis'}]
+
+    actual = catalog_cache.read_metadata(path, columns=['state', 'missing'], service_ids=['b'])
+    assert actual.to_dict(orient='records') == [{'service_id': 'b', 'state': 'TX'}]
+
+    actual = catalog_cache.metadata_to_records(catalog_cache.read_metadata(path).drop('service_id', axis=1))
+    assert actual == [
+        {'elevation': None, 'state': None, 'location': None},
+        {'elevation': 1.5, 'state': 'TX', 'location': {'county': 'Travis'}},
+    ]
+
+
+def test_memoized_catalog(cache_file):
+    catalog_cache.clear_memory_cache()
+    info = catalog_cache.memory_cache_info()
+
+    assert catalog_cache.get_memoized_catalog('provider', 'test', cache_file) is None
+
+    mtime = catalog_cache.catalog_mtime(cache_file)
+    catalog_entries = catalog_cache.read_catalog(cache_file)
+    assert not catalog_cache.is_memoized('provider', 'test', cache_file)
+    catalog_cache.memoize_catalog('provider', 'test', cache_file, catalog_entries, mtime)
+    assert catalog_cache.is_memoized('provider', 'test', cache_file)
+    actual = catalog_cache.get_memoized_catalog('provider', 'test', cache_file)
+    assert actual['service_id'].tolist() == catalog_entries['service_id'].tolist()
+    assert actual is not catalog_entries
+
+    # rewriting the cache file invalidates the memoized catalog
+    catalog_cache.write_catalog(catalog_entries.iloc[:2], cache_file)
+    os.utime(cache_file, ns=(0, 0))
+    assert not catalog_cache.is_memoized('provider', 'test', cache_file)
+    assert catalog_cache.get_memoized_catalog('provider', 'test', cache_file) is None
+
+    actual = catalog_cache.memory_cache_info()
+    assert actual['hits'] - info['hits'] == 1
+    assert actual['misses'] - info['misses'] == 2
+    assert actual['size'] == 0
+
+
+def test_memoized_catalog_rewritten_while_read(cache_file):
+    catalog_cache.clear_memory_cache()
+    mtime = catalog_cache.catalog_mtime(cache_file)
+    catalog_entries = catalog_cache.read_catalog(cache_file)
+    catalog_cache._load_spatial_index.cache_clear()
+
+    # the cache file is replaced after it was read but before the catalog is memoized
+    catalog_cache.write_catalog(catalog_entries.iloc[::-1], cache_file)
+    os.utime(cache_file, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    catalog_cache.memoize_catalog('provider', 'test', cache_file, catalog_entries, mtime)
+    assert catalog_cache.get_memoized_catalog('provider', 'test', cache_file, bbox='160,-20,200,20') is None
+
+    # the spatial index of the new version is not applied to the old version
+    assert catalog_cache.query_spatial_index(cache_file, '160,-20,200,20', mtime=mtime) is None
+    assert catalog_cache.query_spatial_index(cache_file, '160,-20,200,20') is not None
+
+
+def test_memoized_catalog_lru(cache_file):
+    catalog_cache.clear_memory_cache()
+    catalog_entries = catalog_cache.read_catalog(cache_file)
+    quest.api.update_settings({'CATALOG_MEMORY_CACHE_SIZE': 2})
+    try:
+        for service in ['a', 'b', 'c']:
+            catalog_cache.memoize_catalog('provider', service, cache_file, catalog_entries,
+                                          catalog_cache.catalog_mtime(cache_file))
+
+        assert catalog_cache.memory_cache_info()['size'] == 2
+        assert catalog_cache.get_memoized_catalog('provider', 'a', cache_file) is None
+        assert catalog_cache.get_memoized_catalog('provider', 'c', cache_file) is not None
+    finally:
+        del quest.api.get_settings()['CATALOG_MEMORY_CACHE_SIZE']
+
+
+def test_spatial_index(request):
+    folder_obj = tempfile.TemporaryDirectory()
+    request.addfinalizer(folder_obj.cleanup)
+
+    rng = np.random.RandomState(0)
+    xy = np.column_stack([rng.uniform(-180, 170, 1000), rng.uniform(-90, 80, 1000)])
+    bounds = np.hstack([xy, xy + rng.uniform(0, 10, (1000, 2))])
+    bounds[::10] = np.nan
+
+    path = os.path.join(folder_obj.name, 'sindex.npz')
+    catalog_cache.SpatialIndex(bounds, node_size=4).save(path)
+    index = catalog_cache.SpatialIndex.load(path)
+    assert len(index) == 900
+
+    for bbox in [(-100, 20, -80, 40), (160, -20, 200, 20), (-180, -90, 180, 90), (0, 0, 0, 0)]:
+        expected = set()
+        for xmin, ymin, xmax, ymax in catalog_cache._split_bbox(bbox):
+            idx = (bounds[:, 2] >= xmin) & (bounds[:, 0] <= xmax) & (bounds[:, 3] >= ymin) & (bounds[:, 1] <= ymax)
+            expected.update(np.where(idx)[0])
+        assert index.query(bbox).tolist() == sorted(expected)
+
+
+def test_query_spatial_index(cache_file):
+    assert os.path.exists(catalog_cache.spatial_index_file(cache_file))
+    assert catalog_cache.query_spatial_index(cache_file, '160,-20,200,20').tolist() == [0, 1]
+    assert catalog_cache.query_spatial_index(cache_file + '.missing', '160,-20,200,20') is None
+
+
+def test_id_index(cache_file):
+    index_file = catalog_cache.id_index_file(cache_file)
+    assert os.path.exists(index_file)
+
+    index = catalog_cache.get_id_index(cache_file)
+    assert len(index) == 4
+    assert index.lookup(['d', 'a', 'x']).tolist() == [0, 3]
+    assert index.lookup([]).tolist() == []
+
+    # rows of ids that share a hash are returned, but not read
+    collisions = catalog_cache.IdIndex(np.repeat(catalog_cache._hash_ids(['b']), 4), np.arange(4))
+    assert collisions.lookup(['b']).tolist() == [0, 1, 2, 3]
+    collisions.save(index_file)
+    catalog_cache._load_id_index.cache_clear()
+    assert catalog_cache.read_catalog(cache_file, service_ids=['b'])['service_id'].tolist() == ['b']
+
+    # indexes that are missing are rebuilt
+    os.remove(index_file)
+    catalog_cache._load_id_index.cache_clear()
+    actual = catalog_cache.read_catalog(cache_file, service_ids=['c'], columns=['display_name'])
+    assert actual['display_name'].tolist() == ['C']
+    assert os.path.exists(index_file)
+
+
+def test_catalog_writer(request):
+    folder_obj = tempfile.TemporaryDirectory()
+    request.addfinalizer(folder_obj.cleanup)
+    path = catalog_cache.catalog_cache_file(folder_obj.name, 'test')
+
+    service_ids = np.random.RandomState(0).permutation(2500).astype(str)
+    with catalog_cache.CatalogWriter(path) as writer:
+        for i, chunk in enumerate(np.array_split(service_ids, 5)):
+            n = len(chunk)
+            writer.write(pd.DataFrame({
+                'service_id': chunk,
+                'geometry': [Point(int(s) % 10, 0) for s in chunk],
+                'parameters': pd.Categorical(['streamflow'] * n if i % 2 else ['gage_height'] * n),
+            }), metadata=pd.DataFrame({
+                'service_id': chunk,
+                # columns and types that differ between chunks
+                'count': np.arange(n) if i % 2 else np.arange(n) + 0.5,
+                'location': [{'state': 'TX'}] * n if i == 3 else ['TX'] * n,
+                'extra_{}'.format(i % 2): 1,
+            }))
+
+    actual = catalog_cache.read_catalog(path)
+    assert actual['service_id'].tolist() == sorted(service_ids)
+    assert actual['parameters'].value_counts().to_dict() == {'gage_height': 1500, 'streamflow': 1000}
+    assert catalog_cache.read_catalog(path, bbox=[0.5, -1, 1.5, 1])['service_id'].str.endswith('1').all()
+    assert catalog_cache.query_spatial_index(path, [0.5, -1, 1.5, 1]) is not None
+    # temporary files are removed
+    assert not [f for f in os.listdir(folder_obj.name) if 'tmp' in f]
+
+    metadata = catalog_cache.read_metadata(path, service_ids=['7', '1234'])
+    assert metadata['service_id'].tolist() == ['1234', '7']
+    assert metadata['count'].dtype == float
+    columns = sorted(catalog_cache.read_metadata(path).columns)
+    assert columns == ['count', 'extra_0', 'extra_1', 'location', 'service_id']
+    locations = catalog_cache.read_metadata(path)['location']
+    assert locations.map(lambda x: x == 'TX' or x == {'state': 'TX'}).all()
+
+    # a failed write leaves the cache in place
+    with pytest.raises(ValueError):
+        with catalog_cache.CatalogWriter(path) as writer:
+            writer.write(pd.DataFrame({'service_id': ['x'], 'geometry': [None]}))
+            raise ValueError()
+    assert len(catalog_cache.read_catalog(path)) == 2500
+
+
+def test_catalog_writer_empty(request):
+    folder_obj = tempfile.TemporaryDirectory()
+    request.addfinalizer(folder_obj.cleanup)
+    path = catalog_cache.catalog_cache_file(folder_obj.name, 'test')
+
+    with catalog_cache.CatalogWriter(path):
+        pass
+
+    actual = catalog_cache.read_catalog(path)
+    assert actual.empty and list(actual.columns) == ['service_id', 'display_name', 'description', 'geometry']
+    assert catalog_cache.read_catalog(path, service_ids=['a']).empty
+    assert catalog_cache.read_metadata(path, service_ids=['a']).empty
+    assert catalog_cache.query_spatial_index(path, [0, 0, 1, 1]).tolist() == []
+
+
+def test_geometry_tiers(request):
+    folder_obj = tempfile.TemporaryDirectory()
+    request.addfinalizer(folder_obj.cleanup)
+    path = catalog_cache.catalog_cache_file(folder_obj.name, 'test')
+
+    circle = Point(0, 0).buffer(1, 64)
+    with catalog_cache.CatalogWriter(path) as writer:
+        writer.write(pd.DataFrame({'service_id': ['a'], 'geometry': [circle]}))
+        # chunks of points have nothing to simplify
+        writer.write(pd.DataFrame({'service_id': ['b'], 'geometry': [Point(1, 1)]}))
+
+    tiers = catalog_cache.get_geometry_tiers(path)
+    assert tiers == {catalog_cache.geometry_tier_column(t): t for t in catalog_cache.GEOMETRY_TOLERANCES}
+    assert list(catalog_cache.read_catalog(path).columns) == ['service_id', 'geometry']
+
+    actual = catalog_cache.read_catalog(path, tolerance=0.05)
+    assert len(actual['geometry'][0].exterior.coords) < len(circle.exterior.coords)
+    assert actual['geometry'][0].hausdorff_distance(circle) <= 0.01
+    assert actual['geometry'][1].equals(Point(1, 1))
+    assert catalog_cache.read_catalog(path, tolerance=0.0001)['geometry'][0].equals(circle)
+
+    geometries = catalog_cache.read_geometries(path, 0.5)
+    assert geometries.index.tolist() == ['a', 'b']
+    assert geometries['a'].hausdorff_distance(circle) <= 0.1
+    assert catalog_cache.read_geometries(path, 0.0001) is None
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from quest.util import download_cache
+
+
+@pytest.fixture
+def cache_dir(api, reset_settings, tmpdir):
+    api.update_settings({'CACHE_DIR': str(tmpdir.join('cache'))})
+    return str(tmpdir.join('cache'))
+
+
+def write_download(folder, name, size=10):
+    path = os.path.join(str(folder), name, '{}.csv'.format(name))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('x' * size)
+    return {'file_path': path, 'file_format': 'csv', 'metadata': {'site': name}}
+
+
+def test_download_key():
+    key = download_cache.download_key('svc://a:x/1', {'start': '2018-01-01', 'parameter': 'streamflow'})
+    assert key == download_cache.download_key('svc://a:x/1', {'parameter': 'streamflow', 'start': '2018-01-01'})
+    assert key != download_cache.download_key('svc://a:x/2', {'parameter': 'streamflow', 'start': '2018-01-01'})
+    assert download_cache.download_key('svc://a:x/1', None) == download_cache.download_key('svc://a:x/1', {})
+
+
+def test_store_and_acquire(cache_dir, tmpdir):
+    key = download_cache.download_key('svc://a:x/1', {'parameter': 'streamflow'})
+    assert download_cache.acquire(key) is None
+
+    metadata = write_download(tmpdir.join('project1'), 'd1')
+    stored_path = download_cache.store(key, 'svc://a:x/1', {'parameter': 'streamflow'}, metadata)
+    assert stored_path.startswith(download_cache.download_cache_dir())
+    assert os.path.exists(stored_path) and not os.path.exists(metadata['file_path'])
+
+    actual = download_cache.acquire(key)
+    assert actual == {'file_path': stored_path, 'file_format': 'csv', 'metadata': {'site': 'd1'}}
+
+    # a second download of the same data (i.e. in another process) is replaced by the stored file
+    metadata = write_download(tmpdir.join('project2'), 'd2')
+    assert download_cache.store(key, 'svc://a:x/1', {'parameter': 'streamflow'}, metadata) == stored_path
+    assert not os.path.exists(metadata['file_path'])
+
+    entries = download_cache.get_download_cache_entries()
+    assert [(e['key'], e['refcount'], e['size']) for e in entries] == [(key, 3, 10)]
+
+    # downloads without a file are not stored
+    assert download_cache.store(key, 'svc://a:x/1', {}, {'file_path': None}) is None
+
+    # stored files that were removed are downloaded again
+    os.remove(stored_path)
+    assert download_cache.acquire(key) is None
+    assert download_cache.get_download_cache_entries() == []
+
+
+def test_store_folder(cache_dir, tmpdir):
+    key = download_cache.download_key('svc://a:x/1', {})
+    metadata = write_download(tmpdir.join('project1'), 'd1')
+    folder = os.path.dirname(metadata['file_path'])
+    with open(os.path.join(folder, 'd1.prj'), 'w') as f:
+        f.write('x' * 5)
+
+    stored_path = download_cache.store(key, 'svc://a:x/1', {}, metadata, folder=folder)
+    assert os.path.basename(stored_path) == 'd1.csv'
+    assert os.path.exists(os.path.join(os.path.dirname(stored_path), 'd1.prj'))
+    assert not os.path.exists(folder)
+    assert download_cache.get_download_cache_entries()[0]['size'] == 15
+
+    download_cache.release([key])
+    assert download_cache.evict(max_size=0) == [key]
+    assert not os.path.exists(os.path.dirname(stored_path))
+
+
+def test_release_and_evict(api, cache_dir, tmpdir):
+    keys = [download_cache.download_key('svc://a:x/{}'.format(i), {}) for i in range(3)]
+    paths = [download_cache.store(key, 'svc://a:x/{}'.format(i), {}, write_download(tmpdir, 'd{}'.format(i)))
+             for i, key in enumerate(keys)]
+
+    # unreferenced downloads are kept until the cache is full
+    download_cache.release(keys[:2])
+    assert all(os.path.exists(path) for path in paths)
+    assert [e['refcount'] for e in download_cache.get_download_cache_entries()] == [1, 0, 0]
+
+    # the least recently used unreferenced downloads are evicted first
+    download_cache.acquire(keys[0])
+    download_cache.release(keys[:1])
+    assert download_cache.evict(max_size=20) == [keys[1]]
+    assert not os.path.exists(paths[1])
+
+    # downloads that are referenced are never evicted
+    api.update_settings({'DOWNLOAD_CACHE_SIZE': 0})
+    try:
+        download_cache.release([keys[0], None])
+        assert not os.path.exists(paths[0])
+        assert [e['key'] for e in download_cache.get_download_cache_entries()] == [keys[2]]
+        assert os.path.exists(paths[2])
+    finally:
+        api.get_settings().pop('DOWNLOAD_CACHE_SIZE')
@@ -0,0 +1,59 @@
+import json
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Point, box
+
+from quest.util import geojson_encoder, to_json_default_handler
+
+
+def catalog_entries():
+    return gpd.GeoDataFrame({
+        'display_name': ['A', None, 'C'],
+        'elevation': [1.5, np.nan, 2.0],
+        'count': [1, 2, 3],
+        'parameters': pd.Categorical(['streamflow', 'streamflow', None]),
+        'metadata': [{'state': 'TX'}, {}, None],
+        'updated': pd.to_datetime(['2020-01-01', None, '2021-06-01']),
+        'geometry': [Point(-95.123456789, 30.5), box(0, 0, 1, 1), None],
+    }, index=['svc://p:s/a', 'svc://p:s/b', 'svc://p:s/c'])
+
+
+def test_write_geojson():
+    df = catalog_entries()
+    expected = json.loads(df.to_json(default=to_json_default_handler))
+    assert json.loads(geojson_encoder.write_geojson(df)) == expected
+    assert json.loads(geojson_encoder.write_geojson(df, chunksize=2)) == expected
+    assert json.loads(geojson_encoder.write_geojson(df.iloc[:0])) == {'type': 'FeatureCollection', 'features': []}
+
+    # WKT geometries
+    wkt = pd.DataFrame(df).assign(geometry=[g.wkt if g is not None else None for g in df.geometry])
+    assert json.loads(geojson_encoder.write_geojson(wkt)) == expected
+
+
+def test_write_geojson_precision(tmpdir):
+    df = catalog_entries()
+    actual = geojson_encoder.write_geojson(df, precision=3, compact=True)
+    assert b', ' not in actual
+    actual = json.loads(actual)
+    assert actual['features'][0]['geometry']['coordinates'] == [-95.123, 30.5]
+
+    path = str(tmpdir.join('catalog.geojson'))
+    geojson_encoder.write_geojson(df, path, precision=3, compact=True)
+    with open(path) as f:
+        assert json.load(f) == actual
+
+
+def test_write_geojson_nullable_dtypes():
+    df = pd.DataFrame({
+        'count': pd.array([1, None, 3], dtype='Int64'),
+        'active': pd.array([True, None, False], dtype='boolean'),
+        'name': pd.array(['a', None, 'c'], dtype='string'),
+    }, index=['a', 'b', 'c'])
+    features = json.loads(geojson_encoder.write_geojson(df))['features']
+    assert [f['properties'] for f in features] == [
+        {'count': 1, 'active': True, 'name': 'a'},
+        {'count': None, 'active': None, 'name': None},
+        {'count': 3, 'active': False, 'name': 'c'},
+    ]
@@ -0,0 +1,59 @@
+import os
+
+import pandas as pd
+from shapely.geometry import Point
+
+from quest.util import catalog_cache, global_index
+
+
+def write_cache(folder, service, points, parameters):
+    catalog_entries = pd.DataFrame({
+        'service_id': [str(i) for i in range(len(points))],
+        'geometry': [Point(*p) for p in points],
+        'parameters': parameters,
+    })
+    path = catalog_cache.catalog_cache_file(str(folder), service)
+    catalog_cache.write_catalog(catalog_entries, path, metadata=catalog_entries[['service_id']])
+    return path
+
+
+def test_global_index(tmpdir):
+    cache_files = {
+        'svc://a:x': write_cache(tmpdir, 'x', [(0, 0), (10, 10)], ['streamflow', 'gage_height']),
+        'svc://b:y': write_cache(tmpdir, 'y', [(1, 1), (50, 50)], ['streamflow,gage_height', '']),
+    }
+    path = global_index.global_index_file(str(tmpdir))
+
+    index = global_index.update_global_index(cache_files, path=path)
+    assert os.path.exists(path)
+    assert index[['service', 'service_id']].values.tolist() == [
+        ['svc://a:x', '0'], ['svc://a:x', '1'], ['svc://b:y', '0'], ['svc://b:y', '1']]
+
+    actual = global_index.query_global_index(index, bbox=[-5, -5, 5, 5], parameter='streamflow', path=path)
+    assert actual[['service', 'service_id']].values.tolist() == [['svc://a:x', '0'], ['svc://b:y', '0']]
+    actual = global_index.query_global_index(index, parameter='gage_height', services=['svc://b:y'], path=path)
+    assert actual['service_id'].tolist() == ['0']
+
+    # only changed catalogs are read again, and removed catalogs are dropped
+    cache_files['svc://a:x'] = write_cache(tmpdir, 'x', [(0, 0)], ['streamflow'])
+    os.utime(cache_files['svc://a:x'], ns=(1, 1))
+    del cache_files['svc://b:y']
+    index = global_index.update_global_index(cache_files, path=path)
+    assert index[['service', 'service_id']].values.tolist() == [['svc://a:x', '0']]
+    # unchanged catalogs aren't read at all
+    index = global_index.update_global_index(cache_files, path=path)
+    assert global_index.update_global_index(cache_files, path=path) is index
+
+
+def test_query_global_index_stale_frame(tmpdir):
+    cache_files = {'svc://a:x': write_cache(tmpdir, 'x', [(0, 0), (10, 10)], ['streamflow', 'streamflow'])}
+    path = global_index.global_index_file(str(tmpdir))
+    index = global_index.update_global_index(cache_files, path=path)
+
+    # the index file is rewritten after the frame was loaded, so its spatial index no longer matches the frame
+    cache_files['svc://a:x'] = write_cache(tmpdir, 'x', [(10, 10), (20, 20), (0, 0)], ['streamflow'] * 3)
+    os.utime(cache_files['svc://a:x'], ns=(1, 1))
+    assert len(global_index.update_global_index(cache_files, path=path)) == 3
+
+    actual = global_index.query_global_index(index, bbox=[-5, -5, 5, 5], path=path)
+    assert actual['service_id'].tolist() == ['0']
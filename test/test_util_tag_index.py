@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from quest.util import tag_index
+
+
+def metadata():
+    return pd.DataFrame({
+        'service_id': ['a', 'b', 'c', 'd'],
+        'state': ['TX', 'TX', None, 'LA'],
+        'elevation': [1.0, np.nan, 1.0, 2.0],
+        'site': [{'county': 'Travis', 'networks': ['x', 'y']}, {'county': 'Travis'}, None, {'county': 'Harris'}],
+        'location': [1, 2, 3, 4],
+    })
+
+
+def test_build_tag_index():
+    index = tag_index.build_tag_index(metadata())
+    assert 'location' not in index.tag.values
+    assert tag_index.tags_to_dict(index) == {
+        'elevation': [1.0, 2.0, None],
+        'site': [None],
+        'site:county': ['Travis', 'Harris'],
+        'site:networks': ['x', 'y'],
+        'state': ['TX', 'LA', None],
+    }
+    assert tag_index.tags_to_dict(index, as_count=True)['state'] == {'TX': 2, 'LA': 1, None: 1}
+
+
+def test_update_tag_index():
+    df = metadata()
+    index = tag_index.build_tag_index(df)
+
+    updated = df.iloc[:2].assign(state=['LA', 'MS'])
+    actual = tag_index.update_tag_index(index, removed=df.iloc[:2], added=updated)
+    expected = tag_index.build_tag_index(pd.concat([df.iloc[2:], updated]))
+    pd.testing.assert_frame_equal(actual, expected)
+    assert tag_index.tags_to_dict(actual, as_count=True)['state'] == {'LA': 2, 'MS': 1, None: 1}
@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+
+from quest.util import text_index
+
+
+def test_tokenize():
+    assert text_index.tokenize('Gage Height, ft (USGS-01516350)') == ['gage', 'height', 'ft', 'usgs', '01516350']
+
+
+def test_token_index():
+    catalog_entries = pd.DataFrame({
+        'service_id': ['a', 'b', 'c'],
+        'display_name': ['Susquehanna River at Towanda', 'New York Harbor', None],
+        'geometry': ['POINT (1 2)', None, None],
+        'state': ['PA', 'NY', 'TX'],
+    })
+    index = text_index.TokenIndex.build(catalog_entries)
+    assert len(index) == 3
+    assert 'point' not in index.vocabulary
+    assert list(index.vocabulary) == sorted(index.vocabulary)
+
+    assert index.service_ids[index.candidates('york')].tolist() == ['b']
+    # candidates are a superset of entries containing the term
+    assert index.service_ids[index.candidates('A')].tolist() == ['a', 'b']
+    assert 'none' not in index.vocabulary
+    assert index.service_ids[index.candidates('ork Harb')].tolist() == ['b']
+    assert index.candidates('Harbour').tolist() == []
+    # terms without tokens and regular expressions can't be answered by the index
+    assert index.candidates(', ') is None
+    assert index.candidates('PA|NY') is None
+
+
+def test_token_index_search(tmpdir):
+    catalog_entries = pd.DataFrame({
+        'service_id': ['a', 'b', 'c'],
+        'display_name': ['Gage on Mill Creek', 'Millbrook', 'Rain gage'],
+        'description': ['Creek gage', '', None],
+        'state': ['VA', 'NY', 'VA'],
+    })
+    index = text_index.TokenIndex.build(catalog_entries)
+
+    rows, scores = index.search('gage')
+    assert index.service_ids[rows].tolist() == ['a', 'c']
+    # tokens in the display_name and description add up
+    assert scores[0] > scores[1]
+
+    rows, _ = index.search('mill')
+    assert index.service_ids[rows].tolist() == ['a', 'b']
+    rows, _ = index.search('mill', prefix=False)
+    assert index.service_ids[rows].tolist() == ['a']
+
+    rows, _ = index.search(['gage', 'va'])
+    assert index.service_ids[rows].tolist() == ['a', 'c']
+    rows, _ = index.search(['rain', 'ny'])
+    assert index.service_ids[rows].tolist() == []
+    rows, _ = index.search(['rain', 'ny'], match_all=False)
+    assert index.service_ids[rows].tolist() == ['b', 'c']
+    assert len(index.search(', ')[0]) == 0
+
+    path = str(tmpdir.join('index.npz'))
+    index.save(path)
+    loaded = text_index.TokenIndex.load(path)
+    assert loaded.service_ids.tolist() == index.service_ids.tolist()
+    assert loaded.vocabulary.tolist() == index.vocabulary.tolist()
+    assert loaded.search('gage')[1].tolist() == scores.tolist()
+
+
+@pytest.mark.parametrize('service_ids', [[''], ['a\nb', 'c'], ['', 'é', '\n'], []])
+def test_token_index_save_service_ids(tmpdir, service_ids):
+    catalog_entries = pd.DataFrame({'service_id': service_ids, 'display_name': ['Site'] * len(service_ids)})
+    path = str(tmpdir.join('index.npz'))
+    text_index.TokenIndex.build(catalog_entries).save(path)
+
+    loaded = text_index.TokenIndex.load(path)
+    assert loaded.service_ids.tolist() == service_ids
+    assert loaded.service_ids[loaded.candidates('site')].tolist() == service_ids
+
+
+def test_token_index_concat():
+    catalog_entries = pd.DataFrame({
+        'service_id': ['a', 'b', 'c', 'd'],
+        'display_name': ['Red River', 'Blue Lake', 'Red Lake', 'Green River'],
+        'state': ['TX', 'MN', 'MN', None],
+    })
+    expected = text_index.TokenIndex.build(catalog_entries)
+    actual = text_index.TokenIndex.concat([
+        text_index.TokenIndex.build(catalog_entries.iloc[:1]),
+        text_index.TokenIndex.build(catalog_entries.iloc[1:]),
+    ])
+
+    assert actual.service_ids.tolist() == expected.service_ids.tolist()
+    assert actual.vocabulary.tolist() == expected.vocabulary.tolist()
+    assert actual.offsets.tolist() == expected.offsets.tolist()
+    assert actual.postings.tolist() == expected.postings.tolist()
+    assert actual.weights.tolist() == expected.weights.tolist()